@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "quran_center.middleware.UserRolesMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -83,12 +85,99 @@ WSGI_APPLICATION = "myproject.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE=django.db.backends.postgresql (set by docker-compose) switches to
+# PostgreSQL with the DB_* variables; otherwise the SQLite file at SQLITE_PATH
+# is used. `manage.py copy_sqlite_data` moves an existing SQLite database over.
+DB_ENGINE = os.getenv("DB_ENGINE", "django.db.backends.sqlite3")
+
+if DB_ENGINE == "django.db.backends.postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": DB_ENGINE,
+            "NAME": os.getenv("DB_NAME", "tahfeed_db"),
+            "USER": os.getenv("DB_USER", "tahfeed_user"),
+            "PASSWORD": os.getenv("DB_PASSWORD", ""),
+            "HOST": os.getenv("DB_HOST", "localhost"),
+            "PORT": os.getenv("DB_PORT", "5432"),
+            # Each gunicorn worker keeps its connection for DB_CONN_MAX_AGE seconds
+            # (0 closes it after every request) and checks it before reuse.
+            "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": os.getenv("DB_CONN_HEALTH_CHECKS", "True").lower() == "true",
+            # Exports stream rows with .iterator(), which uses server-side cursors.
+            # Disable them behind a transaction-pooling pgbouncer.
+            "DISABLE_SERVER_SIDE_CURSORS": os.getenv("DB_DISABLE_SERVER_SIDE_CURSORS", "False").lower() == "true",
+            "OPTIONS": {"connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10"))},
+        }
     }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", str(BASE_DIR / "db.sqlite3")),
+            # Writers take the lock at BEGIN, so a busy database waits (busy_timeout)
+            # instead of failing halfway through a transaction.
+            "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+            # A file-backed test database lets concurrency tests use several
+            # connections; the shared in-memory database fails them with table locks.
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+        }
+    }
+
+# Applied to every new SQLite connection (quran_center.sqlite_tuning). WAL lets
+# readers run while a teacher's attendance is being written.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-20000")),  # negative = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
 }
+# Attendance saves still locked out after busy_timeout are retried this many
+# times in total, waiting RETRY_BACKOFF seconds, doubled on each retry.
+SQLITE_WRITE_ATTEMPTS = int(os.getenv("SQLITE_WRITE_ATTEMPTS", "5"))
+SQLITE_WRITE_RETRY_BACKOFF = float(os.getenv("SQLITE_WRITE_RETRY_BACKOFF", "0.05"))
+
+
+# Cache
+# Role lookups, admin statistics and parent inquiries are cached across
+# requests and dropped on change, so the cache must be shared by every gunicorn
+# worker (and by run_sms_worker, for the SMS circuit breakers). Redis when
+# REDIS_URL is set (docker-compose, Heroku Redis), otherwise files under
+# BASE_DIR, which all processes on the host (and PythonAnywhere tasks) share.
+# A per-process backend such as LocMemCache is only safe with a single process.
+
+if os.getenv("CACHE_BACKEND"):
+    CACHES = {
+        "default": {
+            "BACKEND": os.getenv("CACHE_BACKEND"),
+            "LOCATION": os.getenv("CACHE_LOCATION", "quran-center"),
+        }
+    }
+elif os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("CACHE_LOCATION", str(BASE_DIR / "cache")),
+            "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "2000"))},
+        }
+    }
+
+ROLE_CACHE_TIMEOUT = int(os.getenv("ROLE_CACHE_TIMEOUT", "300"))
+# Each process keeps the academic calendar in memory. Edits reach other
+# processes through a stamp read from the calendar table (not this cache), at
+# most this many seconds later.
+ACADEMIC_CALENDAR_CHECK_SECONDS = int(os.getenv("ACADEMIC_CALENDAR_CHECK_SECONDS", "60"))
+# Admin statistics snapshots are dropped for every process (shared cache) as
+# soon as students, attendance or exam nominations change.
+ADMIN_STATISTICS_CACHE_TIMEOUT = int(os.getenv("ADMIN_STATISTICS_CACHE_TIMEOUT", "600"))
 
 
 # Password validation
@@ -158,4 +247,59 @@ SMS_PHONE_FIELD = os.getenv('SMS_PHONE_FIELD', 'dests')
 SMS_MESSAGE_FIELD = os.getenv('SMS_MESSAGE_FIELD', 'body')
 SMS_SENDER_FIELD = os.getenv('SMS_SENDER_FIELD', 'src')
 SMS_PHONE_IS_ARRAY = os.getenv('SMS_PHONE_IS_ARRAY', 'True').lower() == 'true'
+# Parallel requests per batch, and the most messages started per second (0 = no limit).
+SMS_CONCURRENCY = int(os.getenv('SMS_CONCURRENCY', '8'))
+SMS_RATE_LIMIT = float(os.getenv('SMS_RATE_LIMIT', '0'))
+# Identical texts go out as one request with up to SMS_MAX_RECIPIENTS phones
+# (needs SMS_PHONE_IS_ARRAY). Optional response fields that list accepted or
+# rejected phones give per-phone results.
+SMS_MAX_RECIPIENTS = int(os.getenv('SMS_MAX_RECIPIENTS', '100'))
+SMS_ACCEPTED_FIELD = os.getenv('SMS_ACCEPTED_FIELD', '')
+SMS_REJECTED_FIELD = os.getenv('SMS_REJECTED_FIELD', '')
+# Price of one SMS segment, used for the batch cost estimate (0 hides the cost).
+SMS_SEGMENT_COST = float(os.getenv('SMS_SEGMENT_COST', '0'))
+# Optional failover list, tried in order. Each entry takes the provider options
+# (name, url, api_key, phone_field, message_field, sender_field, sender_id,
+# phone_is_array, auth_header, auth_scheme, timeout, max_recipients, ...).
+# Empty means the single provider configured by the SMS_* settings above.
+SMS_PROVIDERS = json.loads(os.getenv('SMS_PROVIDERS', '[]'))
+# A provider is skipped after this many consecutive failures, and probed again
+# with one request after SMS_BREAKER_RESET_SECONDS. The breaker state is kept
+# in the default cache, which every gunicorn worker and run_sms_worker share
+# (see CACHES).
+SMS_BREAKER_FAILURES = int(os.getenv('SMS_BREAKER_FAILURES', '5'))
+SMS_BREAKER_RESET_SECONDS = int(os.getenv('SMS_BREAKER_RESET_SECONDS', '60'))
+# Send one message per parent phone when several children share it.
+SMS_COALESCE_HOUSEHOLDS = os.getenv('SMS_COALESCE_HOUSEHOLDS', 'True').lower() == 'true'
+# Outbox delivery by `manage.py run_sms_worker`: failed sends are retried after
+# RETRY_BACKOFF seconds, doubling each time up to MAX_BACKOFF, MAX_ATTEMPTS times.
+SMS_OUTBOX_MAX_ATTEMPTS = int(os.getenv('SMS_OUTBOX_MAX_ATTEMPTS', '5'))
+SMS_OUTBOX_RETRY_BACKOFF = int(os.getenv('SMS_OUTBOX_RETRY_BACKOFF', '30'))
+SMS_OUTBOX_MAX_BACKOFF = int(os.getenv('SMS_OUTBOX_MAX_BACKOFF', '3600'))
+SMS_OUTBOX_CLAIM_TIMEOUT = int(os.getenv('SMS_OUTBOX_CLAIM_TIMEOUT', '300'))
+# Delivery reports: the provider posts them (one report, a JSON list, or
+# {"reports": [...]}) to /sms/delivery-reports/?token=SMS_WEBHOOK_TOKEN.
+# SMS_MESSAGE_ID_FIELD is the send-response field holding the provider's
+# message id; the SMS_RECEIPT_* fields name the report's id, phone and status.
+SMS_MESSAGE_ID_FIELD = os.getenv('SMS_MESSAGE_ID_FIELD', '')
+SMS_WEBHOOK_TOKEN = os.getenv('SMS_WEBHOOK_TOKEN', '')
+SMS_RECEIPT_ID_FIELD = os.getenv('SMS_RECEIPT_ID_FIELD', 'msgId')
+SMS_RECEIPT_PHONE_FIELD = os.getenv('SMS_RECEIPT_PHONE_FIELD', 'dest')
+SMS_RECEIPT_STATUS_FIELD = os.getenv('SMS_RECEIPT_STATUS_FIELD', 'status')
+SMS_RECEIPT_DELIVERED = [
+    value.strip().lower() for value in os.getenv('SMS_RECEIPT_DELIVERED', 'delivered,delivrd').split(',') if value.strip()
+]
+SMS_RECEIPT_UNDELIVERED = [
+    value.strip().lower()
+    for value in os.getenv('SMS_RECEIPT_UNDELIVERED', 'undelivered,undeliv,failed,rejected,expired').split(',')
+    if value.strip()
+]
+
+
+# Seconds a parent inquiry result stays cached; it is also dropped, for every
+# process through the shared cache (see CACHES), as soon as the family's
+# students or attendance change.
+PARENT_INQUIRY_CACHE_TIMEOUT = int(os.getenv('PARENT_INQUIRY_CACHE_TIMEOUT', '300'))
 
+# Students with this many absences since their last reset are listed as at-risk.
+ABSENCE_RISK_THRESHOLD = int(os.getenv('ABSENCE_RISK_THRESHOLD', '5'))
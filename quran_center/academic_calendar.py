@@ -0,0 +1,105 @@
+import threading
+import time
+from bisect import bisect_right
+
+from django.conf import settings
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import AcademicCalendar
+
+
+# رقم الأسبوع للتواريخ خارج التقويم، كما كان يعيده get_week_from_date
+DEFAULT_WEEK_NUMBER = 1
+
+_loaded = {'stamp': None, 'index': None, 'checked_at': None}
+_lock = threading.Lock()
+
+
+class CalendarIndex:
+    """The academic weeks as arrays sorted by start date, resolved with ``bisect``.
+
+    A date belongs to the week with the latest start on or before it that has
+    not ended yet (the highest week number among equal starts), the same rule
+    as ``calendar_week_expression``.
+    """
+
+    def __init__(self, weeks):
+        weeks = sorted(weeks, key=lambda week: (week[1], week[0]))
+        self.week_numbers = [week[0] for week in weeks]
+        self.starts = [week[1] for week in weeks]
+        self.ends = [week[2] for week in weeks]
+        # أبعد نهاية حتى كل موضع، لإيقاف البحث للخلف عند تداخل الأسابيع
+        self.max_ends = []
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+    @classmethod
+    def load(cls):
+        return cls(AcademicCalendar.objects.values_list('week_number', 'start_date', 'end_date'))
+
+    def week_for(self, target_date, default=DEFAULT_WEEK_NUMBER):
+        position = bisect_right(self.starts, target_date) - 1
+        while position >= 0 and self.max_ends[position] >= target_date:
+            if self.ends[position] >= target_date:
+                return self.week_numbers[position]
+            position -= 1
+        return default
+
+
+def calendar_stamp():
+    """Row count, last id and last edit of the calendar: changes with any save or delete in any process."""
+    stamp = AcademicCalendar.objects.aggregate(rows=Count('id'), last_id=Max('id'), updated_at=Max('updated_at'))
+    return (stamp['rows'], stamp['last_id'], stamp['updated_at'])
+
+
+def get_calendar_index():
+    """This process's ``CalendarIndex``.
+
+    Edits in this process drop it at once (signals). Edits made by other
+    processes are noticed by comparing ``calendar_stamp()``, read at most every
+    ACADEMIC_CALENDAR_CHECK_SECONDS, so lookups in between run no query.
+    """
+    interval = getattr(settings, 'ACADEMIC_CALENDAR_CHECK_SECONDS', 60)
+    now = time.monotonic()
+    with _lock:
+        checked_at = _loaded['checked_at']
+        if _loaded['index'] is not None and checked_at is not None and now - checked_at < interval:
+            return _loaded['index']
+        stamp = calendar_stamp()
+        if _loaded['index'] is None or _loaded['stamp'] != stamp:
+            _loaded['index'] = CalendarIndex.load()
+            _loaded['stamp'] = stamp
+        _loaded['checked_at'] = now
+        return _loaded['index']
+
+
+def week_for_date(target_date):
+    return get_calendar_index().week_for(target_date)
+
+
+def invalidate_calendar():
+    """Drop the loaded calendar so the next lookup reloads it."""
+    with _lock:
+        _loaded.update(stamp=None, index=None, checked_at=None)
+
+
+def calendar_week_expression(date_field='date'):
+    """SQL for the week of ``date_field`` by ``CalendarIndex``'s rule, DEFAULT_WEEK_NUMBER outside the calendar."""
+    weeks = (
+        AcademicCalendar.objects.filter(start_date__lte=OuterRef(date_field), end_date__gte=OuterRef(date_field))
+        .order_by('-start_date', '-week_number')
+        .values('week_number')[:1]
+    )
+    return Coalesce(Subquery(weeks), Value(DEFAULT_WEEK_NUMBER), output_field=IntegerField())
+
+
+def recompute_week_numbers(model, dry_run=False):
+    """Rewrite ``model.week_number`` from the calendar with one UPDATE; returns the number of changed rows.
+
+    Only rows whose stored week differs are touched, so a rerun changes nothing.
+    """
+    stale = model.objects.alias(calendar_week=calendar_week_expression()).exclude(week_number=F('calendar_week'))
+    if dry_run:
+        return stale.count()
+    return stale.update(week_number=calendar_week_expression())
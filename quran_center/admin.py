@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Student, Attendance, StageSupervisor, AcademicCalendar, ExamNomination, Role, UserRole, TeacherPlanPreference, TeacherProfile
+from .models import Student, Attendance, StageSupervisor, AcademicCalendar, ExamNomination, Role, UserRole, TeacherPlanPreference, TeacherProfile, StudentAttendanceSummary, SmsOutbox
 
 @admin.register(StageSupervisor)
 class StageSupervisorAdmin(admin.ModelAdmin):
@@ -53,6 +53,20 @@ class AttendanceAdmin(admin.ModelAdmin):
     date_hierarchy = 'date'
 
 
+@admin.register(StudentAttendanceSummary)
+class StudentAttendanceSummaryAdmin(admin.ModelAdmin):
+    # العدادات تُحدَّث تلقائياً مع سجلات الحضور، لذا هي للعرض فقط
+    list_display = ('student', 'present_count', 'absent_count', 'absent_excused_count', 'excused_count', 'late_count', 'absent_since_reset_count', 'updated_at')
+    search_fields = ('student__full_name',)
+    list_select_related = ('student',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(TeacherPlanPreference)
 class TeacherPlanPreferenceAdmin(admin.ModelAdmin):
     list_display = ('user', 'mem_plan', 'big_review_pages', 'updated_at')
@@ -64,3 +78,13 @@ class TeacherProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'halaqa_name', 'phone')
     search_fields = ('user__username', 'user__first_name', 'user__last_name', 'halaqa_name', 'phone')
 
+
+@admin.register(SmsOutbox)
+class SmsOutboxAdmin(admin.ModelAdmin):
+    list_display = ('phone', 'section', 'target_date', 'status', 'delivery_status', 'attempts', 'last_response', 'created_at', 'sent_at')
+    list_filter = ('status', 'delivery_status', 'section', 'target_date')
+    search_fields = ('phone', 'batch_id', 'provider_message_id')
+    readonly_fields = (
+        'batch_id', 'attempts', 'claimed_at', 'last_response', 'provider', 'provider_message_id',
+        'delivery_status', 'delivery_updated_at', 'created_at', 'sent_at',
+    )
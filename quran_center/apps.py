@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class QuranCenterConfig(AppConfig):
+    name = 'quran_center'
+
+    def ready(self):
+        from . import signals  # noqa: F401
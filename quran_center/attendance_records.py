@@ -0,0 +1,81 @@
+from django.db import transaction
+
+from .attendance_summary import refresh_student_summaries
+from .center_stats import invalidate_admin_statistics
+from .models import Attendance, TeacherAttendance
+from .parent_inquiry import invalidate_family_reports_for_students
+from .sqlite_tuning import write_transaction
+
+
+def _upsert_daily_attendance(model, owner_field, statuses, target_date, weekday, week_number):
+    """Save a whole roster of ``{owner_id: status}`` for one day in one transaction.
+
+    Uses a single ``bulk_create(update_conflicts=True)`` on the
+    ``(owner, date)`` unique constraint and returns the owner ids that were
+    created, changed and left as they were.
+    """
+    valid_statuses = {code for code, _label in model.STATUS_CHOICES}
+    statuses = {
+        int(owner_id): status
+        for owner_id, status in statuses.items()
+        if status in valid_statuses
+    }
+    result = {'created': [], 'updated': [], 'unchanged': []}
+    if not statuses:
+        return result
+
+    owner_id_field = f'{owner_field}_id'
+    with transaction.atomic():
+        existing = {
+            row[owner_id_field]: row
+            for row in model.objects.filter(
+                **{f'{owner_id_field}__in': list(statuses), 'date': target_date}
+            ).values(owner_id_field, 'status', 'weekday', 'week_number')
+        }
+
+        rows = []
+        for owner_id, status in statuses.items():
+            previous = existing.get(owner_id)
+            if previous is None:
+                result['created'].append(owner_id)
+            elif (previous['status'], previous['weekday'], previous['week_number']) != (status, weekday, week_number):
+                result['updated'].append(owner_id)
+            else:
+                result['unchanged'].append(owner_id)
+                continue
+
+            rows.append(model(**{
+                owner_id_field: owner_id,
+                'date': target_date,
+                'weekday': weekday,
+                'week_number': week_number,
+                'status': status,
+            }))
+
+        if rows:
+            model.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=[owner_field, 'date'],
+                update_fields=['status', 'weekday', 'week_number'],
+            )
+            transaction.on_commit(invalidate_admin_statistics)
+    return result
+
+
+@write_transaction
+def save_students_attendance(statuses, target_date, weekday, week_number):
+    """Upsert the day's Attendance rows and refresh the affected summaries."""
+    result = _upsert_daily_attendance(Attendance, 'student', statuses, target_date, weekday, week_number)
+    # bulk_create لا يطلق إشارات الحفظ، لذا نعيد حساب ملخص الطلاب المتأثرين
+    changed_ids = result['created'] + result['updated']
+    if changed_ids:
+        refresh_student_summaries(changed_ids)
+        transaction.on_commit(lambda: invalidate_family_reports_for_students(changed_ids))
+    return result
+
+
+@write_transaction
+def save_teachers_attendance(statuses, target_date, weekday, week_number):
+    """Upsert the day's TeacherAttendance rows for many teachers at once."""
+    return _upsert_daily_attendance(TeacherAttendance, 'teacher', statuses, target_date, weekday, week_number)
@@ -0,0 +1,61 @@
+from itertools import groupby
+
+from django.db.models import Max, Min
+
+from .attendance_stats import filter_attendance_range
+from .models import AcademicCalendar, Attendance
+
+
+STATUS_LABELS = dict(Attendance.STATUS_CHOICES)
+
+
+def get_term_range():
+    """First and last day of the academic calendar, or (None, None) when it is empty."""
+    bounds = AcademicCalendar.objects.aggregate(start=Min('start_date'), end=Max('end_date'))
+    return bounds['start'], bounds['end']
+
+
+def register_headers(dates):
+    return (
+        ['اسم الطالب', 'المعلم', 'المرحلة']
+        + [item.strftime('%Y-%m-%d') for item in dates]
+        + [STATUS_LABELS[code] for code in STATUS_LABELS]
+    )
+
+
+def register_dates(students, start_date=None, end_date=None):
+    """Distinct attendance dates of ``students`` inside the term, oldest first."""
+    attendances = filter_attendance_range(Attendance.objects.filter(student__in=students), start_date, end_date)
+    return list(attendances.order_by('date').values_list('date', flat=True).distinct())
+
+
+def iter_register_rows(students, dates, start_date=None, end_date=None):
+    """One row per student with the status of every date and per-status totals.
+
+    Students and their attendance are streamed by two ordered queries that are
+    merged in Python, so memory use does not grow with the size of the term.
+    """
+    students = students.select_related('teacher').order_by('full_name', 'id')
+    date_index = {item: index for index, item in enumerate(dates)}
+    attendances = filter_attendance_range(
+        Attendance.objects.filter(student__in=students), start_date, end_date
+    ).order_by('student__full_name', 'student_id', 'date').values_list('student_id', 'date', 'status')
+
+    grouped = groupby(attendances.iterator(chunk_size=2000), key=lambda row: row[0])
+    current = next(grouped, None)
+
+    for student in students.iterator(chunk_size=500):
+        cells = [''] * len(dates)
+        totals = dict.fromkeys(STATUS_LABELS, 0)
+        if current is not None and current[0] == student.id:
+            for _student_id, attendance_date, status in current[1]:
+                if attendance_date in date_index:
+                    cells[date_index[attendance_date]] = STATUS_LABELS.get(status, status)
+                if status in totals:
+                    totals[status] += 1
+            current = next(grouped, None)
+
+        teacher_name = ''
+        if student.teacher:
+            teacher_name = student.teacher.get_full_name() or student.teacher.username
+        yield [student.full_name, teacher_name, student.educational_stage] + cells + list(totals.values())
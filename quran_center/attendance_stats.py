@@ -0,0 +1,233 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import Attendance, Student, StudentAttendanceSummary
+
+
+# مفاتيح الإحصائية مقابل حالات الحضور المخزنة
+ATTENDANCE_STATUS_KEYS = {
+    'present': 'حاضر',
+    'absent': 'غائب',
+    'absent_excused': 'غياب بعذر',
+    'excused': 'مستأذن',
+    'late': 'متأخر',
+}
+
+NON_PRESENT_KEYS = ('absent', 'absent_excused', 'excused', 'late')
+
+
+def filter_attendance_range(queryset, start_date=None, end_date=None):
+    """Restrict an Attendance queryset to an optional inclusive date range."""
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    return queryset
+
+
+def empty_status_counts():
+    counts = {key: 0 for key in ATTENDANCE_STATUS_KEYS}
+    counts['total_days'] = 0
+    return counts
+
+
+def status_count_annotations(prefix=''):
+    """Conditional COUNT expressions, one per status, for use with annotate()/aggregate()."""
+    annotations = {'total_days': Count(f'{prefix}id')}
+    for key, status_code in ATTENDANCE_STATUS_KEYS.items():
+        annotations[key] = Count(f'{prefix}id', filter=Q(**{f'{prefix}status': status_code}))
+    return annotations
+
+
+def attendance_counts_by_student(students, start_date=None, end_date=None):
+    """Per-student status counts computed with a single grouped query.
+
+    ``students`` may be a queryset (used as a subquery) or an iterable of
+    students / ids. Students without any record are absent from the result.
+    """
+    attendances = filter_attendance_range(
+        Attendance.objects.filter(student__in=students), start_date, end_date
+    )
+    rows = (
+        attendances.order_by()
+        .values('student_id')
+        .annotate(**status_count_annotations())
+    )
+    return {row.pop('student_id'): row for row in rows}
+
+
+def annotate_absences_in_range(students, start_date=None, end_date=None):
+    """Annotate ``absent_count_in_range`` so students can be ranked in the database.
+
+    Without a range the materialized summary counter is used; with a range a
+    correlated COUNT subquery over the student's Attendance rows.
+    """
+    if not (start_date or end_date):
+        return students.annotate(
+            absent_count_in_range=Coalesce(F('attendance_summary__absent_count'), 0)
+        )
+
+    absences = filter_attendance_range(
+        Attendance.objects.filter(student=OuterRef('pk'), status=ATTENDANCE_STATUS_KEYS['absent']),
+        start_date,
+        end_date,
+    )
+    absence_count = absences.order_by().values('student').annotate(total=Count('id')).values('total')
+    return students.annotate(absent_count_in_range=Coalesce(Subquery(absence_count), 0))
+
+
+def summary_counts_by_student(students):
+    """Full-period status counts read from the materialized StudentAttendanceSummary rows."""
+    counts_map = {}
+    for summary in StudentAttendanceSummary.objects.filter(student__in=students):
+        counts_map[summary.student_id] = summary_as_counts(summary)
+    return counts_map
+
+
+def summary_as_counts(summary):
+    """Convert a summary row (or None) to the ``ATTENDANCE_STATUS_KEYS`` counts dict."""
+    counts = empty_status_counts()
+    if summary is None:
+        return counts
+    for key, status_code in ATTENDANCE_STATUS_KEYS.items():
+        counts[key] = getattr(summary, StudentAttendanceSummary.STATUS_FIELDS[status_code])
+    counts['total_days'] = summary.total_days
+    return counts
+
+
+def get_student_summary(student):
+    """The student's summary row, or None when it has no attendance yet."""
+    try:
+        return student.attendance_summary
+    except StudentAttendanceSummary.DoesNotExist:
+        return None
+
+
+def attendance_history_by_student(students, start_date=None, end_date=None):
+    """All (date, status) records per student, newest first, fetched in one query."""
+    attendances = filter_attendance_range(
+        Attendance.objects.filter(student__in=students), start_date, end_date
+    )
+    history = defaultdict(list)
+    for row in attendances.order_by('-date').values('student_id', 'date', 'status'):
+        history[row['student_id']].append({'date': row['date'], 'status': row['status']})
+    return history
+
+
+def recent_attendance_by_student(students, limit=10):
+    """The last ``limit`` (date, status) records of each student, newest first, from one windowed query."""
+    attendances = (
+        Attendance.objects.filter(student__in=students)
+        .annotate(position=Window(RowNumber(), partition_by=F('student_id'), order_by=F('date').desc()))
+        .filter(position__lte=limit)
+        .order_by('student_id', '-date')
+        .values('student_id', 'date', 'status')
+    )
+    history = defaultdict(list)
+    for row in attendances:
+        history[row['student_id']].append({'date': row['date'], 'status': row['status']})
+    return history
+
+
+def build_student_attendance_stats(students, start_date=None, end_date=None, with_history=True):
+    """Attendance statistics for each student, sorted by absences (most first).
+
+    Runs a constant number of queries regardless of how many students are passed.
+    """
+    students = list(students)
+    student_ids = [student.id for student in students]
+    if start_date or end_date:
+        counts_map = attendance_counts_by_student(student_ids, start_date, end_date)
+    else:
+        counts_map = summary_counts_by_student(student_ids)
+    history_map = attendance_history_by_student(student_ids, start_date, end_date) if with_history else {}
+
+    stats_rows = []
+    for student in students:
+        counts = counts_map.get(student.id) or empty_status_counts()
+        stats = {'student': student}
+        stats.update(counts)
+        stats['non_present_count'] = sum(counts[key] for key in NON_PRESENT_KEYS)
+        if with_history:
+            stats['all_attendance'] = history_map.get(student.id, [])
+        stats_rows.append(stats)
+
+    stats_rows.sort(key=lambda item: (-item['absent'], item['student'].full_name or ''))
+    return stats_rows
+
+
+def teacher_roll_call(target_date):
+    """Teachers with regular students split into ``pending`` and ``completed`` roll calls for ``target_date``.
+
+    Two grouped queries whatever the number of teachers: regular students per
+    teacher (with the teacher's name joined in), and the day's attendance
+    count and last record time per ``student__teacher``.
+    """
+    teachers = (
+        Student.objects.filter(status='منتظم', teacher__isnull=False)
+        .values('teacher_id', 'teacher__username', 'teacher__first_name', 'teacher__last_name')
+        .annotate(student_count=Count('id'))
+        .order_by('teacher__username')
+    )
+    recorded = {
+        row['student__teacher_id']: row
+        for row in Attendance.objects.filter(date=target_date, student__teacher__isnull=False)
+        .order_by()
+        .values('student__teacher_id')
+        .annotate(recorded_count=Count('id'), last_time=Max('created_at'))
+    }
+
+    board = {'pending': [], 'completed': []}
+    for row in teachers:
+        day = recorded.get(row['teacher_id'], {})
+        full_name = f"{row['teacher__first_name']} {row['teacher__last_name']}".strip()
+        item = {
+            'teacher_id': row['teacher_id'],
+            'display_name': full_name or row['teacher__username'],
+            'student_count': row['student_count'],
+            'recorded_count': day.get('recorded_count', 0),
+        }
+        if item['recorded_count'] >= item['student_count']:
+            item['last_time'] = day.get('last_time')
+            board['completed'].append(item)
+        else:
+            board['pending'].append(item)
+    return board
+
+
+def get_absence_risk_threshold():
+    return int(getattr(settings, 'ABSENCE_RISK_THRESHOLD', 5))
+
+
+def absence_since_reset_filter(prefix='attendance__'):
+    """Q matching attendance rows created after the student's ``absence_reset_at``."""
+    return Q(absence_reset_at__isnull=True) | Q(**{f'{prefix}created_at__date__gt': F('absence_reset_at')})
+
+
+def find_at_risk_students(threshold=None, students=None):
+    """Regular students whose absences since the last reset reach ``threshold``.
+
+    Returns a list of ``{'student', 'temp_count', 'total_absences'}`` dicts
+    read from the materialized attendance summaries in a single query.
+    """
+    if threshold is None:
+        threshold = get_absence_risk_threshold()
+    if students is None:
+        students = Student.objects.filter(status='منتظم')
+
+    at_risk_students = (
+        students.filter(attendance_summary__absent_since_reset_count__gte=threshold)
+        .select_related('attendance_summary')
+        .order_by('full_name')
+    )
+    return [
+        {
+            'student': student,
+            'temp_count': student.attendance_summary.absent_since_reset_count,
+            'total_absences': student.attendance_summary.absent_count,
+        }
+        for student in at_risk_students
+    ]
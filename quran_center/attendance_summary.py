@@ -0,0 +1,154 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .attendance_stats import ATTENDANCE_STATUS_KEYS, absence_since_reset_filter
+from .models import Attendance, Student, StudentAttendanceSummary
+
+
+ABSENT_STATUS = ATTENDANCE_STATUS_KEYS['absent']
+SUMMARY_FIELDS = list(StudentAttendanceSummary.STATUS_FIELDS.values()) + ['absent_since_reset_count']
+
+
+def summary_annotations():
+    """Student annotations that recompute every summary counter from Attendance."""
+    annotations = {
+        field: Count('attendance', filter=Q(attendance__status=status))
+        for status, field in StudentAttendanceSummary.STATUS_FIELDS.items()
+    }
+    annotations['absent_since_reset_count'] = Count(
+        'attendance',
+        filter=Q(attendance__status=ABSENT_STATUS) & absence_since_reset_filter(),
+    )
+    return annotations
+
+
+def compute_summary_rows(students=None):
+    """Expected counters per student, straight from the Attendance table."""
+    if students is None:
+        students = Student.objects.all()
+    return students.order_by().values('id').annotate(**summary_annotations())
+
+
+def refresh_student_summaries(student_ids=None, batch_size=500):
+    """Recompute and upsert the summaries of the given students (all when None)."""
+    students = Student.objects.all()
+    if student_ids is not None:
+        students = students.filter(id__in=list(student_ids))
+
+    summaries = []
+    refreshed = 0
+    for row in compute_summary_rows(students).iterator(chunk_size=batch_size):
+        student_id = row.pop('id')
+        summaries.append(StudentAttendanceSummary(student_id=student_id, **row))
+        if len(summaries) >= batch_size:
+            refreshed += _upsert_summaries(summaries)
+            summaries = []
+    refreshed += _upsert_summaries(summaries)
+    return refreshed
+
+
+def _upsert_summaries(summaries):
+    if not summaries:
+        return 0
+    StudentAttendanceSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['student'],
+        update_fields=SUMMARY_FIELDS + ['updated_at'],
+    )
+    return len(summaries)
+
+
+def find_summary_mismatches(students=None):
+    """Students whose stored counters differ from a fresh recount.
+
+    Returns ``[(student_id, expected, stored)]`` where ``stored`` is None
+    for students that have attendance but no summary row.
+    """
+    stored_map = {
+        row.pop('student_id'): row
+        for row in StudentAttendanceSummary.objects.values('student_id', *SUMMARY_FIELDS)
+    }
+    mismatches = []
+    for row in compute_summary_rows(students).iterator():
+        student_id = row.pop('id')
+        stored = stored_map.get(student_id)
+        if stored is None:
+            if any(row.values()):
+                mismatches.append((student_id, row, None))
+        elif stored != row:
+            mismatches.append((student_id, row, stored))
+    return mismatches
+
+
+def created_after_reset(created_at, reset_date):
+    """Same rule as ``absence_since_reset_filter`` applied to one row in Python."""
+    if reset_date is None:
+        return True
+    if created_at is None:
+        return False
+    if timezone.is_aware(created_at):
+        created_at = timezone.localtime(created_at)
+    return created_at.date() > reset_date
+
+
+def _student_reset_date(attendance, student_id):
+    if student_id == attendance.student_id and Attendance.student.is_cached(attendance):
+        return attendance.student.absence_reset_at
+    return Student.objects.filter(pk=student_id).values_list('absence_reset_at', flat=True).first()
+
+
+def _add_delta(deltas, status, counts_since_reset, sign):
+    field = StudentAttendanceSummary.STATUS_FIELDS.get(status)
+    if field:
+        deltas[field] = deltas.get(field, 0) + sign
+    if status == ABSENT_STATUS and counts_since_reset:
+        deltas['absent_since_reset_count'] = deltas.get('absent_since_reset_count', 0) + sign
+
+
+def apply_attendance_change(attendance, previous=None, removed=False):
+    """Move the student's counters from ``previous`` to the current row state.
+
+    ``previous`` is a ``{'student_id', 'status', 'created_at'}`` dict of the
+    row as stored before an update. Missing summaries are rebuilt from scratch.
+    """
+    changes = []
+    if previous:
+        changes.append((previous['student_id'], previous['status'], previous['created_at'], -1))
+    if not removed:
+        changes.append((attendance.student_id, attendance.status, attendance.created_at, 1))
+
+    deltas_by_student = {}
+    reset_dates = {}
+    for student_id, status, created_at, sign in changes:
+        counts_since_reset = False
+        if status == ABSENT_STATUS:
+            if student_id not in reset_dates:
+                reset_dates[student_id] = _student_reset_date(attendance, student_id)
+            counts_since_reset = created_after_reset(created_at, reset_dates[student_id])
+        _add_delta(deltas_by_student.setdefault(student_id, {}), status, counts_since_reset, sign)
+
+    for student_id, deltas in deltas_by_student.items():
+        updates = {
+            field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+            for field, delta in deltas.items() if delta
+        }
+        if not updates:
+            continue
+        updates['updated_at'] = timezone.now()
+        updated = StudentAttendanceSummary.objects.filter(student_id=student_id).update(**updates)
+        if not updated and not removed:
+            refresh_student_summaries([student_id])
+
+
+def refresh_since_reset_count(student):
+    """Recount absences since ``student.absence_reset_at`` after a reset."""
+    absences = Attendance.objects.filter(student_id=OuterRef('student_id'), status=ABSENT_STATUS)
+    if student.absence_reset_at:
+        absences = absences.filter(created_at__date__gt=student.absence_reset_at)
+    absence_count = absences.order_by().values('student_id').annotate(total=Count('id')).values('total')
+    StudentAttendanceSummary.objects.filter(student_id=student.pk).update(
+        absent_since_reset_count=Coalesce(Subquery(absence_count), 0),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,111 @@
+from collections import defaultdict
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Attendance, ExamNomination, StageSupervisor, Student, TeacherAttendance
+
+
+STATS_VERSION_KEY = 'quran_center:admin_statistics:version'
+
+
+def _grouped_counts(queryset, *fields):
+    """``{(field values...): count}`` from one GROUP BY query."""
+    rows = queryset.order_by().values_list(*fields).annotate(total=Count('id'))
+    return {tuple(row[:-1]): row[-1] for row in rows}
+
+
+def compute_admin_statistics(today):
+    """Center, stage, teacher and teacher×stage statistics from a handful of grouped queries."""
+    students = _grouped_counts(
+        Student.objects.filter(status='منتظم'), 'teacher_id', 'educational_stage'
+    )
+    tested = _grouped_counts(
+        ExamNomination.objects.filter(internal_passed=True), 'teacher_id', 'student__educational_stage'
+    )
+    absent_today = _grouped_counts(
+        Attendance.objects.filter(date=today, status='غائب'), 'student__teacher_id', 'student__educational_stage'
+    )
+    teacher_absent_today = _grouped_counts(
+        TeacherAttendance.objects.filter(date=today, status='غائب'), 'teacher_id'
+    )
+
+    def totals_by(counts, index):
+        totals = defaultdict(int)
+        for key, value in counts.items():
+            totals[key[index]] += value
+        return totals
+
+    students_by_stage = totals_by(students, 1)
+    students_by_teacher = totals_by(students, 0)
+    tested_by_stage = totals_by(tested, 1)
+    tested_by_teacher = totals_by(tested, 0)
+    absent_by_stage = totals_by(absent_today, 1)
+    absent_by_teacher = totals_by(absent_today, 0)
+
+    stage_stats = []
+    for stage_code, stage_name in StageSupervisor.STAGE_CHOICES:
+        if students_by_stage.get(stage_code, 0) > 0:
+            stage_stats.append({
+                'stage': stage_name,
+                'total_students': students_by_stage[stage_code],
+                'tested': tested_by_stage.get(stage_code, 0),
+                'absent_today': absent_by_stage.get(stage_code, 0),
+            })
+
+    teacher_ids = [teacher_id for teacher_id in students_by_teacher if teacher_id is not None]
+    teachers = User.objects.filter(id__in=teacher_ids).order_by('username').values_list('id', 'username')
+
+    teacher_stats = []
+    for teacher_id, username in teachers:
+        teacher_stage_stats = []
+        for stage_code, stage_name in StageSupervisor.STAGE_CHOICES:
+            stage_students = students.get((teacher_id, stage_code), 0)
+            if stage_students > 0:
+                teacher_stage_stats.append({
+                    'stage': stage_name,
+                    'total_students': stage_students,
+                    'tested': tested.get((teacher_id, stage_code), 0),
+                    'absent_today': absent_today.get((teacher_id, stage_code), 0),
+                })
+
+        teacher_stats.append({
+            'teacher': username,
+            'total_students': students_by_teacher[teacher_id],
+            'tested': tested_by_teacher.get(teacher_id, 0),
+            'absent_today': absent_by_teacher.get(teacher_id, 0),
+            'teacher_self_absent_today': teacher_absent_today.get((teacher_id,), 0),
+            'stage_stats': teacher_stage_stats,
+        })
+
+    return {
+        'total_students': sum(students.values()),
+        'total_tested': sum(tested.values()),
+        'total_absent_today': sum(absent_today.values()),
+        'total_teacher_absent_today': sum(teacher_absent_today.values()),
+        'stage_stats': stage_stats,
+        'teacher_stats': teacher_stats,
+    }
+
+
+def get_admin_statistics(today):
+    """Cached snapshot of ``compute_admin_statistics`` for ``today``."""
+    version = cache.get(STATS_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.set(STATS_VERSION_KEY, version, None)
+
+    key = f'quran_center:admin_statistics:{today.isoformat()}:{version}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = compute_admin_statistics(today)
+        cache.set(key, snapshot, getattr(settings, 'ADMIN_STATISTICS_CACHE_TIMEOUT', 600))
+    return snapshot
+
+
+def invalidate_admin_statistics():
+    """Start a new snapshot version so every cached date is recomputed."""
+    cache.set(STATS_VERSION_KEY, uuid4().hex, None)
@@ -0,0 +1,60 @@
+import csv
+from tempfile import SpooledTemporaryFile
+
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# الملفات الأصغر من هذا الحجم تبقى في الذاكرة، والأكبر تُكتب على القرص
+SPOOL_MAX_SIZE = 5 * 1024 * 1024
+
+
+class _EchoBuffer:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+def csv_streaming_response(filename, headers, rows):
+    """Stream ``headers`` and the ``rows`` iterable as a UTF-8 (BOM) CSV download."""
+    writer = csv.writer(_EchoBuffer())
+
+    def generate():
+        # BOM حتى يفتح Excel النص العربي بشكل صحيح
+        yield '\ufeff'
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(generate(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_xlsx_sheet(workbook, title, headers, rows):
+    """Append a right-to-left write-only sheet filled from the ``rows`` iterable."""
+    worksheet = workbook.create_sheet(title=title[:31])
+    worksheet.sheet_view.rightToLeft = True
+    worksheet.append(headers)
+    for row in rows:
+        worksheet.append(row)
+    return worksheet
+
+
+def xlsx_file_response(filename, sheets):
+    """Build a write-only workbook from ``[(title, headers, rows)]`` and send it.
+
+    Rows are consumed one at a time, so memory stays flat regardless of the
+    number of rows; the finished file is spooled to disk once it grows large.
+    """
+    workbook = Workbook(write_only=True)
+    for title, headers, rows in sheets:
+        write_xlsx_sheet(workbook, title, headers, rows)
+
+    spooled = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    workbook.save(spooled)
+    spooled.seek(0)
+    return FileResponse(spooled, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
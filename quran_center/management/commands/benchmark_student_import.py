@@ -0,0 +1,82 @@
+from io import BytesIO
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from openpyxl import Workbook
+
+from quran_center.student_import import IMPORT_CHUNK_SIZE, import_students, iter_excel_sheet_rows
+
+
+# نفس أعمدة ملف newStudents.xlsx المرفق مع المشروع
+SHEET_HEADERS = [
+    'full_name', 'student_phone', 'parent_phone', 'identity_number', 'jamiaa_id',
+    'parent_identity', 'grade', 'birth_date', 'last_tested_part', 'previous_center', 'neighborhood',
+]
+SAMPLE_GRADES = ['أول ابتدائي', 'رابع ابتدائي', 'ثاني متوسط', 'ثالث ثانوي', 'جامعي', '']
+
+
+class _Rollback(Exception):
+    pass
+
+
+def build_sample_workbook(row_count, identity_prefix):
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(SHEET_HEADERS)
+    for index in range(row_count):
+        worksheet.append([
+            f'طالب تجريبي {index}',
+            f'05{index:08d}',
+            f'05{index:08d}',
+            f'{identity_prefix}{index:07d}',
+            '',
+            '',
+            SAMPLE_GRADES[index % len(SAMPLE_GRADES)],
+            '2012-01-01',
+            '0',
+            '',
+            'الحي',
+        ])
+    buffer = BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+class Command(BaseCommand):
+    help = 'Time the bulk student import on a generated sheet shaped like newStudents.xlsx.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Number of generated student rows.')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=IMPORT_CHUNK_SIZE,
+            help='Number of students inserted per bulk_create call.',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the imported students instead of rolling the import back.',
+        )
+
+    def handle(self, *args, **options):
+        sheet = build_sample_workbook(options['rows'], identity_prefix='BENCH')
+
+        started = perf_counter()
+        try:
+            with transaction.atomic():
+                result = import_students(iter_excel_sheet_rows(sheet), chunk_size=options['chunk_size'])
+                elapsed = perf_counter() - started
+                if not options['keep']:
+                    raise _Rollback
+        except _Rollback:
+            pass
+
+        self.stdout.write(
+            f"created {result['created_count']}, skipped {result['skipped_count']} "
+            f"in {elapsed:.2f}s ({options['rows'] / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+        if not options['keep']:
+            self.stdout.write('Import rolled back; pass --keep to store the students.')
@@ -0,0 +1,149 @@
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+
+SOURCE_ALIAS = 'sqlite_source'
+
+
+def register_sqlite_source(path, alias=SOURCE_ALIAS):
+    """Add ``alias`` to ``connections`` for the SQLite file at ``path`` and return it."""
+    connections.settings[alias] = connections.configure_settings({
+        DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)},
+    })[alias]
+    return alias
+
+
+def unregister_sqlite_source(alias=SOURCE_ALIAS):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+def unapplied_migrations(alias):
+    """Labels of the project's migrations not yet applied to the ``alias`` database."""
+    executor = MigrationExecutor(connections[alias])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    return [f'{migration.app_label}.{migration.name}' for migration, _backwards in plan]
+
+
+def copied_models(source_alias):
+    """Concrete models (auto-created m2m tables included) whose table exists in the source."""
+    source_tables = set(connections[source_alias].introspection.table_names())
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.managed and not model._meta.proxy and model._meta.db_table in source_tables
+    ]
+
+
+def copy_model(model, source_alias, target_alias, chunk_size):
+    """Copy every row of ``model`` with chunked ``bulk_create``; returns the number of rows."""
+    rows = model._base_manager.using(source_alias).order_by('pk').iterator(chunk_size=chunk_size)
+    copied = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            model._base_manager.using(target_alias).bulk_create(chunk)
+            copied += len(chunk)
+            chunk = []
+    if chunk:
+        model._base_manager.using(target_alias).bulk_create(chunk)
+        copied += len(chunk)
+    return copied
+
+
+def reset_sequences(models, target_alias):
+    """Move the target's id sequences past the copied ids (no-op on SQLite)."""
+    connection = connections[target_alias]
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return len(statements)
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy every table of a SQLite database into the (migrated) target database, '
+        'replacing its contents, then reset the id sequences. Both databases must be '
+        'migrated to the current schema: migrate an older source first with '
+        '"SQLITE_PATH=<source> python manage.py migrate".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source',
+            help='Path of the SQLite database file to copy from, migrated to the current schema.',
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Target database alias (default: "default"). Run migrate on it first.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows read and inserted per batch.',
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not ask before replacing the target contents.',
+        )
+
+    def handle(self, *args, **options):
+        source_path = Path(options['source'])
+        if not source_path.is_file():
+            raise CommandError(f'SQLite database {source_path} does not exist.')
+        target_alias = options['database']
+        target = connections[target_alias]
+        if Path(str(target.settings_dict['NAME'])).resolve() == source_path.resolve():
+            raise CommandError('The source and target databases are the same file.')
+
+        source_alias = register_sqlite_source(source_path)
+        try:
+            # مصدر بمخطط أقدم يفشل في منتصف النسخ (no such column)، فيُرفض قبل البدء
+            missing = unapplied_migrations(source_alias)
+            if missing:
+                raise CommandError(
+                    f'{source_path} is not migrated to the current schema ({len(missing)} unapplied migrations, '
+                    f'first {missing[0]}). Run "SQLITE_PATH={source_path} python manage.py migrate" first.'
+                )
+            models = copied_models(source_alias)
+            if options['interactive']:
+                answer = input(
+                    f'Every row of {len(models)} tables in "{target.settings_dict["NAME"]}" will be replaced '
+                    f'by the contents of {source_path}. Type "yes" to continue: '
+                )
+                if answer != 'yes':
+                    raise CommandError('Copy cancelled.')
+
+            # الجداول تُفرغ وتُملأ في معاملة واحدة؛ قيود المفاتيح الأجنبية في PostgreSQL
+            # مؤجلة حتى نهايتها، فلا يهم ترتيب نسخ الجداول
+            with transaction.atomic(using=target_alias):
+                tables = [model._meta.db_table for model in models]
+                target.ops.execute_sql_flush(target.ops.sql_flush(no_style(), tables, allow_cascade=True))
+                counts = []
+                for model in models:
+                    copied = copy_model(model, source_alias, target_alias, options['chunk_size'])
+                    counts.append((model._meta.label, copied))
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{model._meta.label}: {copied}')
+                reset = reset_sequences(models, target_alias)
+                target.check_constraints(table_names=tables)
+        finally:
+            unregister_sqlite_source(source_alias)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {sum(count for _, count in counts)} rows in {len(counts)} tables; '
+            f'reset {reset} sequence statement(s).'
+        ))
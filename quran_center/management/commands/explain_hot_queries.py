@@ -0,0 +1,129 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from quran_center.models import Attendance, ExamNomination, SmsOutbox, Student, TeacherAttendance
+
+
+# SQLite: "SCAN quran_center_student" (older versions: "SCAN TABLE ...") without
+# "USING ... INDEX" reads the whole table; PostgreSQL reports "Seq Scan on ...".
+SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(?P<table>\w+)(?P<rest>.*)$')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (?P<table>\w+)')
+NOT_TABLES = {'CONSTANT', 'SUBQUERY'}
+
+
+def hot_queries(today=None):
+    """``[(label, queryset)]``: the filters the busiest views run, with sample values."""
+    today = today or timezone.now().date()
+    teacher_id = 1
+    stage = 'عليا'
+    return [
+        ('preparer_absent_contacts: status rows of a day', (
+            Attendance.objects.filter(date=today, status='غائب')
+            .select_related('student__teacher__teacher_profile', 'student__attendance_summary')
+            .order_by('student__full_name', 'student_id')
+        )),
+        ('admin_statistics: regular students per teacher and stage', (
+            Student.objects.filter(status='منتظم').order_by()
+            .values_list('teacher_id', 'educational_stage').annotate(total=Count('id'))
+        )),
+        ('admin_statistics: absences today', (
+            Attendance.objects.filter(date=today, status='غائب').order_by()
+            .values_list('student__teacher_id', 'student__educational_stage').annotate(total=Count('id'))
+        )),
+        ('admin_statistics: absent teachers today', (
+            TeacherAttendance.objects.filter(date=today, status='غائب').order_by()
+            .values_list('teacher_id').annotate(total=Count('id'))
+        )),
+        ('teacher_dashboard: regular students of a teacher', (
+            Student.objects.filter(teacher_id=teacher_id, status='منتظم').order_by('full_name')
+        )),
+        ('take_attendance: day records of a teacher', (
+            Attendance.objects.filter(
+                student__in=Student.objects.filter(teacher_id=teacher_id, status='منتظم'), date=today,
+            )
+        )),
+        ('pending_students: waiting students of a stage', (
+            Student.objects.filter(status='منتظر', educational_stage=stage).order_by('full_name')
+        )),
+        ('stage_students_data: regular students of a stage', (
+            Student.objects.filter(status='منتظم', educational_stage=stage).order_by('full_name')
+        )),
+        ('parent_inquiry: children of a parent phone', (
+            Student.objects.filter(parent_phone_normalized='966500000000')
+            .select_related('teacher__teacher_profile', 'attendance_summary')
+        )),
+        ('registration: identity number lookup', Student.objects.filter(identity_number='1000000000')),
+        ('nominated_students: waiting for the internal exam', (
+            ExamNomination.objects.filter(internal_passed=False).select_related('student', 'teacher')
+        )),
+        ('association_candidates: passed, not tested by the association', (
+            ExamNomination.objects.filter(internal_passed=True, association_tested=False).select_related('student')
+        )),
+        ('association_results: tested by the association', (
+            ExamNomination.objects.filter(association_tested=True).select_related('student')
+        )),
+        ('run_sms_worker: due outbox messages', (
+            SmsOutbox.objects.filter(
+                Q(status=SmsOutbox.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+                | Q(status=SmsOutbox.STATUS_SENDING, claimed_at__lt=timezone.now() - timedelta(minutes=5))
+            ).order_by('next_attempt_at', 'id').values_list('id', flat=True)
+        )),
+    ]
+
+
+def explain(queryset):
+    """The query plan of ``queryset`` as a list of lines."""
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # الجداول الصغيرة تُقرأ كاملة عادةً، فنمنع ذلك لنرى هل يوجد فهرس مناسب
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan_lines, vendor='sqlite'):
+    """Tables that ``plan_lines`` read without an index."""
+    tables = []
+    for line in plan_lines:
+        line = line.strip().lstrip('-> ').strip()
+        if vendor == 'postgresql':
+            match = POSTGRES_SCAN_RE.search(line)
+            if match:
+                tables.append(match.group('table'))
+            continue
+        match = SQLITE_SCAN_RE.match(line)
+        if match and match.group('table') not in NOT_TABLES and 'USING' not in match.group('rest'):
+            tables.append(match.group('table'))
+    return tables
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot view queries and fail if any of them reads a whole table.'
+
+    def handle(self, *args, **options):
+        if connection.vendor not in {'sqlite', 'postgresql'}:
+            raise CommandError(f'Query plans are only checked on SQLite and PostgreSQL, not {connection.vendor}.')
+
+        failures = []
+        for label, queryset in hot_queries():
+            plan = explain(queryset)
+            scanned = full_scans(plan, connection.vendor)
+            status = f"FULL SCAN of {', '.join(scanned)}" if scanned else 'ok'
+            self.stdout.write(f'{label}: {status}')
+            if options['verbosity'] > 1 or scanned:
+                for line in plan:
+                    self.stdout.write(f'    {line}')
+            if scanned:
+                failures.append(label)
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries read whole tables: {'; '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('All hot queries use indexes.'))
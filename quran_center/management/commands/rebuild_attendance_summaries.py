@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from quran_center.attendance_summary import find_summary_mismatches, refresh_student_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-student attendance summary counters, or verify them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare stored counters with a fresh recount; fail if any differ.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of summaries written per bulk upsert.',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = find_summary_mismatches()
+            for student_id, expected, stored in mismatches[:20]:
+                self.stdout.write(f'student {student_id}: expected {expected}, stored {stored}')
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} attendance summary row(s) are out of date.')
+            self.stdout.write(self.style.SUCCESS('All attendance summaries are up to date.'))
+            return
+
+        with transaction.atomic():
+            refreshed = refresh_student_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {refreshed} attendance summary row(s).'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quran_center.academic_calendar import invalidate_calendar, recompute_week_numbers
+from quran_center.models import Attendance, TeacherAttendance
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored week_number of student and teacher attendance from the academic calendar.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows whose week number is out of date.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        with transaction.atomic():
+            counts = [
+                (model.__name__, recompute_week_numbers(model, dry_run=dry_run))
+                for model in (Attendance, TeacherAttendance)
+            ]
+        # التقويم ربما عُدّل دون إشارات (update أو loaddata)، فتُعاد قراءته في هذه العملية
+        invalidate_calendar()
+
+        verb = 'would change' if dry_run else 'updated'
+        for label, count in counts:
+            self.stdout.write(f'{label}: {verb} {count} row(s)')
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f'Recomputed week numbers of {sum(count for _, count in counts)} row(s).'))
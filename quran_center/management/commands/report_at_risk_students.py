@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from quran_center.attendance_stats import find_at_risk_students, get_absence_risk_threshold
+
+
+class Command(BaseCommand):
+    help = 'List regular students whose absences since the last reset reach the at-risk threshold.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold',
+            type=int,
+            default=None,
+            help='Minimum absences since reset (defaults to settings.ABSENCE_RISK_THRESHOLD).',
+        )
+
+    def handle(self, *args, **options):
+        threshold = options['threshold']
+        if threshold is None:
+            threshold = get_absence_risk_threshold()
+
+        at_risk = find_at_risk_students(threshold)
+        for item in at_risk:
+            student = item['student']
+            self.stdout.write(
+                f"{student.student_unique_id or student.id}\t{student.full_name}\t"
+                f"{student.parent_phone}\t{item['temp_count']}\t{item['total_absences']}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(at_risk)} student(s) at or above {threshold} absence(s).'
+        ))
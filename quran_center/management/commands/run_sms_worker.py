@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quran_center.sms import SmsDispatcher
+from quran_center.sms_outbox import DEFAULT_WORKER_BATCH_SIZE, process_outbox
+from quran_center.sms_receipts import apply_delivery_reports
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver queued SMS messages from the outbox, retrying failures with exponential backoff, '
+        'and apply buffered delivery reports.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_WORKER_BATCH_SIZE,
+            help='Number of messages claimed and sent per round.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when no message is due.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Deliver everything that is due now, then exit.',
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = SmsDispatcher()
+        try:
+            while True:
+                summary = process_outbox(dispatcher, limit=options['batch_size'])
+                receipts = apply_delivery_reports()
+                if receipts['applied']:
+                    self.stdout.write(f"applied {receipts['applied']} delivery reports")
+                if summary['claimed']:
+                    self.stdout.write(
+                        f"sent {summary['sent']}, failed {summary['failed']}, retrying {summary['retrying']}"
+                    )
+                if summary['claimed'] or receipts['applied']:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
@@ -0,0 +1,14 @@
+from .roles import get_user_role_codes
+
+
+class UserRolesMiddleware:
+    """Attach the user's role codes to ``request.user`` once per request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            get_user_role_codes(user)
+        return self.get_response(request)
@@ -4,6 +4,7 @@ import django.db.models.deletion
 
 
 def seed_roles_and_parts(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
     Role = apps.get_model('quran_center', 'Role')
     Student = apps.get_model('quran_center', 'Student')
     ExamNomination = apps.get_model('quran_center', 'ExamNomination')
@@ -17,11 +18,11 @@ def seed_roles_and_parts(apps, schema_editor):
     ]
 
     for code, name in role_choices:
-        Role.objects.get_or_create(code=code, defaults={'name': name})
+        Role.objects.using(db_alias).get_or_create(code=code, defaults={'name': name})
 
     allowed_parts = {'0', '1', '2', '3', '5', '8', '10', '13', '15', '20', '25', '30'}
 
-    for student in Student.objects.all():
+    for student in Student.objects.using(db_alias).all():
         current = (student.last_tested_part or '').strip()
         if current == 'لم يتم الاختبار من قبل':
             student.last_tested_part = '0'
@@ -29,7 +30,7 @@ def seed_roles_and_parts(apps, schema_editor):
             student.last_tested_part = '0'
         student.save(update_fields=['last_tested_part'])
 
-    for nomination in ExamNomination.objects.all():
+    for nomination in ExamNomination.objects.using(db_alias).all():
         current = (nomination.last_tested_part or '').strip()
         if current == 'لم يتم الاختبار من قبل':
             nomination.last_tested_part = '0'
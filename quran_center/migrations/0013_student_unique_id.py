@@ -3,12 +3,13 @@ import uuid
 
 
 def assign_unique_ids(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
     Student = apps.get_model('quran_center', 'Student')
 
-    for student in Student.objects.filter(student_unique_id__isnull=True):
+    for student in Student.objects.using(db_alias).filter(student_unique_id__isnull=True):
         while True:
             candidate = f"STD-{uuid.uuid4().hex[:12].upper()}"
-            if not Student.objects.filter(student_unique_id=candidate).exists():
+            if not Student.objects.using(db_alias).filter(student_unique_id=candidate).exists():
                 student.student_unique_id = candidate
                 student.save(update_fields=['student_unique_id'])
                 break
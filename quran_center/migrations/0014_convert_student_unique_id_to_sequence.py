@@ -2,9 +2,10 @@ from django.db import migrations, models
 
 
 def assign_sequence_ids(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
     Student = apps.get_model('quran_center', 'Student')
 
-    for index, student in enumerate(Student.objects.order_by('id'), start=1):
+    for index, student in enumerate(Student.objects.using(db_alias).order_by('id'), start=1):
         student.student_sequence_id = index
         student.save(update_fields=['student_sequence_id'])
 
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.11 on 2026-10-18 18:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Q
+
+
+STATUS_FIELDS = {
+    'حاضر': 'present_count',
+    'غائب': 'absent_count',
+    'غياب بعذر': 'absent_excused_count',
+    'مستأذن': 'excused_count',
+    'متأخر': 'late_count',
+}
+
+
+def build_summaries(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Student = apps.get_model('quran_center', 'Student')
+    StudentAttendanceSummary = apps.get_model('quran_center', 'StudentAttendanceSummary')
+
+    annotations = {
+        field: Count('attendance', filter=Q(attendance__status=status))
+        for status, field in STATUS_FIELDS.items()
+    }
+    annotations['absent_since_reset_count'] = Count(
+        'attendance',
+        filter=Q(attendance__status='غائب') & (
+            Q(absence_reset_at__isnull=True) | Q(attendance__created_at__date__gt=F('absence_reset_at'))
+        ),
+    )
+
+    rows = Student.objects.using(db_alias).order_by().values('id').annotate(**annotations)
+    summaries = [
+        StudentAttendanceSummary(student_id=row.pop('id'), **row)
+        for row in rows
+        if any(value for key, value in row.items() if key != 'id')
+    ]
+    StudentAttendanceSummary.objects.using(db_alias).bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0020_teacherprofile_halaqa_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentAttendanceSummary',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='attendance_summary', serialize=False, to='quran_center.student', verbose_name='الطالب')),
+                ('present_count', models.PositiveIntegerField(default=0, verbose_name='حاضر')),
+                ('absent_count', models.PositiveIntegerField(default=0, verbose_name='غائب')),
+                ('absent_excused_count', models.PositiveIntegerField(default=0, verbose_name='غياب بعذر')),
+                ('excused_count', models.PositiveIntegerField(default=0, verbose_name='منصرف')),
+                ('late_count', models.PositiveIntegerField(default=0, verbose_name='متأخر')),
+                ('absent_since_reset_count', models.PositiveIntegerField(default=0, verbose_name='الغياب منذ آخر تصفير')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')),
+            ],
+            options={
+                'verbose_name': 'ملخص حضور طالب',
+                'verbose_name_plural': 'ملخصات حضور الطلاب',
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
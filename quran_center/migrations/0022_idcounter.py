@@ -0,0 +1,35 @@
+# Generated by Django 5.2.11 on 2026-10-18 18:59
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_student_counter(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Student = apps.get_model('quran_center', 'Student')
+    IdCounter = apps.get_model('quran_center', 'IdCounter')
+    max_id = Student.objects.using(db_alias).aggregate(max_id=Max('student_unique_id'))['max_id'] or 0
+    IdCounter.objects.using(db_alias).update_or_create(name='student_unique_id', defaults={'value': max_id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0021_studentattendancesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='اسم العداد')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='آخر قيمة')),
+            ],
+            options={
+                'verbose_name': 'عداد معرفات',
+                'verbose_name_plural': 'عدادات المعرفات',
+            },
+        ),
+        migrations.RunPython(seed_student_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0022_idcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(db_index=True, max_length=32, verbose_name='رقم الدفعة')),
+                ('phone', models.CharField(blank=True, max_length=20, verbose_name='رقم الجوال')),
+                ('message', models.TextField(blank=True, verbose_name='نص الرسالة')),
+                ('section', models.CharField(blank=True, max_length=20, verbose_name='القسم')),
+                ('target_date', models.DateField(blank=True, null=True, verbose_name='تاريخ الحضور')),
+                ('status', models.CharField(choices=[('pending', 'بانتظار الإرسال'), ('sending', 'قيد الإرسال'), ('sent', 'أُرسلت'), ('failed', 'فشلت')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='عدد المحاولات')),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True, verbose_name='موعد المحاولة التالية')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الاستلام')),
+                ('last_response', models.CharField(blank=True, max_length=255, verbose_name='آخر رد من المزود')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الإرسال')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='أنشأها')),
+                ('student', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='quran_center.student', verbose_name='الطالب')),
+            ],
+            options={
+                'verbose_name': 'رسالة في صندوق الإرسال',
+                'verbose_name_plural': 'صندوق إرسال الرسائل',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='sms_outbox_due_idx')],
+            },
+        ),
+    ]
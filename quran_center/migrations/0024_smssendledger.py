@@ -0,0 +1,30 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0023_smsoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsSendLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient_key', models.CharField(max_length=40, verbose_name='المستلم')),
+                ('target_date', models.DateField(verbose_name='تاريخ الحضور')),
+                ('section', models.CharField(max_length=20, verbose_name='القسم')),
+                ('template_hash', models.CharField(max_length=16, verbose_name='بصمة القالب')),
+                ('batch_id', models.CharField(db_index=True, max_length=32, verbose_name='رقم الدفعة')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'سجل رسالة مرسلة',
+                'verbose_name_plural': 'سجل الرسائل المرسلة',
+                'constraints': [models.UniqueConstraint(fields=('recipient_key', 'target_date', 'section', 'template_hash'), name='sms_ledger_unique_send')],
+            },
+        ),
+    ]
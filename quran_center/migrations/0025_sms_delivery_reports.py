@@ -0,0 +1,48 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0024_smssendledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsDeliveryReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(blank=True, max_length=100, verbose_name='رقم الرسالة لدى المزود')),
+                ('phone', models.CharField(blank=True, max_length=20, verbose_name='رقم الجوال')),
+                ('delivery_status', models.CharField(choices=[('delivered', 'وصلت'), ('undelivered', 'لم تصل')], max_length=12, verbose_name='حالة الاستلام')),
+                ('raw_status', models.CharField(blank=True, max_length=50, verbose_name='الحالة كما وردت')),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'تقرير استلام',
+                'verbose_name_plural': 'تقارير الاستلام',
+            },
+        ),
+        migrations.AddField(
+            model_name='smsoutbox',
+            name='delivery_status',
+            field=models.CharField(blank=True, choices=[('delivered', 'وصلت'), ('undelivered', 'لم تصل')], max_length=12, verbose_name='حالة الاستلام'),
+        ),
+        migrations.AddField(
+            model_name='smsoutbox',
+            name='delivery_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='وقت تحديث الاستلام'),
+        ),
+        migrations.AddField(
+            model_name='smsoutbox',
+            name='provider',
+            field=models.CharField(blank=True, max_length=50, verbose_name='المزود'),
+        ),
+        migrations.AddField(
+            model_name='smsoutbox',
+            name='provider_message_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, verbose_name='رقم الرسالة لدى المزود'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+def normalize_saudi_phone(phone):
+    digits = ''.join(ch for ch in phone or '' if ch.isdigit())
+    if digits.startswith('966'):
+        return digits
+    if digits.startswith('0'):
+        return '966' + digits[1:]
+    if digits.startswith('5'):
+        return '966' + digits
+    return digits
+
+
+def fill_normalized_phones(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Student = apps.get_model('quran_center', 'Student')
+    students = []
+    for student in Student.objects.using(db_alias).exclude(parent_phone='').only('id', 'parent_phone').iterator(chunk_size=2000):
+        student.parent_phone_normalized = normalize_saudi_phone(student.parent_phone)
+        students.append(student)
+    Student.objects.using(db_alias).bulk_update(students, ['parent_phone_normalized'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0025_sms_delivery_reports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='parent_phone_normalized',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(fill_normalized_phones, migrations.RunPython.noop),
+    ]
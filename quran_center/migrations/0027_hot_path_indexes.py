@@ -0,0 +1,55 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0026_student_parent_phone_normalized'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['date', 'status'], name='attendance_date_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['student', 'status'], name='attendance_student_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examnomination',
+            index=models.Index(condition=models.Q(('internal_passed', False)), fields=['student'], name='nomination_internal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examnomination',
+            index=models.Index(condition=models.Q(('association_tested', False), ('internal_passed', True)), fields=['student'], name='nomination_assoc_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examnomination',
+            index=models.Index(condition=models.Q(('association_tested', True)), fields=['student'], name='nomination_assoc_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['status', 'educational_stage', 'full_name'], name='student_status_stage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(condition=models.Q(('status', 'منتظم')), fields=['teacher', 'full_name'], name='student_active_teacher_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['teacher', 'status'], name='student_teacher_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['identity_number'], name='student_identity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teacherattendance',
+            index=models.Index(fields=['date', 'status'], name='teacher_att_date_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran_center', '0027_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='academiccalendar',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='آخر تعديل'),
+        ),
+    ]
@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 
+from .sms import normalize_saudi_phone
+from .sms_templates import unknown_template_tokens
+
 # العضويات الافتراضية
 ROLE_CHOICES = [
     ('preparer', 'المُحضّر'),
@@ -80,6 +85,45 @@ class StageSupervisor(models.Model):
     def __str__(self):
         return f"مشرف {self.stage}: {self.user.username}"
 
+class IdCounter(models.Model):
+    """عداد المعرفات المتسلسلة (مثل المعرف الفريد للطالب) بدل حساب MAX عند كل إضافة"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="اسم العداد")
+    value = models.PositiveBigIntegerField(default=0, verbose_name="آخر قيمة")
+
+    class Meta:
+        verbose_name = "عداد معرفات"
+        verbose_name_plural = "عدادات المعرفات"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def allocate(cls, name, count=1, seed=None):
+        """Reserve ``count`` consecutive values of counter ``name`` and return them as a range.
+
+        The counter row is bumped with one ``UPDATE ... SET value = value + count``,
+        which locks it until the surrounding transaction ends, so concurrent
+        callers always receive disjoint ranges. ``seed`` is called to get the
+        starting value the first time the counter is used.
+        """
+        with transaction.atomic(savepoint=False):
+            updated = cls.objects.filter(name=name).update(value=F('value') + count)
+            if not updated:
+                cls.objects.get_or_create(name=name, defaults={'value': seed() if seed else 0})
+                cls.objects.filter(name=name).update(value=F('value') + count)
+            last = cls.objects.filter(name=name).values_list('value', flat=True).get()
+        return range(last - count + 1, last + 1)
+
+    @classmethod
+    def sync(cls, name, value):
+        """Move counter ``name`` forward to at least ``value`` (after ids were set by hand)."""
+        with transaction.atomic():
+            counter, _created = cls.objects.select_for_update().get_or_create(name=name, defaults={'value': value})
+            if counter.value < value:
+                counter.value = value
+                counter.save(update_fields=['value'])
+
+
 class Student(models.Model):
     # خيارات الصف الدراسي
     GRADE_CHOICES = [
@@ -97,6 +141,8 @@ class Student(models.Model):
     student_unique_id = models.PositiveIntegerField(unique=True, blank=True, null=True, editable=False, verbose_name="المعرف الفريد")
     student_phone = models.CharField(max_length=15, blank=True, null=True, verbose_name="جوال الطالب")
     parent_phone = models.CharField(max_length=15, verbose_name="جوال ولي الأمر", blank=True, default="")
+    # رقم ولي الأمر بصيغة 9665... للبحث السريع بأي صيغة أُدخل بها
+    parent_phone_normalized = models.CharField(max_length=20, blank=True, default="", db_index=True, editable=False)
     identity_number = models.CharField(max_length=100, verbose_name="رقم هوية الطالب", blank=True, null=True)
     jamiaa_id = models.CharField(max_length=100, verbose_name="رقم الجمعية", blank=True, null=True)
     parent_identity = models.CharField(max_length=50, verbose_name="رقم هوية ولي الأمر", blank=True, null=True)
@@ -118,29 +164,89 @@ class Student(models.Model):
     absence_reset_at = models.DateField(blank=True, null=True, verbose_name="تاريخ تصفير الغياب المؤقت")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    UNIQUE_ID_COUNTER = 'student_unique_id'
+    UNIQUE_ID_ATTEMPTS = 3
+    # حقول تُحفظ قيمها عند القراءة لتعرف الإشارات ما تغيّر عند الحفظ دون استعلام إضافي
+    TRACKED_FIELDS = ('parent_phone_normalized', 'absence_reset_at')
+
+    class Meta:
+        indexes = [
+            # قوائم الطلاب حسب الحالة والمرحلة مرتبة بالاسم (الانتظار، طلاب المرحلة، الإحصائيات)
+            models.Index(fields=['status', 'educational_stage', 'full_name'], name='student_status_stage_idx'),
+            # طلاب المعلم المنتظمون مرتبون بالاسم (لوحة المعلم والتحضير والترشيح)
+            models.Index(
+                fields=['teacher', 'full_name'],
+                condition=models.Q(status='منتظم'),
+                name='student_active_teacher_idx',
+            ),
+            models.Index(fields=['teacher', 'status'], name='student_teacher_status_idx'),
+            models.Index(fields=['identity_number'], name='student_identity_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self, names=None):
+        names = self.TRACKED_FIELDS if names is None else [name for name in self.TRACKED_FIELDS if name in names]
+        loaded = getattr(self, '_loaded_values', {})
+        loaded.update({name: self.__dict__[name] for name in names if name in self.__dict__})
+        self._loaded_values = loaded
+
+    def loaded_value(self, name, default=None):
+        """``name`` as last read from or written to the database, or ``default`` when unknown."""
+        return getattr(self, '_loaded_values', {}).get(name, default)
+
     def save(self, *args, **kwargs):
-        if not self.student_unique_id:
-            max_id = Student.objects.aggregate(max_id=models.Max('student_unique_id'))['max_id'] or 0
-            self.student_unique_id = max_id + 1
+        self.educational_stage = self.stage_for_grade(self.grade)
+        self.parent_phone_normalized = normalize_saudi_phone(self.parent_phone)
+
+        if self.student_unique_id:
+            super(Student, self).save(*args, **kwargs)
+            return
+
+        for attempt in range(self.UNIQUE_ID_ATTEMPTS):
+            self.student_unique_id = self.allocate_unique_ids()[0]
+            try:
+                with transaction.atomic():
+                    super(Student, self).save(*args, **kwargs)
+                return
+            except IntegrityError:
+                # المعرف مستخدم مسبقاً (أُدخل يدوياً مثلاً): نقدّم العداد ونعيد المحاولة
+                taken = Student.objects.filter(student_unique_id=self.student_unique_id).exists()
+                self.student_unique_id = None
+                if not taken or attempt == self.UNIQUE_ID_ATTEMPTS - 1:
+                    raise
+                IdCounter.sync(self.UNIQUE_ID_COUNTER, self.current_max_unique_id())
+
+    @staticmethod
+    def current_max_unique_id():
+        return Student.objects.aggregate(max_id=models.Max('student_unique_id'))['max_id'] or 0
 
-        # أتمتة المرحلة الدراسية بناءً على الصف
+    @classmethod
+    def allocate_unique_ids(cls, count=1):
+        """حجز ``count`` معرفات فريدة متتالية للطلاب الجدد"""
+        return IdCounter.allocate(cls.UNIQUE_ID_COUNTER, count, seed=cls.current_max_unique_id)
+
+    @staticmethod
+    def stage_for_grade(grade):
+        """أتمتة المرحلة الدراسية بناءً على الصف"""
         primary_early = ['1_pri', '2_pri', '3_pri']
         primary_late = ['4_pri', '5_pri', '6_pri']
         intermediate = ['1_med', '2_med', '3_med']
         secondary = ['1_sec', '2_sec', '3_sec']
 
-        if self.grade in primary_early:
-            self.educational_stage = "مبكرة"
-        elif self.grade in primary_late:
-            self.educational_stage = "عليا"
-        elif self.grade in intermediate:
-            self.educational_stage = "متوسط"
-        elif self.grade in secondary:
-            self.educational_stage = "ثانوي"
-        else:
-            self.educational_stage = "جامعي"
-            
-        super(Student, self).save(*args, **kwargs)
+        if grade in primary_early:
+            return "مبكرة"
+        elif grade in primary_late:
+            return "عليا"
+        elif grade in intermediate:
+            return "متوسط"
+        elif grade in secondary:
+            return "ثانوي"
+        return "جامعي"
 
     def __str__(self):
         return self.full_name
@@ -152,6 +258,8 @@ class AcademicCalendar(models.Model):
     week_number = models.IntegerField(unique=True, verbose_name="رقم الأسبوع")
     start_date = models.DateField(verbose_name="تاريخ بداية الأسبوع")
     end_date = models.DateField(verbose_name="تاريخ نهاية الأسبوع")
+    # يكشف تعديل التقويم للعمليات الأخرى التي تحتفظ بنسخة منه في الذاكرة
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="آخر تعديل")
     
     class Meta:
         verbose_name = "أسبوع دراسي"
@@ -163,12 +271,10 @@ class AcademicCalendar(models.Model):
     
     @classmethod
     def get_week_from_date(cls, target_date):
-        """الحصول على رقم الأسبوع من التاريخ"""
-        week = cls.objects.filter(
-            start_date__lte=target_date,
-            end_date__gte=target_date
-        ).first()
-        return week.week_number if week else 1
+        """الحصول على رقم الأسبوع من التاريخ (من نسخة التقويم المحملة في الذاكرة)"""
+        from .academic_calendar import week_for_date
+
+        return week_for_date(target_date)
 
 
 class Attendance(models.Model):
@@ -200,10 +306,56 @@ class Attendance(models.Model):
         verbose_name = "حضور"
         verbose_name_plural = "سجلات الحضور"
         ordering = ['-date']
+        indexes = [
+            # أرقام الغياب وإحصائيات اليوم: حالة واحدة في تاريخ واحد
+            models.Index(fields=['date', 'status'], name='attendance_date_status_idx'),
+            models.Index(fields=['student', 'status'], name='attendance_student_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.full_name} - {self.weekday} الأسبوع {self.week_number} - {self.status}"
 
+    def save(self, *args, **kwargs):
+        # الحفظ وتحديث ملخص الحضور في معاملة واحدة
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+class StudentAttendanceSummary(models.Model):
+    """عدادات الحضور التراكمية لكل طالب (تُحدَّث مع كل تعديل على سجلات الحضور)"""
+    # حالة الحضور مقابل اسم العداد
+    STATUS_FIELDS = {
+        'حاضر': 'present_count',
+        'غائب': 'absent_count',
+        'غياب بعذر': 'absent_excused_count',
+        'مستأذن': 'excused_count',
+        'متأخر': 'late_count',
+    }
+
+    student = models.OneToOneField(Student, on_delete=models.CASCADE, primary_key=True, related_name='attendance_summary', verbose_name="الطالب")
+    present_count = models.PositiveIntegerField(default=0, verbose_name="حاضر")
+    absent_count = models.PositiveIntegerField(default=0, verbose_name="غائب")
+    absent_excused_count = models.PositiveIntegerField(default=0, verbose_name="غياب بعذر")
+    excused_count = models.PositiveIntegerField(default=0, verbose_name="منصرف")
+    late_count = models.PositiveIntegerField(default=0, verbose_name="متأخر")
+    absent_since_reset_count = models.PositiveIntegerField(default=0, verbose_name="الغياب منذ آخر تصفير")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="آخر تحديث")
+
+    class Meta:
+        verbose_name = "ملخص حضور طالب"
+        verbose_name_plural = "ملخصات حضور الطلاب"
+
+    def __str__(self):
+        return f"ملخص حضور {self.student_id}"
+
+    @property
+    def total_days(self):
+        return sum(getattr(self, field) for field in self.STATUS_FIELDS.values())
+
 
 class TeacherAttendance(models.Model):
     WEEKDAY_CHOICES = [
@@ -234,6 +386,9 @@ class TeacherAttendance(models.Model):
         verbose_name = "حضور معلم"
         verbose_name_plural = "سجلات حضور المعلمين"
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['date', 'status'], name='teacher_att_date_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.teacher.username} - {self.weekday} الأسبوع {self.week_number} - {self.status}"
@@ -260,6 +415,17 @@ class ExamNomination(models.Model):
         verbose_name = "ترشيح اختبار"
         verbose_name_plural = "ترشيحات الاختبارات"
         ordering = ['-nomination_date']
+        # المرشحون للداخلي ثم للجمعية ثم نتائج الجمعية. الحقول المنطقية تُكتب في
+        # الاستعلام كشرط مجرد (WHERE col) فلا يفيد معها إلا فهرس جزئي بنفس الشرط
+        indexes = [
+            models.Index(fields=['student'], condition=models.Q(internal_passed=False), name='nomination_internal_idx'),
+            models.Index(
+                fields=['student'],
+                condition=models.Q(internal_passed=True, association_tested=False),
+                name='nomination_assoc_pending_idx',
+            ),
+            models.Index(fields=['student'], condition=models.Q(association_tested=True), name='nomination_assoc_done_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student.full_name} - جزء {self.last_tested_part}"
@@ -334,3 +500,97 @@ class SmsTemplateSetting(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.get_section_display()}"
+
+    def clean(self):
+        unknown_tokens = unknown_template_tokens(self.template_text)
+        if unknown_tokens:
+            raise ValidationError({'template_text': f"متغيرات غير معروفة: {' '.join(unknown_tokens)}"})
+
+
+class SmsOutbox(models.Model):
+    """رسائل SMS المجدولة للإرسال، يرسلها العامل run_sms_worker ويسجل نتيجتها"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'بانتظار الإرسال'),
+        (STATUS_SENDING, 'قيد الإرسال'),
+        (STATUS_SENT, 'أُرسلت'),
+        (STATUS_FAILED, 'فشلت'),
+    ]
+
+    DELIVERY_DELIVERED = 'delivered'
+    DELIVERY_UNDELIVERED = 'undelivered'
+    DELIVERY_CHOICES = [
+        (DELIVERY_DELIVERED, 'وصلت'),
+        (DELIVERY_UNDELIVERED, 'لم تصل'),
+    ]
+
+    batch_id = models.CharField(max_length=32, db_index=True, verbose_name="رقم الدفعة")
+    phone = models.CharField(max_length=20, blank=True, verbose_name="رقم الجوال")
+    message = models.TextField(blank=True, verbose_name="نص الرسالة")
+    section = models.CharField(max_length=20, blank=True, verbose_name="القسم")
+    target_date = models.DateField(null=True, blank=True, verbose_name="تاريخ الحضور")
+    student = models.ForeignKey(Student, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="الطالب")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="أنشأها")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="الحالة")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="عدد المحاولات")
+    next_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name="موعد المحاولة التالية")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="وقت الاستلام")
+    last_response = models.CharField(max_length=255, blank=True, verbose_name="آخر رد من المزود")
+    provider = models.CharField(max_length=50, blank=True, verbose_name="المزود")
+    provider_message_id = models.CharField(max_length=100, blank=True, db_index=True, verbose_name="رقم الرسالة لدى المزود")
+    delivery_status = models.CharField(max_length=12, choices=DELIVERY_CHOICES, blank=True, verbose_name="حالة الاستلام")
+    delivery_updated_at = models.DateTimeField(null=True, blank=True, verbose_name="وقت تحديث الاستلام")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="وقت الإرسال")
+
+    class Meta:
+        verbose_name = "رسالة في صندوق الإرسال"
+        verbose_name_plural = "صندوق إرسال الرسائل"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='sms_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.phone} - {self.get_status_display()}"
+
+
+class SmsSendLedger(models.Model):
+    """سجل ما أُرسل لكل مستلم في يوم وقسم وقالب معين، لمنع تكرار الإرسال عند إعادة الطلب"""
+    recipient_key = models.CharField(max_length=40, verbose_name="المستلم")
+    target_date = models.DateField(verbose_name="تاريخ الحضور")
+    section = models.CharField(max_length=20, verbose_name="القسم")
+    template_hash = models.CharField(max_length=16, verbose_name="بصمة القالب")
+    batch_id = models.CharField(max_length=32, db_index=True, verbose_name="رقم الدفعة")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "سجل رسالة مرسلة"
+        verbose_name_plural = "سجل الرسائل المرسلة"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient_key', 'target_date', 'section', 'template_hash'],
+                name='sms_ledger_unique_send',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient_key} - {self.section} - {self.target_date}"
+
+
+class SmsDeliveryReport(models.Model):
+    """تقارير الاستلام الواردة من المزود قبل تطبيقها على صندوق الإرسال دفعة واحدة"""
+    message_id = models.CharField(max_length=100, blank=True, verbose_name="رقم الرسالة لدى المزود")
+    phone = models.CharField(max_length=20, blank=True, verbose_name="رقم الجوال")
+    delivery_status = models.CharField(max_length=12, choices=SmsOutbox.DELIVERY_CHOICES, verbose_name="حالة الاستلام")
+    raw_status = models.CharField(max_length=50, blank=True, verbose_name="الحالة كما وردت")
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "تقرير استلام"
+        verbose_name_plural = "تقارير الاستلام"
+
+    def __str__(self):
+        return f"{self.message_id or self.phone} - {self.raw_status}"
@@ -0,0 +1,93 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .attendance_stats import get_student_summary, recent_attendance_by_student, summary_as_counts
+from .models import Student
+from .sms import normalize_saudi_phone
+
+
+FAMILY_VERSION_KEY = 'quran_center:family_report:version'
+RECENT_ATTENDANCE_LIMIT = 10
+
+
+def _family_version():
+    version = cache.get(FAMILY_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.set(FAMILY_VERSION_KEY, version, None)
+    return version
+
+
+def family_cache_key(phone, version):
+    return f'quran_center:family_report:{version}:{phone}'
+
+
+def compute_family_report(phone):
+    """Children of one normalized parent phone with their counters, teacher and recent attendance.
+
+    One indexed student query (teacher, profile and summary joined) and one
+    windowed attendance query, whatever the number of children.
+    """
+    students = list(
+        Student.objects.filter(parent_phone_normalized=phone)
+        .select_related('teacher__teacher_profile', 'attendance_summary')
+        .order_by('full_name')
+    )
+    history = recent_attendance_by_student([student.id for student in students], RECENT_ATTENDANCE_LIMIT) if students else {}
+
+    report = []
+    for student in students:
+        counts = summary_as_counts(get_student_summary(student))
+        teacher = student.teacher
+        profile = getattr(teacher, 'teacher_profile', None) if teacher else None
+        report.append({
+            'full_name': student.full_name,
+            'educational_stage': student.educational_stage,
+            'status': student.status,
+            'teacher_name': teacher.username if teacher else '',
+            'teacher_phone': profile.phone if profile else None,
+            'present_count': counts['present'],
+            'absent_count': counts['absent'],
+            'absent_excused_count': counts['absent_excused'],
+            'excused_count': counts['excused'],
+            'late_count': counts['late'],
+            'recent_attendance': history.get(student.id, []),
+        })
+    return report
+
+
+def get_family_report(parent_phone):
+    """Cached ``compute_family_report`` for a phone typed in any format (05..., 5..., 9665...).
+
+    Entries are dropped when the family's students or attendance change and
+    expire after PARENT_INQUIRY_CACHE_TIMEOUT seconds in any case.
+    """
+    phone = normalize_saudi_phone(parent_phone)
+    if not phone:
+        return []
+    key = family_cache_key(phone, _family_version())
+    report = cache.get(key)
+    if report is None:
+        report = compute_family_report(phone)
+        cache.set(key, report, getattr(settings, 'PARENT_INQUIRY_CACHE_TIMEOUT', 300))
+    return report
+
+
+def invalidate_family_reports(*phones):
+    version = _family_version()
+    cache.delete_many([family_cache_key(phone, version) for phone in phones if phone])
+
+
+def invalidate_family_reports_for_students(student_ids):
+    """Drop the cached reports of the families of ``student_ids`` (one query for their phones)."""
+    phones = set(
+        Student.objects.filter(id__in=list(student_ids)).values_list('parent_phone_normalized', flat=True)
+    )
+    invalidate_family_reports(*phones)
+
+
+def invalidate_all_family_reports():
+    """Start a new version so every family is recomputed (teacher data or bulk imports)."""
+    cache.set(FAMILY_VERSION_KEY, uuid4().hex, None)
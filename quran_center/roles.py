@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import UserRole
+
+
+ROLE_CODES_ATTR = 'role_codes'
+
+
+def role_cache_key(user_id):
+    return f'quran_center:user_roles:{user_id}'
+
+
+def get_user_role_codes(user):
+    """Role codes of ``user`` as a frozenset, loaded at most once per request.
+
+    The set is memoized on the user object and shared between requests
+    through Django's cache until a UserRole change invalidates it.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    role_codes = getattr(user, ROLE_CODES_ATTR, None)
+    if role_codes is not None:
+        return role_codes
+
+    key = role_cache_key(user.pk)
+    role_codes = cache.get(key)
+    if role_codes is None:
+        role_codes = frozenset(
+            UserRole.objects.filter(user_id=user.pk).values_list('role__code', flat=True)
+        )
+        cache.set(key, role_codes, getattr(settings, 'ROLE_CACHE_TIMEOUT', 300))
+
+    setattr(user, ROLE_CODES_ATTR, role_codes)
+    return role_codes
+
+
+def user_has_role(user, role_code):
+    """تحقق من العضوية"""
+    if not user or not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    return role_code in get_user_role_codes(user)
+
+
+def invalidate_user_roles(*user_ids):
+    cache.delete_many([role_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,140 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .academic_calendar import invalidate_calendar
+from .attendance_summary import apply_attendance_change, refresh_since_reset_count
+from .center_stats import invalidate_admin_statistics
+from .models import AcademicCalendar, Attendance, ExamNomination, Role, Student, TeacherAttendance, TeacherProfile, UserRole
+from .parent_inquiry import invalidate_all_family_reports, invalidate_family_reports, invalidate_family_reports_for_students
+from .roles import invalidate_user_roles
+from .sqlite_tuning import apply_sqlite_pragmas
+
+
+@receiver(pre_save, sender=Attendance)
+def remember_previous_attendance(sender, instance, raw=False, **kwargs):
+    """Keep the stored row state so post_save can move the counters."""
+    instance._summary_previous = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._summary_previous = (
+        Attendance.objects.filter(pk=instance.pk)
+        .values('student_id', 'status', 'created_at')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Attendance)
+def update_summary_on_attendance_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    apply_attendance_change(instance, previous=getattr(instance, '_summary_previous', None))
+
+
+@receiver(post_delete, sender=Attendance)
+def update_summary_on_attendance_delete(sender, instance, **kwargs):
+    apply_attendance_change(
+        instance,
+        previous={'student_id': instance.student_id, 'status': instance.status, 'created_at': instance.created_at},
+        removed=True,
+    )
+
+
+UNKNOWN = object()
+
+
+@receiver(post_save, sender=Student)
+def update_summary_on_absence_reset(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or created:
+        return
+    # مع update_fields يُعاد العد متى ذُكر فيها تاريخ التصفير؛ وبدونها فقط إذا
+    # تغيّر عما قُرئ (أو لم تُعرف قيمته السابقة)
+    if update_fields is not None:
+        if 'absence_reset_at' not in update_fields:
+            return
+    elif instance.loaded_value('absence_reset_at', UNKNOWN) == instance.absence_reset_at:
+        return
+    refresh_since_reset_count(instance)
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def invalidate_family_report_on_attendance_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    student_id = instance.student_id
+    transaction.on_commit(lambda: invalidate_family_reports_for_students([student_id]))
+
+
+@receiver(pre_save, sender=Student)
+def remember_previous_parent_phone(sender, instance, raw=False, **kwargs):
+    instance._previous_parent_phone = ''
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    previous = instance.loaded_value('parent_phone_normalized', UNKNOWN)
+    if previous is UNKNOWN:
+        previous = Student.objects.filter(pk=instance.pk).values_list('parent_phone_normalized', flat=True).first()
+    instance._previous_parent_phone = previous or ''
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_family_report_on_student_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    phones = [instance.parent_phone_normalized, getattr(instance, '_previous_parent_phone', '')]
+    transaction.on_commit(lambda: invalidate_family_reports(*phones))
+
+
+@receiver(post_save, sender=Student)
+def remember_saved_student_values(sender, instance, update_fields=None, **kwargs):
+    # تُسجَّل بعد بقية مستقبلات Student، فتقارن تلك بالقيم السابقة قبل تحديثها
+    instance.remember_loaded_values(update_fields)
+
+
+@receiver(post_save, sender=TeacherProfile)
+@receiver(post_delete, sender=TeacherProfile)
+def invalidate_family_reports_on_teacher_profile_change(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_all_family_reports)
+
+
+@receiver(post_save, sender=User)
+def invalidate_family_reports_on_teacher_rename(sender, instance, created=False, update_fields=None, **kwargs):
+    # تسجيل الدخول يحفظ last_login فقط، ولا يغير ما يظهر لأولياء الأمور
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    transaction.on_commit(invalidate_all_family_reports)
+
+
+@receiver(post_save, sender=AcademicCalendar)
+@receiver(post_delete, sender=AcademicCalendar)
+def invalidate_calendar_on_change(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_calendar)
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def invalidate_roles_on_user_role_change(sender, instance, **kwargs):
+    invalidate_user_roles(instance.user_id)
+
+
+@receiver(post_save, sender=Role)
+def invalidate_roles_on_role_change(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    user_ids = list(UserRole.objects.filter(role=instance).values_list('user_id', flat=True))
+    if user_ids:
+        invalidate_user_roles(*user_ids)
+
+
+def invalidate_statistics_on_change(sender, **kwargs):
+    transaction.on_commit(invalidate_admin_statistics)
+
+
+for statistics_model in (Student, Attendance, TeacherAttendance, ExamNomination):
+    post_save.connect(invalidate_statistics_on_change, sender=statistics_model, dispatch_uid=f'admin_statistics_save_{statistics_model.__name__}')
+    post_delete.connect(invalidate_statistics_on_change, sender=statistics_model, dispatch_uid=f'admin_statistics_delete_{statistics_model.__name__}')
+
+connection_created.connect(apply_sqlite_pragmas, dispatch_uid='quran_center_sqlite_pragmas')
@@ -0,0 +1,489 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import client as http_client
+from queue import Empty, LifoQueue
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_RECIPIENTS = 100
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_RESET_SECONDS = 60
+
+# أخطاء تعني أن اتصال keep-alive المحفوظ أغلقه الخادم، فنعيد المحاولة باتصال جديد
+STALE_CONNECTION_ERRORS = (http_client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+def normalize_saudi_phone(phone):
+    phone = phone or ''
+    digits = ''.join([ch for ch in phone if ch.isdigit()])
+    if digits.startswith('966'):
+        return digits
+    if digits.startswith('0'):
+        return '966' + digits[1:]
+    if digits.startswith('5'):
+        return '966' + digits
+    return digits
+
+
+class SmsProvider:
+    """Endpoint, credentials and JSON field mapping of one SMS HTTP API."""
+
+    def __init__(self, url, api_key, phone_field='to', message_field='message', sender_field='sender',
+                 sender_id='', phone_is_array=False, auth_header='Authorization', auth_scheme='Bearer',
+                 timeout=15, max_recipients=DEFAULT_MAX_RECIPIENTS, accepted_field='', rejected_field='', message_id_field='', name=''):
+        self.url = (url or '').strip()
+        self.name = name or urlsplit(self.url).hostname or 'sms'
+
+        self.api_key = (api_key or '').strip()
+        self.phone_field = phone_field
+        self.message_field = message_field
+        self.sender_field = sender_field
+        self.sender_id = (sender_id or '').strip()
+        self.phone_is_array = phone_is_array
+        self.auth_header = auth_header
+        self.auth_scheme = (auth_scheme or '').strip()
+        self.timeout = timeout
+        # أكثر عدد أرقام في الطلب الواحد، وحقول الرد التي تبين الأرقام المقبولة والمرفوضة
+        self.max_recipients = max(1, int(max_recipients)) if phone_is_array else 1
+        self.accepted_field = accepted_field
+        self.rejected_field = rejected_field
+        # حقل الرد الذي يحمل رقم الرسالة لدى المزود، لربط تقارير الاستلام بها
+        self.message_id_field = message_id_field
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            url=getattr(settings, 'SMS_API_URL', ''),
+            api_key=getattr(settings, 'SMS_API_KEY', ''),
+            phone_field=getattr(settings, 'SMS_PHONE_FIELD', 'to'),
+            message_field=getattr(settings, 'SMS_MESSAGE_FIELD', 'message'),
+            sender_field=getattr(settings, 'SMS_SENDER_FIELD', 'sender'),
+            sender_id=getattr(settings, 'SMS_SENDER_ID', ''),
+            phone_is_array=bool(getattr(settings, 'SMS_PHONE_IS_ARRAY', False)),
+            auth_header=getattr(settings, 'SMS_AUTH_HEADER', 'Authorization'),
+            auth_scheme=getattr(settings, 'SMS_AUTH_SCHEME', 'Bearer'),
+            timeout=int(getattr(settings, 'SMS_API_TIMEOUT', 15)),
+            max_recipients=getattr(settings, 'SMS_MAX_RECIPIENTS', DEFAULT_MAX_RECIPIENTS),
+            accepted_field=getattr(settings, 'SMS_ACCEPTED_FIELD', ''),
+            rejected_field=getattr(settings, 'SMS_REJECTED_FIELD', ''),
+            message_id_field=getattr(settings, 'SMS_MESSAGE_ID_FIELD', ''),
+        )
+
+    @classmethod
+    def all_from_settings(cls):
+        """Providers in failover order: SMS_PROVIDERS entries, or the single SMS_* provider."""
+        entries = getattr(settings, 'SMS_PROVIDERS', None) or []
+        if not entries:
+            return [cls.from_settings()]
+        return [cls(**entry) for entry in entries]
+
+    def configuration_error(self):
+        if not self.url:
+            return 'SMS API URL is not configured.'
+        if not self.api_key:
+            return 'SMS API key is not configured.'
+        if not self.sender_id and self.sender_field == 'src':
+            return 'SMS_SENDER_ID is not configured (required field: src).'
+        return None
+
+    def build_body(self, phone_numbers, message_text):
+        payload = {
+            self.phone_field: list(phone_numbers) if self.phone_is_array else phone_numbers[0],
+            self.message_field: message_text,
+        }
+        if self.sender_id:
+            payload[self.sender_field] = self.sender_id
+        return json.dumps(payload).encode('utf-8')
+
+    @staticmethod
+    def parse_response(response_body):
+        try:
+            data = json.loads(response_body or b'{}')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def message_id(self, response_body):
+        """The provider's id for a successful request, or '' when SMS_MESSAGE_ID_FIELD is not set."""
+        if not self.message_id_field:
+            return ''
+        value = self.parse_response(response_body).get(self.message_id_field)
+        return '' if value is None else str(value)[:100]
+
+    def rejected_phones(self, phone_numbers, response_body):
+        """Phones of a successful request that the provider's JSON response reports as not accepted."""
+        if not (self.accepted_field or self.rejected_field):
+            return set()
+        data = self.parse_response(response_body)
+
+        def phones_in(field):
+            return {
+                str(item.get(self.phone_field, '')) if isinstance(item, dict) else str(item)
+                for item in data.get(field) or []
+            }
+
+        rejected = phones_in(self.rejected_field) if self.rejected_field in data else set()
+        if self.accepted_field in data:
+            rejected |= set(phone_numbers) - phones_in(self.accepted_field)
+        return rejected
+
+    def build_headers(self):
+        auth_value = f'{self.auth_scheme} {self.api_key}' if self.auth_scheme else self.api_key
+        return {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Connection': 'keep-alive',
+            self.auth_header: auth_value,
+        }
+
+
+class ConnectionPool:
+    """Reusable keep-alive HTTP(S) connections, one idle stack per ``scheme://host:port``."""
+
+    def __init__(self, max_idle=DEFAULT_CONCURRENCY):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _stack(self, key):
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = LifoQueue(maxsize=self.max_idle)
+            return self._idle[key]
+
+    def acquire(self, scheme, host, port, timeout):
+        """Return ``(connection, reused)``; new connections are opened lazily on first request."""
+        try:
+            connection = self._stack((scheme, host, port)).get_nowait()
+            connection.timeout = timeout
+            return connection, True
+        except Empty:
+            connection_class = http_client.HTTPSConnection if scheme == 'https' else http_client.HTTPConnection
+            return connection_class(host, port, timeout=timeout), False
+
+    def release(self, scheme, host, port, connection):
+        try:
+            self._stack((scheme, host, port)).put_nowait(connection)
+        except Exception:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            stacks, self._idle = list(self._idle.values()), {}
+        for stack in stacks:
+            while True:
+                try:
+                    stack.get_nowait().close()
+                except Empty:
+                    break
+
+
+class RateLimiter:
+    """Space calls evenly so no more than ``per_second`` start in any second (0 disables it)."""
+
+    def __init__(self, per_second=0):
+        self.interval = 1.0 / per_second if per_second else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker and latency statistics for one provider.
+
+    State lives in the Django cache. It is shared by the web workers and
+    run_sms_worker (and shown to staff) only with a shared cache backend,
+    the default (file, or redis with REDIS_URL); with LocMemCache each process
+    has its own breaker and the provider status page shows only its own. After
+    SMS_BREAKER_FAILURES consecutive failures the circuit opens; once
+    SMS_BREAKER_RESET_SECONDS have passed a single half-open probe request is
+    let through, and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _locks = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.key = f'quran_center:sms_provider:{name}'
+        if failure_threshold is None:
+            failure_threshold = getattr(settings, 'SMS_BREAKER_FAILURES', DEFAULT_BREAKER_FAILURES)
+        if reset_timeout is None:
+            reset_timeout = getattr(settings, 'SMS_BREAKER_RESET_SECONDS', DEFAULT_BREAKER_RESET_SECONDS)
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        with self._locks_guard:
+            self.lock = self._locks.setdefault(name, threading.Lock())
+
+    def snapshot(self):
+        return cache.get(self.key) or {
+            'state': self.CLOSED,
+            'consecutive_failures': 0,
+            'opened_at': None,
+            'probe_started_at': None,
+            'requests': 0,
+            'errors': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            'last_error': '',
+        }
+
+    def _save(self, state):
+        cache.set(self.key, state, None)
+
+    def allow_request(self):
+        with self.lock:
+            state = self.snapshot()
+            if state['state'] == self.CLOSED:
+                return True
+
+            now = time.time()
+            started = state['probe_started_at'] if state['state'] == self.HALF_OPEN else state['opened_at']
+            if now - (started or 0) < self.reset_timeout:
+                return False
+            # هذا الطلب هو طلب الاختبار الوحيد حتى تتضح النتيجة
+            state['state'] = self.HALF_OPEN
+            state['probe_started_at'] = now
+            self._save(state)
+            return True
+
+    def record(self, healthy, latency, error=''):
+        with self.lock:
+            state = self.snapshot()
+            state['requests'] += 1
+            state['total_latency'] += latency
+            state['max_latency'] = max(state['max_latency'], latency)
+            if healthy:
+                state['state'] = self.CLOSED
+                state['consecutive_failures'] = 0
+            else:
+                state['errors'] += 1
+                state['last_error'] = error[:200]
+                state['consecutive_failures'] += 1
+                if state['state'] == self.HALF_OPEN or state['consecutive_failures'] >= self.failure_threshold:
+                    state['state'] = self.OPEN
+                    state['opened_at'] = time.time()
+            self._save(state)
+
+    def reset(self):
+        cache.delete(self.key)
+
+
+class SmsDispatcher:
+    """Send SMS messages with bounded concurrency and provider failover.
+
+    HTTP connections are kept alive and shared between worker threads, so a
+    batch costs one TLS handshake per worker rather than one per message, and
+    identical texts are combined into multi-recipient requests. A request that
+    fails at the transport level or with a 5xx moves on to the next provider
+    whose circuit is not open.
+    """
+
+    def __init__(self, provider=None, concurrency=None, rate_limit=None, pool=None, providers=None):
+        if providers is None:
+            providers = [provider] if provider else SmsProvider.all_from_settings()
+        self.providers = list(providers)
+        self.breakers = {id(item): CircuitBreaker(item.name) for item in self.providers}
+        if concurrency is None:
+            concurrency = getattr(settings, 'SMS_CONCURRENCY', DEFAULT_CONCURRENCY)
+        if rate_limit is None:
+            rate_limit = getattr(settings, 'SMS_RATE_LIMIT', 0)
+        self.concurrency = max(1, int(concurrency))
+        self.rate_limiter = RateLimiter(float(rate_limit))
+        self.pool = pool or ConnectionPool(max_idle=self.concurrency)
+
+    def _post(self, provider, body):
+        parts = urlsplit(provider.url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        headers = provider.build_headers()
+
+        while True:
+            connection, reused = self.pool.acquire(scheme, parts.hostname, port, provider.timeout)
+            try:
+                connection.request('POST', path, body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.release(scheme, parts.hostname, port, connection)
+            return response.status, response_body
+
+    def send(self, phone_number, message_text):
+        """Deliver one message and return ``{'phone', 'ok', 'info'}``."""
+        return self.send_many([phone_number], message_text)[0]
+
+    def configuration_error(self):
+        """The first provider's configuration error when no provider is usable."""
+        errors = [provider.configuration_error() for provider in self.providers]
+        return None if None in errors else errors[0]
+
+    def send_many(self, phone_numbers, message_text):
+        """Deliver one text to several phones in a single request; one result per phone."""
+        def results(ok, info, rejected=(), provider='', message_id=''):
+            return [
+                {
+                    'phone': phone,
+                    'ok': ok and phone not in rejected,
+                    'info': 'rejected' if phone in rejected else info,
+                    'provider': provider,
+                    'message_id': message_id if ok and phone not in rejected else '',
+                }
+                for phone in phone_numbers
+            ]
+
+        def label(provider, text):
+            return f'{provider.name}: {text}' if len(self.providers) > 1 else text
+
+        errors = []
+        for provider in self.providers:
+            error = provider.configuration_error()
+            if error:
+                errors.append(label(provider, error))
+                continue
+            breaker = self.breakers[id(provider)]
+            if not breaker.allow_request():
+                errors.append(label(provider, 'circuit open'))
+                continue
+
+            self.rate_limiter.wait()
+            started = time.monotonic()
+            try:
+                status_code, body = self._post(provider, provider.build_body(phone_numbers, message_text))
+            except OSError as exc:
+                info = f'Connection error: {exc}'
+                breaker.record(False, time.monotonic() - started, info)
+                errors.append(label(provider, info))
+                continue
+            except Exception as exc:
+                breaker.record(False, time.monotonic() - started, str(exc))
+                errors.append(label(provider, str(exc)))
+                continue
+
+            info = f'HTTP {status_code}'
+            if status_code >= 500:
+                breaker.record(False, time.monotonic() - started, info)
+                errors.append(label(provider, info))
+                continue
+
+            breaker.record(True, time.monotonic() - started)
+            ok = 200 <= status_code < 300
+            rejected = provider.rejected_phones(phone_numbers, body) if ok else ()
+            return results(ok, info, rejected, provider.name, provider.message_id(body) if ok else '')
+
+        return results(False, ' | '.join(errors))
+
+    def plan_requests(self, messages):
+        """Group ``[(phone, text)]`` into ``[(text, [phones], [indexes per phone])]`` requests.
+
+        Messages with identical text become one multi-recipient request, chunked
+        to the provider's ``max_recipients``; a phone repeated with the same
+        text is sent once and shares its result.
+        """
+        by_text = {}
+        for index, (phone, text) in enumerate(messages):
+            by_text.setdefault(text, {}).setdefault(phone, []).append(index)
+
+        requests = []
+        # أصغر حد بين المزودين حتى يصلح الطلب لأي مزود بديل
+        size = min(provider.max_recipients for provider in self.providers)
+        for text, phones in by_text.items():
+            phone_list = list(phones)
+            for start in range(0, len(phone_list), size):
+                chunk = phone_list[start:start + size]
+                requests.append((text, chunk, [phones[phone] for phone in chunk]))
+        return requests
+
+    def dispatch(self, messages):
+        """Send ``[(phone, text), ...]`` concurrently; results keep the input order."""
+        messages = list(messages)
+        if not messages:
+            return []
+
+        error = self.configuration_error()
+        if error:
+            return [{'phone': phone, 'ok': False, 'info': error} for phone, _text in messages]
+
+        requests = self.plan_requests(messages)
+
+        def run(request):
+            return self.send_many(request[1], request[0])
+
+        if self.concurrency == 1 or len(requests) == 1:
+            responses = [run(request) for request in requests]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(requests))) as executor:
+                responses = list(executor.map(run, requests))
+
+        results = [None] * len(messages)
+        for (_text, _phones, index_groups), request_results in zip(requests, responses):
+            for indexes, result in zip(index_groups, request_results):
+                for index in indexes:
+                    results[index] = result
+        return results
+
+    def close(self):
+        self.pool.close()
+
+
+_shared_pool = ConnectionPool()
+
+
+def dispatch_messages(messages, concurrency=None, rate_limit=None):
+    """Send ``[(phone, text), ...]`` with the configured provider, reusing the process-wide connection pool."""
+    return SmsDispatcher(concurrency=concurrency, rate_limit=rate_limit, pool=_shared_pool).dispatch(messages)
+
+
+def provider_status():
+    """Breaker state and latency statistics of every configured provider, for the staff status page."""
+    rows = []
+    for provider in SmsProvider.all_from_settings():
+        state = CircuitBreaker(provider.name).snapshot()
+        requests = state['requests']
+        rows.append({
+            'name': provider.name,
+            'host': urlsplit(provider.url).hostname or '',
+            'configuration_error': provider.configuration_error(),
+            'state': state['state'],
+            'consecutive_failures': state['consecutive_failures'],
+            'opened_at': state['opened_at'],
+            'requests': requests,
+            'errors': state['errors'],
+            'error_rate': round(100 * state['errors'] / requests, 1) if requests else 0,
+            'avg_latency_ms': round(1000 * state['total_latency'] / requests) if requests else 0,
+            'max_latency_ms': round(1000 * state['max_latency']),
+            'last_error': state['last_error'],
+        })
+    return rows
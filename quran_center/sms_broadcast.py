@@ -0,0 +1,100 @@
+from .models import StageSupervisor, Student
+from .sms_outbox import enqueue_once
+from .sms_templates import compile_template, get_arabic_weekday_name
+
+
+BROADCAST_SECTION = 'broadcast'
+# معيار الاستهداف ← حقل الطالب
+BROADCAST_FILTERS = {
+    'educational_stage': 'educational_stage',
+    'teacher': 'teacher_id',
+    'grade': 'grade',
+    'status': 'status',
+}
+# الرسالة الجماعية واحدة لكل ولي أمر، فلا تتاح فيها إلا متغيرات اليوم
+BROADCAST_FIELDS = {'today_date', 'today_day_name'}
+
+
+def broadcast_filters(data):
+    """The non-empty segment filters in ``data`` (GET or POST)."""
+    return {name: data.get(name) for name in BROADCAST_FILTERS if data.get(name)}
+
+
+def invalid_broadcast_filters(filters):
+    """Names of the filters whose value is not a teacher id or one of the field's choices."""
+    choices = {
+        'educational_stage': dict(StageSupervisor.STAGE_CHOICES),
+        'grade': dict(Student.GRADE_CHOICES),
+        'status': dict(Student.STATUS_CHOICES),
+    }
+    invalid = []
+    for name, value in filters.items():
+        valid = value.isdigit() if name == 'teacher' else value in choices[name]
+        if not valid:
+            invalid.append(name)
+    return invalid
+
+
+def recipient_phones(filters):
+    """``DISTINCT parent_phone_normalized`` of the students matching ``filters``.
+
+    Phones written differently (05..., 9665...) are already merged.
+    """
+    lookups = {BROADCAST_FILTERS[name]: value for name, value in filters.items()}
+    return (
+        Student.objects.filter(**lookups)
+        .exclude(parent_phone_normalized='')
+        .order_by('parent_phone_normalized')
+        .values_list('parent_phone_normalized', flat=True)
+        .distinct()
+    )
+
+
+def iter_recipient_phones(filters):
+    """``recipient_phones(filters)`` streamed in chunks, each phone once."""
+    yield from recipient_phones(filters).iterator(chunk_size=2000)
+
+
+def count_recipient_phones(filters):
+    """Number of distinct parent phones in the segment, with one COUNT query."""
+    return recipient_phones(filters).count()
+
+
+def broadcast_template_errors(template_text):
+    """Tokens that cannot be used in a broadcast: unknown ones and per-student fields."""
+    template = compile_template(template_text or '')
+    errors = list(template.unknown_tokens)
+    errors += [token for token, field in template.fields.items() if field not in BROADCAST_FIELDS]
+    if template.has_children_block:
+        errors.append('{{{#الأبناء}}}')
+    return list(dict.fromkeys(errors))
+
+
+def render_broadcast(template_text, target_date):
+    """The broadcast text, rendered once since every recipient gets the same message."""
+    return compile_template(template_text or '').render({
+        'today_date': target_date,
+        'today_day_name': get_arabic_weekday_name(target_date),
+    })
+
+
+def iter_broadcast_messages(filters, message_text):
+    for phone in iter_recipient_phones(filters):
+        yield {'phone': phone, 'message': message_text, 'student_id': None, 'error': None}
+
+
+def queue_broadcast(filters, template_text, target_date, user=None, force=False, retry_failed=False):
+    """Queue one message per parent phone of the segment; returns ``enqueue_once``'s summary.
+
+    The outbox worker sends the identical texts as multi-recipient requests.
+    """
+    message_text = render_broadcast(template_text, target_date)
+    return enqueue_once(
+        iter_broadcast_messages(filters, message_text),
+        section=BROADCAST_SECTION,
+        target_date=target_date,
+        template_text=template_text,
+        user=user,
+        force=force,
+        retry_failed=retry_failed,
+    )
@@ -0,0 +1,259 @@
+import hashlib
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import SmsOutbox, SmsSendLedger
+from .sms import SmsDispatcher
+
+
+DEFAULT_WORKER_BATCH_SIZE = 50
+ENQUEUE_CHUNK_SIZE = 500
+
+
+def outbox_setting(name, default):
+    return getattr(settings, f'SMS_OUTBOX_{name}', default)
+
+
+def retry_delay(attempts):
+    """Exponential backoff after ``attempts`` failed deliveries, capped by SMS_OUTBOX_MAX_BACKOFF."""
+    base = outbox_setting('RETRY_BACKOFF', 30)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), outbox_setting('MAX_BACKOFF', 3600)))
+
+
+def enqueue_messages(messages, section='', target_date=None, user=None, batch_id=None):
+    """Store ``[{'phone', 'message', 'student_id', 'error'}]`` as one outbox batch and return its id.
+
+    Entries that carry an ``error`` (no phone, empty text) are recorded as failed
+    right away so the batch keeps a complete record of every recipient.
+    ``messages`` may be a generator; it is inserted in chunks of ENQUEUE_CHUNK_SIZE.
+    """
+    batch_id = batch_id or uuid4().hex
+    now = timezone.now()
+    entries = []
+    for item in messages:
+        if len(entries) >= ENQUEUE_CHUNK_SIZE:
+            SmsOutbox.objects.bulk_create(entries)
+            entries = []
+        error = item.get('error')
+        entries.append(SmsOutbox(
+            batch_id=batch_id,
+            phone=item.get('phone') or '',
+            message=item.get('message') or '',
+            section=section,
+            target_date=target_date,
+            student_id=item.get('student_id'),
+            created_by=user,
+            status=SmsOutbox.STATUS_FAILED if error else SmsOutbox.STATUS_PENDING,
+            last_response=error or '',
+            next_attempt_at=now,
+        ))
+    SmsOutbox.objects.bulk_create(entries)
+    return batch_id
+
+
+def recipient_key(phone, student_id=None):
+    return phone or f'student:{student_id}'
+
+
+def template_hash(template_text):
+    return hashlib.sha256((template_text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def chunked(items, size):
+    """Lists of up to ``size`` consecutive ``items``, read lazily."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def failed_recipient_keys(ledger, keys):
+    """The ``keys`` whose message in the batch now holding their ledger row ended failed."""
+    batches = dict(ledger.filter(recipient_key__in=keys).values_list('recipient_key', 'batch_id'))
+    failed = SmsOutbox.objects.filter(
+        batch_id__in=set(batches.values()), status=SmsOutbox.STATUS_FAILED,
+    ).values_list('batch_id', 'phone', 'student_id')
+    failed_keys = set()
+    for batch_id, phone, student_id in failed:
+        key = recipient_key(phone, student_id)
+        if batches.get(key) == batch_id:
+            failed_keys.add(key)
+    return failed_keys
+
+
+def enqueue_once(messages, section, target_date, template_text, user=None, force=False, retry_failed=False):
+    """Enqueue a section's messages, skipping recipients already served with this template on this date.
+
+    Recipients are claimed in the send ledger with one ``bulk_create`` on its
+    unique (recipient, date, section, template) index; only the rows this batch
+    managed to insert are queued, so a double submission cannot send twice.
+    Recipients whose message failed stay in the ledger too: ``retry_failed``
+    re-claims just those, ``force`` re-claims every existing row for a
+    deliberate resend. ``messages`` may be a generator; it is claimed and queued
+    ENQUEUE_CHUNK_SIZE messages at a time, in one transaction.
+    """
+    batch_id = uuid4().hex
+    digest = template_hash(template_text)
+    ledger = SmsSendLedger.objects.filter(target_date=target_date, section=section, template_hash=digest)
+    queued = 0
+    skipped = set()
+
+    with transaction.atomic():
+        for chunk in chunked(messages, ENQUEUE_CHUNK_SIZE):
+            keyed = [
+                (recipient_key(item.get('phone'), item.get('student_id')), item)
+                for item in chunk if not item.get('error')
+            ]
+            keys = {key for key, _item in keyed}
+            if force:
+                ledger.filter(recipient_key__in=keys).update(batch_id=batch_id)
+            elif retry_failed:
+                ledger.filter(recipient_key__in=failed_recipient_keys(ledger, keys)).update(batch_id=batch_id)
+            SmsSendLedger.objects.bulk_create(
+                [
+                    SmsSendLedger(
+                        recipient_key=key, target_date=target_date, section=section,
+                        template_hash=digest, batch_id=batch_id,
+                    )
+                    for key in keys
+                ],
+                ignore_conflicts=True,
+                batch_size=500,
+            )
+            claimed = set(ledger.filter(batch_id=batch_id, recipient_key__in=keys).values_list('recipient_key', flat=True))
+            skipped |= keys - claimed
+
+            chunk_queued = [item for key, item in keyed if key in claimed]
+            chunk_queued += [item for item in chunk if item.get('error')]
+            if chunk_queued:
+                enqueue_messages(chunk_queued, section=section, target_date=target_date, user=user, batch_id=batch_id)
+                queued += len(chunk_queued)
+
+    return {
+        'batch_id': batch_id if queued else None,
+        'queued': queued,
+        'already_sent': len(skipped),
+    }
+
+
+def already_sent_counts(target_date):
+    """``{section: recipients}`` already in the send ledger for ``target_date``."""
+    rows = (
+        SmsSendLedger.objects.filter(target_date=target_date)
+        .values('section')
+        .annotate(total=Count('recipient_key', distinct=True))
+    )
+    return {row['section']: row['total'] for row in rows}
+
+
+def claim_due_messages(limit=DEFAULT_WORKER_BATCH_SIZE, now=None):
+    """Mark up to ``limit`` due messages as sending and return them.
+
+    Messages left in ``sending`` by a worker that died are claimed again once
+    SMS_OUTBOX_CLAIM_TIMEOUT seconds have passed. Such a claim counts as a
+    failed attempt, so a message that keeps crashing or hanging the worker is
+    marked failed after SMS_OUTBOX_MAX_ATTEMPTS instead of being retried forever.
+    """
+    now = now or timezone.now()
+    stale_before = now - timedelta(seconds=outbox_setting('CLAIM_TIMEOUT', 300))
+    due = (
+        Q(status=SmsOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+        | Q(status=SmsOutbox.STATUS_SENDING, claimed_at__lt=stale_before)
+    )
+
+    with transaction.atomic():
+        ids = list(
+            SmsOutbox.objects.select_for_update(skip_locked=True)
+            .filter(due)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        stale = SmsOutbox.objects.filter(id__in=ids, status=SmsOutbox.STATUS_SENDING)
+        if stale.update(attempts=F('attempts') + 1):
+            stale.filter(attempts__gte=outbox_setting('MAX_ATTEMPTS', 5)).update(
+                status=SmsOutbox.STATUS_FAILED, claimed_at=None,
+                last_response='توقف العامل أثناء الإرسال عدة مرات',
+            )
+        SmsOutbox.objects.filter(id__in=ids).exclude(status=SmsOutbox.STATUS_FAILED).update(
+            status=SmsOutbox.STATUS_SENDING, claimed_at=now,
+        )
+    return list(SmsOutbox.objects.filter(id__in=ids, status=SmsOutbox.STATUS_SENDING).order_by('id'))
+
+
+def record_results(entries, results, now=None):
+    """Apply per-recipient dispatcher results to claimed ``entries`` with one bulk_update."""
+    now = now or timezone.now()
+    max_attempts = outbox_setting('MAX_ATTEMPTS', 5)
+
+    for entry, result in zip(entries, results):
+        entry.attempts += 1
+        entry.last_response = str(result['info'])[:255]
+        entry.claimed_at = None
+        if result['ok']:
+            entry.status = SmsOutbox.STATUS_SENT
+            entry.sent_at = now
+            entry.provider = result.get('provider', '')
+            entry.provider_message_id = result.get('message_id', '')
+        elif entry.attempts >= max_attempts:
+            entry.status = SmsOutbox.STATUS_FAILED
+        else:
+            entry.status = SmsOutbox.STATUS_PENDING
+            entry.next_attempt_at = now + retry_delay(entry.attempts)
+
+    SmsOutbox.objects.bulk_update(
+        entries,
+        [
+            'status', 'attempts', 'last_response', 'claimed_at', 'sent_at', 'next_attempt_at',
+            'provider', 'provider_message_id',
+        ],
+        batch_size=500,
+    )
+
+
+def process_outbox(dispatcher=None, limit=DEFAULT_WORKER_BATCH_SIZE):
+    """Claim and deliver one batch of due messages; returns ``{'claimed', 'sent', 'failed', 'retrying'}``."""
+    entries = claim_due_messages(limit)
+    summary = {'claimed': len(entries), 'sent': 0, 'failed': 0, 'retrying': 0}
+    if not entries:
+        return summary
+
+    dispatcher = dispatcher or SmsDispatcher()
+    results = dispatcher.dispatch([(entry.phone, entry.message) for entry in entries])
+    record_results(entries, results)
+
+    for entry in entries:
+        if entry.status == SmsOutbox.STATUS_SENT:
+            summary['sent'] += 1
+        elif entry.status == SmsOutbox.STATUS_FAILED:
+            summary['failed'] += 1
+        else:
+            summary['retrying'] += 1
+    return summary
+
+
+def batch_progress(batch_id):
+    """Delivery counts of one outbox batch and its first failures, for the progress display."""
+    counts = SmsOutbox.objects.filter(batch_id=batch_id).aggregate(
+        total=Count('id'),
+        **{status: Count('id', filter=Q(status=status)) for status, _label in SmsOutbox.STATUS_CHOICES},
+    )
+    section = SmsOutbox.objects.filter(batch_id=batch_id).values_list('section', flat=True).first()
+    counts['section'] = section or ''
+    counts['done'] = counts['total'] > 0 and counts[SmsOutbox.STATUS_PENDING] + counts[SmsOutbox.STATUS_SENDING] == 0
+    counts['failures'] = [
+        f'{phone}: {response}' if phone else response
+        for phone, response in SmsOutbox.objects.filter(batch_id=batch_id, status=SmsOutbox.STATUS_FAILED)
+        .order_by('id').values_list('phone', 'last_response')[:5]
+    ]
+    return counts
@@ -0,0 +1,174 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import SmsDeliveryReport, SmsOutbox, SmsTemplateSetting
+from .sms_broadcast import BROADCAST_SECTION
+
+
+DEFAULT_APPLY_BATCH_SIZE = 1000
+# تقرير بلا رقم رسالة يُربط بآخر رسالة أُرسلت لنفس الجوال خلال هذه المدة
+PHONE_MATCH_WINDOW = timedelta(days=7)
+# التقرير الذي لم تُعرف رسالته بعد يبقى في الانتظار هذه المدة ثم يُهمل
+UNMATCHED_GRACE = timedelta(hours=1)
+
+
+def receipt_setting(name, default):
+    return getattr(settings, f'SMS_RECEIPT_{name}', default)
+
+
+def delivery_status_for(raw_status):
+    """Map a provider status to delivered/undelivered; intermediate states (queued, sent) give ''."""
+    value = str(raw_status or '').strip().lower()
+    if value in receipt_setting('DELIVERED', ['delivered']):
+        return SmsOutbox.DELIVERY_DELIVERED
+    if value in receipt_setting('UNDELIVERED', ['undelivered', 'failed']):
+        return SmsOutbox.DELIVERY_UNDELIVERED
+    return ''
+
+
+def parse_delivery_reports(payload):
+    """Unsaved ``SmsDeliveryReport`` rows from one report, a list of reports or ``{"reports": [...]}``."""
+    if isinstance(payload, dict) and isinstance(payload.get('reports'), list):
+        payload = payload['reports']
+    if isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list):
+        return []
+
+    id_field = receipt_setting('ID_FIELD', 'msgId')
+    phone_field = receipt_setting('PHONE_FIELD', 'dest')
+    status_field = receipt_setting('STATUS_FIELD', 'status')
+    reports = []
+    for item in payload:
+        if not isinstance(item, dict):
+            continue
+        message_id = str(item.get(id_field) or '').strip()[:100]
+        phone = str(item.get(phone_field) or '').strip()[:20]
+        raw_status = str(item.get(status_field) or '').strip()[:50]
+        status = delivery_status_for(raw_status)
+        if not status or not (message_id or phone):
+            continue
+        reports.append(SmsDeliveryReport(
+            message_id=message_id, phone=phone, delivery_status=status, raw_status=raw_status,
+        ))
+    return reports
+
+
+def buffer_delivery_reports(payload):
+    """Store the payload's final reports in one insert; they are applied later by ``apply_delivery_reports``."""
+    reports = parse_delivery_reports(payload)
+    SmsDeliveryReport.objects.bulk_create(reports, batch_size=500)
+    return len(reports)
+
+
+def _match_reports(reports, now):
+    """``{report.id: [outbox entries]}`` for the reports whose message is known."""
+    matches = {}
+    by_id = {}
+    ids = {report.message_id for report in reports if report.message_id}
+    for entry in SmsOutbox.objects.filter(provider_message_id__in=ids):
+        by_id.setdefault(entry.provider_message_id, []).append(entry)
+
+    phones = {report.phone for report in reports if not report.message_id}
+    latest_by_phone = {}
+    if phones:
+        candidates = (
+            SmsOutbox.objects.filter(
+                phone__in=phones, status=SmsOutbox.STATUS_SENT, sent_at__gte=now - PHONE_MATCH_WINDOW,
+            )
+            .order_by('phone', '-sent_at', '-id')
+        )
+        if connection.features.can_distinct_on_fields:
+            # PostgreSQL: DISTINCT ON (phone) returns only the latest message of each phone
+            candidates = candidates.distinct('phone')
+        for entry in candidates:
+            latest_by_phone.setdefault(entry.phone, entry)
+
+    for report in reports:
+        if report.message_id:
+            # رقم الرسالة قد يخص طلباً بعدة أرقام، فيُحدد الجوال عند وروده
+            entries = [
+                entry for entry in by_id.get(report.message_id, [])
+                if not report.phone or entry.phone == report.phone
+            ]
+        else:
+            entries = [latest_by_phone[report.phone]] if report.phone in latest_by_phone else []
+        if entries:
+            matches[report.id] = entries
+    return matches
+
+
+def apply_delivery_reports(limit=DEFAULT_APPLY_BATCH_SIZE, now=None):
+    """Apply up to ``limit`` buffered reports to the outbox with one ``bulk_update``.
+
+    Reports are applied in arrival order, so a later report for the same message
+    wins. Reports whose message is not known yet (the send result may still be
+    on its way) stay buffered for UNMATCHED_GRACE and are then dropped.
+    Returns ``{'applied', 'updated', 'waiting', 'dropped'}``.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        reports = list(
+            SmsDeliveryReport.objects.select_for_update(skip_locked=True).order_by('id')[:limit]
+        )
+        if not reports:
+            return {'applied': 0, 'updated': 0, 'waiting': 0, 'dropped': 0}
+
+        matches = _match_reports(reports, now)
+        changed = {}
+        for report in reports:
+            for entry in matches.get(report.id, []):
+                entry = changed.setdefault(entry.id, entry)
+                entry.delivery_status = report.delivery_status
+                entry.delivery_updated_at = now
+        SmsOutbox.objects.bulk_update(list(changed.values()), ['delivery_status', 'delivery_updated_at'], batch_size=500)
+
+        waiting = [report.id for report in reports if report.id not in matches and report.received_at > now - UNMATCHED_GRACE]
+        done = [report.id for report in reports if report.id not in waiting]
+        SmsDeliveryReport.objects.filter(id__in=done).delete()
+
+    return {
+        'applied': len(matches),
+        'updated': len(changed),
+        'waiting': len(waiting),
+        'dropped': len(done) - len(matches),
+    }
+
+
+def delivery_rates(start_date, end_date):
+    """Per-section delivery counts and rate of messages sent for ``start_date``..``end_date``.
+
+    Rows follow SmsTemplateSetting.SECTION_CHOICES, then broadcasts; ``rate`` is the delivered
+    share of messages with a final report, or None before any report arrives.
+    """
+    counts = {
+        row['section']: row
+        for row in SmsOutbox.objects.filter(
+            status=SmsOutbox.STATUS_SENT, target_date__gte=start_date, target_date__lte=end_date,
+        )
+        .values('section')
+        .annotate(
+            sent=Count('id'),
+            delivered=Count('id', filter=Q(delivery_status=SmsOutbox.DELIVERY_DELIVERED)),
+            undelivered=Count('id', filter=Q(delivery_status=SmsOutbox.DELIVERY_UNDELIVERED)),
+        )
+    }
+
+    rows = []
+    for section, label in SmsTemplateSetting.SECTION_CHOICES + [(BROADCAST_SECTION, 'رسائل جماعية')]:
+        row = counts.get(section, {'sent': 0, 'delivered': 0, 'undelivered': 0})
+        reported = row['delivered'] + row['undelivered']
+        rows.append({
+            'section': section,
+            'label': label,
+            'sent': row['sent'],
+            'delivered': row['delivered'],
+            'undelivered': row['undelivered'],
+            'awaiting': row['sent'] - reported,
+            'rate': round(row['delivered'] * 100 / reported, 1) if reported else None,
+        })
+    return rows
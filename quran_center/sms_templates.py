@@ -0,0 +1,223 @@
+import math
+import re
+from functools import lru_cache
+
+from django.conf import settings
+
+
+TOKEN_RE = re.compile(r'\{\{\{(.*?)\}\}\}')
+
+# اسم المتغير في القالب ← مفتاح بيانات الصف
+PLACEHOLDER_FIELDS = {
+    'first_name': 'first_name',
+    'full_name': 'full_name',
+    'phone_number': 'phone_number',
+    'teacher_name': 'teacher_name',
+    'teacher_phone': 'teacher_phone',
+    'total_days': 'total_days',
+    'today_date': 'today_date',
+    'today_day_name': 'today_day_name',
+    # Arabic aliases for template variables.
+    'الاسم_الأول': 'first_name',
+    'الاسم_الكامل': 'full_name',
+    'رقم_الجوال': 'phone_number',
+    'اسم_المعلم': 'teacher_name',
+    'جوال_المعلم': 'teacher_phone',
+    'رقم_جوال_المعلم': 'teacher_phone',
+    'المجموع': 'total_days',
+    'التاريخ': 'today_date',
+    'اليوم': 'today_day_name',
+    # Household messages (one SMS per parent phone).
+    'children_names': 'children_names',
+    'children_count': 'children_count',
+    'أسماء_الأبناء': 'children_names',
+    'عدد_الأبناء': 'children_count',
+}
+
+# {{{#الأبناء}}} ... {{{/الأبناء}}} يتكرر لكل ابن في رسالة ولي الأمر
+CHILDREN_BLOCKS = {'children', 'الأبناء'}
+
+ARABIC_WEEKDAY_NAMES = {
+    0: 'الاثنين',
+    1: 'الثلاثاء',
+    2: 'الأربعاء',
+    3: 'الخميس',
+    4: 'الجمعة',
+    5: 'السبت',
+    6: 'الأحد',
+}
+
+GSM7_BASIC = set(
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+GSM7_EXTENDED = set('^{}\\[~]|€')
+
+
+class CompiledTemplate:
+    """An SMS template split once into literal text, placeholder and children-block segments.
+
+    Segments are ``('text', str)``, ``('field', row_key)`` or
+    ``('block', [segments])``; a block is rendered once per entry of the row's
+    ``children`` list, or once with the row itself for a single student.
+    """
+
+    def __init__(self, text):
+        self.text = text or ''
+        self.unknown_tokens = []
+        # المتغيرات المستخدمة في القالب: نص المتغير ← مفتاح بيانات الصف
+        self.fields = {}
+        self.has_children_block = False
+
+        root = []
+        stack = [root]
+        open_tokens = []
+        position = 0
+        for match in TOKEN_RE.finditer(self.text):
+            name = match.group(1)
+            if name[:1] in '#/' and name[1:] in CHILDREN_BLOCKS:
+                opening = name[0] == '#'
+                if not opening and len(stack) == 1:
+                    self.unknown_tokens.append(match.group(0))
+                    continue
+                self._append_text(stack[-1], self.text[position:match.start()])
+                if opening:
+                    block = []
+                    stack[-1].append(('block', block))
+                    stack.append(block)
+                    open_tokens.append(match.group(0))
+                    self.has_children_block = True
+                else:
+                    stack.pop()
+                    open_tokens.pop()
+                position = match.end()
+                continue
+
+            field = PLACEHOLDER_FIELDS.get(name)
+            if field is None:
+                # غير المعروف يبقى نصاً كما هو، كما في العارض السابق
+                self.unknown_tokens.append(match.group(0))
+                continue
+            self._append_text(stack[-1], self.text[position:match.start()])
+            stack[-1].append(('field', field))
+            self.fields[match.group(0)] = field
+            position = match.end()
+
+        self._append_text(stack[-1], self.text[position:])
+        # كتلة مفتوحة بلا إغلاق تُعد خطأ في القالب
+        self.unknown_tokens.extend(open_tokens)
+        self.segments = root
+
+    @staticmethod
+    def _append_text(segments, text):
+        if text:
+            segments.append(('text', text))
+
+    def _render_segments(self, segments, row_data):
+        parts = []
+        for kind, value in segments:
+            if kind == 'text':
+                parts.append(value)
+            elif kind == 'field':
+                parts.append(str(row_data.get(value, '') or ''))
+            else:
+                for child in row_data.get('children') or [row_data]:
+                    parts.append(self._render_segments(value, child))
+        return ''.join(parts)
+
+    def render(self, row_data):
+        if not self.text:
+            return ''
+        return self._render_segments(self.segments, row_data).strip()
+
+
+@lru_cache(maxsize=128)
+def compile_template(template_text):
+    return CompiledTemplate(template_text)
+
+
+def render_message_template(template_text, row_data):
+    """Render a template like: Hello {{{first_name}}}."""
+    return compile_template(template_text or '').render(row_data)
+
+
+def unknown_template_tokens(template_text):
+    """Placeholders in ``template_text`` that the renderer does not know, in order of appearance."""
+    return list(dict.fromkeys(compile_template(template_text or '').unknown_tokens))
+
+
+def sms_segment_count(text):
+    """Number of SMS parts needed for ``text``: GSM-7 when possible, otherwise UCS-2."""
+    if not text:
+        return 0
+    if all(char in GSM7_BASIC or char in GSM7_EXTENDED for char in text):
+        units = sum(2 if char in GSM7_EXTENDED else 1 for char in text)
+        single, multipart = 160, 153
+    else:
+        # UCS-2 counts UTF-16 code units, so characters outside the BMP take two
+        units = len(text.encode('utf-16-le')) // 2
+        single, multipart = 70, 67
+    return 1 if units <= single else math.ceil(units / multipart)
+
+
+def estimate_batch(texts):
+    """Message, segment and cost totals for a batch of rendered texts (SMS_SEGMENT_COST per segment)."""
+    message_count = 0
+    segment_count = 0
+    for text in texts:
+        message_count += 1
+        segment_count += sms_segment_count(text)
+    segment_cost = float(getattr(settings, 'SMS_SEGMENT_COST', 0))
+    return {
+        'messages': message_count,
+        'segments': segment_count,
+        'cost': round(segment_count * segment_cost, 2),
+    }
+
+
+def get_arabic_weekday_name(target_date):
+    return ARABIC_WEEKDAY_NAMES.get(target_date.weekday(), 'الأحد')
+
+
+def join_names(names):
+    names = [name for name in names if name]
+    if len(names) <= 1:
+        return ''.join(names)
+    return '، '.join(names[:-1]) + ' و' + names[-1]
+
+
+def coalesce_households(rows):
+    """Merge rows that share a parent phone into one household row, keeping first-seen order.
+
+    A household row keeps the first child's fields and adds ``children`` (the
+    original rows), ``children_names`` and ``children_count``. For templates
+    without a children block, names are joined ("أحمد وخالد") and
+    ``total_days`` lists each child's total.
+    """
+    households = {}
+    ordered = []
+    for row in rows:
+        phone = row.get('phone_number')
+        if not phone:
+            ordered.append(dict(row, children=[row], children_names=row.get('first_name', ''), children_count=1))
+            continue
+        if phone not in households:
+            households[phone] = []
+            ordered.append(phone)
+        households[phone].append(row)
+
+    for index, item in enumerate(ordered):
+        if isinstance(item, dict):
+            continue
+        children = households[item]
+        household = dict(children[0], children=children, children_count=len(children))
+        household['children_names'] = join_names([child.get('first_name', '') for child in children])
+        if len(children) > 1:
+            household['first_name'] = household['children_names']
+            household['full_name'] = join_names([child.get('full_name', '') for child in children])
+            household['total_days'] = '، '.join(
+                f"{child.get('first_name', '')}: {child.get('total_days', '')}" for child in children
+            )
+            household['teacher_name'] = join_names(list(dict.fromkeys(child.get('teacher_name', '') for child in children)))
+        ordered[index] = household
+    return ordered
@@ -0,0 +1,71 @@
+import functools
+import random
+import re
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 134217728,
+    'temp_store': 'MEMORY',
+}
+PRAGMA_NAME_RE = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE_RE = re.compile(r'^-?\w+$')
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database schema is locked')
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """``connection_created`` receiver: run the SQLITE_PRAGMAS on every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            value = str(value)
+            if not PRAGMA_NAME_RE.match(name) or not PRAGMA_VALUE_RE.match(value):
+                raise ValueError(f'Invalid SQLite pragma {name}={value}')
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(text in str(exc).lower() for text in LOCK_ERRORS)
+
+
+def write_transaction(func=None, *, attempts=None, backoff=None, using=None):
+    """Run ``func`` in its own ``transaction.atomic()``, retrying it when SQLite reports a lock.
+
+    With ``"transaction_mode": "IMMEDIATE"`` the write lock is taken at BEGIN, so
+    a busy database fails before any work is done and the whole call can be
+    repeated. It is tried up to SQLITE_WRITE_ATTEMPTS times, sleeping
+    SQLITE_WRITE_RETRY_BACKOFF seconds (doubled each time, with jitter) in
+    between. Calls nested in an outer transaction are not retried: only the
+    outermost block can start over.
+    """
+    if func is None:
+        return functools.partial(write_transaction, attempts=attempts, backoff=backoff, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        total = attempts or getattr(settings, 'SQLITE_WRITE_ATTEMPTS', 5)
+        delay = backoff if backoff is not None else getattr(settings, 'SQLITE_WRITE_RETRY_BACKOFF', 0.05)
+        for attempt in range(total):
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                nested = transaction.get_connection(using).in_atomic_block
+                if not is_lock_error(exc) or nested or attempt == total - 1:
+                    raise
+                time.sleep(delay * (2 ** attempt) * (1 + random.random()))
+
+    return wrapper
+
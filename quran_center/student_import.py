@@ -0,0 +1,265 @@
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+
+from django.db import transaction
+from openpyxl import load_workbook
+
+from .center_stats import invalidate_admin_statistics
+from .parent_inquiry import invalidate_all_family_reports
+from .models import Student
+from .sms import normalize_saudi_phone
+
+
+IMPORT_CHUNK_SIZE = 500
+
+
+def normalize_excel_value(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def normalize_arabic_text(value):
+    text = normalize_excel_value(value)
+    replacements = {
+        'أ': 'ا',
+        'إ': 'ا',
+        'آ': 'ا',
+        'ى': 'ي',
+        'ة': 'ه',
+    }
+    for old_char, new_char in replacements.items():
+        text = text.replace(old_char, new_char)
+    return ' '.join(text.split()).lower()
+
+
+GRADE_LABELS = {
+    'أول ابتدائي': '1_pri',
+    'اول ابتدائي': '1_pri',
+    'اولى ابتدائي': '1_pri',
+    'اولي ابتدائي': '1_pri',
+    'ثاني ابتدائي': '2_pri',
+    'ثانيه ابتدائي': '2_pri',
+    'ثالث ابتدائي': '3_pri',
+    'ثالثه ابتدائي': '3_pri',
+    'رابع ابتدائي': '4_pri',
+    'رابعه ابتدائي': '4_pri',
+    'خامس ابتدائي': '5_pri',
+    'خامسه ابتدائي': '5_pri',
+    'سادس ابتدائي': '6_pri',
+    'سادسه ابتدائي': '6_pri',
+    'أول متوسط': '1_med',
+    'اول متوسط': '1_med',
+    'اولى متوسط': '1_med',
+    'اولي متوسط': '1_med',
+    'ثاني متوسط': '2_med',
+    'ثالث متوسط': '3_med',
+    'أول ثانوي': '1_sec',
+    'اول ثانوي': '1_sec',
+    'ثاني ثانوي': '2_sec',
+    'ثالث ثانوي': '3_sec',
+    'جامعي': 'uni',
+}
+
+# Values that mean "not selected yet" are accepted as empty grade.
+EMPTY_GRADE_MARKERS = ['لم يتم التحديد بعد', 'غير محدد', 'غير محدده', 'لا يوجد']
+
+_normalized_grade_labels = None
+_normalized_empty_markers = None
+
+
+def map_grade_from_excel(raw_grade):
+    global _normalized_grade_labels, _normalized_empty_markers
+
+    text_value = normalize_excel_value(raw_grade)
+    if not text_value:
+        return ''
+
+    # Accept internal code directly (e.g. 3_pri).
+    valid_codes = {choice[0] for choice in Student.GRADE_CHOICES}
+    if text_value in valid_codes:
+        return text_value
+
+    # The normalized lookup tables are built once per process, not per row.
+    if _normalized_grade_labels is None:
+        _normalized_grade_labels = {normalize_arabic_text(label): code for label, code in GRADE_LABELS.items()}
+        _normalized_empty_markers = {normalize_arabic_text(marker) for marker in EMPTY_GRADE_MARKERS}
+
+    normalized_text = normalize_arabic_text(text_value)
+    if normalized_text in _normalized_empty_markers:
+        return ''
+
+    # Accept official labels and common writing variants.
+    return _normalized_grade_labels.get(normalized_text, '')
+
+
+def parse_excel_birth_date(value):
+    if value in (None, ''):
+        return ''
+
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    if isinstance(value, (int, float)):
+        try:
+            base_date = datetime(1899, 12, 30)
+            parsed = base_date + timedelta(days=float(value))
+            return parsed.strftime('%Y-%m-%d')
+        except Exception:
+            return str(value)
+
+    text = str(value).strip()
+    digit_map = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
+    text = text.translate(digit_map)
+    return text
+
+
+class SheetReadError(Exception):
+    """The workbook could not be read while its rows were streamed (a corrupt sheet, for example)."""
+
+
+def iter_excel_sheet_rows(uploaded_file):
+    """Open the first sheet and return a generator of ``{'excel_row', 'data'}`` dicts.
+
+    The workbook is opened read-only before returning, so an invalid file fails
+    here, while the rows themselves are streamed without loading the sheet whole;
+    read errors met on the way are raised as ``SheetReadError``.
+    """
+    workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+
+    def read_next(rows):
+        try:
+            return next(rows, None)
+        except Exception as exc:
+            raise SheetReadError(str(exc)) from exc
+
+    def generate():
+        try:
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+            except Exception as exc:
+                raise SheetReadError(str(exc)) from exc
+            header_row = read_next(rows)
+            if header_row is None:
+                return
+            headers = [normalize_excel_value(item) for item in header_row]
+
+            row_idx = 1
+            while (row_values := read_next(rows)) is not None:
+                row_idx += 1
+                row_data = {}
+                for col_idx, header in enumerate(headers):
+                    if not header:
+                        continue
+                    row_data[header] = row_values[col_idx] if col_idx < len(row_values) else None
+                yield {'excel_row': row_idx, 'data': row_data}
+        finally:
+            workbook.close()
+
+    return generate()
+
+
+def build_student_from_row(data, known_identities, last_part_choices, status_default):
+    """Validate one sheet row and return ``(student, error)``; both None for empty rows."""
+    full_name = normalize_excel_value(data.get('full_name'))
+    identity_number = normalize_excel_value(data.get('identity_number'))
+
+    if not full_name and not identity_number:
+        return None, None
+
+    if not identity_number:
+        identity_number = f'GEN_{uuid4().hex[:12]}'
+
+    if identity_number in known_identities:
+        return None, f'رقم هوية الطالب {identity_number} موجود مسبقاً.'
+
+    grade_input = data.get('grade')
+    grade = map_grade_from_excel(grade_input)
+    if normalize_excel_value(grade_input) and not grade:
+        return None, f'الصف الدراسي "{normalize_excel_value(grade_input)}" غير صحيح.'
+
+    last_tested_part = normalize_excel_value(data.get('last_tested_part')) or '0'
+    if last_tested_part not in last_part_choices:
+        last_tested_part = '0'
+
+    parent_phone = normalize_excel_value(data.get('parent_phone'))
+    student = Student(
+        full_name=full_name,
+        student_phone=normalize_excel_value(data.get('student_phone')),
+        parent_phone=parent_phone,
+        parent_phone_normalized=normalize_saudi_phone(parent_phone),
+        identity_number=identity_number,
+        jamiaa_id=normalize_excel_value(data.get('jamiaa_id')),
+        parent_identity=normalize_excel_value(data.get('parent_identity')),
+        grade=grade,
+        educational_stage=Student.stage_for_grade(grade),
+        birth_date=parse_excel_birth_date(data.get('birth_date')),
+        last_tested_part=last_tested_part,
+        previous_center=normalize_excel_value(data.get('previous_center')),
+        neighborhood=normalize_excel_value(data.get('neighborhood')),
+        status=status_default,
+    )
+    return student, None
+
+
+def import_students(rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """Insert valid rows as students in chunked ``bulk_create`` calls inside one transaction.
+
+    Existing identity numbers are preloaded into a set, so duplicates (in the
+    database or earlier in the same sheet) are detected without a query per
+    row, and every chunk takes its ``student_unique_id`` values as one reserved
+    block from the shared counter.
+    """
+    last_part_choices = {choice[0] for choice in Student._meta.get_field('last_tested_part').choices}
+    status_default = Student._meta.get_field('status').default
+
+    created_count = 0
+    skipped_count = 0
+    row_errors = []
+
+    with transaction.atomic():
+        known_identities = set(
+            Student.objects.exclude(identity_number__isnull=True).values_list('identity_number', flat=True)
+        )
+        pending = []
+
+        def insert_pending():
+            for student, unique_id in zip(pending, Student.allocate_unique_ids(len(pending))):
+                student.student_unique_id = unique_id
+            Student.objects.bulk_create(pending)
+            return len(pending)
+
+        for row in rows:
+            student, error = build_student_from_row(
+                row['data'], known_identities, last_part_choices, status_default
+            )
+            if error:
+                skipped_count += 1
+                row_errors.append(f'السطر {row["excel_row"]}: {error}')
+                continue
+            if student is None:
+                skipped_count += 1
+                continue
+            known_identities.add(student.identity_number)
+            pending.append(student)
+
+            if len(pending) >= chunk_size:
+                created_count += insert_pending()
+                pending = []
+
+        if pending:
+            created_count += insert_pending()
+
+        if created_count:
+            # bulk_create لا يطلق إشارات الحفظ
+            transaction.on_commit(invalidate_admin_statistics)
+            transaction.on_commit(invalidate_all_family_reports)
+
+    return {
+        'created_count': created_count,
+        'skipped_count': skipped_count,
+        'row_errors': row_errors,
+    }
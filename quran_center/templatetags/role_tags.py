@@ -1,16 +1,12 @@
 from django import template
-from quran_center.models import UserRole
+from quran_center.roles import user_has_role
 
 register = template.Library()
 
 
 @register.filter
 def has_role(user, role_code):
-    if not user or not user.is_authenticated:
-        return False
-    if user.is_superuser:
-        return True
-    return UserRole.objects.filter(user=user, role__code=role_code).exists()
+    return user_has_role(user, role_code)
 
 
 @register.filter
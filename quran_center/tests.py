@@ -1,3 +1,1632 @@
-from django.test import TestCase
+from datetime import date, timedelta
+import json
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .academic_calendar import invalidate_calendar, week_for_date
+from .attendance_records import save_students_attendance, save_teachers_attendance
+from .attendance_stats import attendance_counts_by_student, build_student_attendance_stats, find_at_risk_students, teacher_roll_call
+from .center_stats import STATS_VERSION_KEY, compute_admin_statistics, get_admin_statistics
+from .attendance_summary import find_summary_mismatches
+from .models import AcademicCalendar, Attendance, ExamNomination, IdCounter, Role, SmsDeliveryReport, SmsOutbox, SmsSendLedger, SmsTemplateSetting, StageSupervisor, Student, StudentAttendanceSummary, TeacherAttendance, TeacherProfile, UserRole
+from .roles import get_user_role_codes, user_has_role
+from .sms import CircuitBreaker, SmsDispatcher, SmsProvider, dispatch_messages
+from .sqlite_tuning import write_transaction
+from .sms_templates import coalesce_households, compile_template, estimate_batch, render_message_template, sms_segment_count
+from .sms_outbox import ENQUEUE_CHUNK_SIZE, batch_progress, claim_due_messages, enqueue_messages, enqueue_once, process_outbox, record_results
+from .parent_inquiry import get_family_report
+from .sms_broadcast import BROADCAST_SECTION, broadcast_template_errors, count_recipient_phones, iter_recipient_phones, queue_broadcast
+from .sms_receipts import UNMATCHED_GRACE, apply_delivery_reports, buffer_delivery_reports, delivery_rates
+from .student_import import import_students, iter_excel_sheet_rows
+from .management.commands.benchmark_student_import import build_sample_workbook
+from .management.commands.copy_sqlite_data import SOURCE_ALIAS, register_sqlite_source, unregister_sqlite_source
+from .management.commands.explain_hot_queries import full_scans
+
+
+def make_student(teacher=None, index=0, **extra):
+    data = {
+        'full_name': f'طالب {index}',
+        'parent_phone': f'05{index:08d}',
+        'grade': '4_pri',
+        'status': 'منتظم',
+        'teacher': teacher,
+    }
+    data.update(extra)
+    return Student.objects.create(**data)
+
+
+class StubSmsServer:
+    """Local HTTP/1.1 keep-alive SMS endpoint with artificial latency, for dispatcher tests.
+
+    Each accepted request gets a ``msgId``; ``delivery_reports()`` builds the
+    receipts the provider would post back for the phones it accepted.
+    """
+
+    def __init__(self, latency=0.0, failing_phones=(), rejected_phones=()):
+        self.latency = latency
+        self.failing_phones = set(failing_phones)
+        self.rejected_phones = set(rejected_phones)
+        self.requests = []
+        self.client_ports = set()
+        self.accepted = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.lock:
+                    stub.requests.append({'payload': payload, 'headers': dict(self.headers)})
+                    stub.client_ports.add(self.client_address[1])
+                    message_id = f'm{len(stub.requests)}'
+                time.sleep(stub.latency)
+                phones = payload['dests'] if isinstance(payload['dests'], list) else [payload['dests']]
+                status = 500 if stub.failing_phones.intersection(phones) else 200
+                with stub.lock:
+                    if status == 200:
+                        stub.accepted += [(message_id, phone) for phone in phones if phone not in stub.rejected_phones]
+                body = json.dumps({
+                    'msgId': message_id,
+                    'accepted': [phone for phone in phones if phone not in stub.rejected_phones],
+                    'rejected': [{'dests': phone} for phone in phones if phone in stub.rejected_phones],
+                }).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/msgs/sms'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def provider(self, **extra):
+        options = {
+            'name': f'stub-{self.server.server_address[1]}', 'url': self.url, 'api_key': 'key', 'phone_field': 'dests', 'message_field': 'body',
+            'sender_field': 'src', 'sender_id': 'CENTER', 'phone_is_array': True, 'timeout': 5,
+        }
+        options.update(extra)
+        return SmsProvider(**options)
+
+    def delivery_reports(self, status='DELIVRD', undelivered=()):
+        return [
+            {'msgId': message_id, 'dest': phone, 'status': 'UNDELIV' if phone in undelivered else status}
+            for message_id, phone in self.accepted
+        ]
+
+
+def make_attendance(student, target_date, status='حاضر'):
+    return Attendance.objects.create(
+        student=student,
+        date=target_date,
+        weekday='الأحد',
+        week_number=1,
+        status=status,
+    )
+
+
+class AttendanceStatsTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user('teacher', password='pass')
+        self.base_date = date(2026, 2, 1)
+
+    def add_students(self, count, start=0):
+        statuses = ['حاضر', 'غائب', 'غياب بعذر', 'مستأذن', 'متأخر']
+        for index in range(start, start + count):
+            student = make_student(self.teacher, index)
+            for offset, status in enumerate(statuses):
+                make_attendance(student, self.base_date + timedelta(days=offset), status)
+
+    def test_counts_by_student(self):
+        student = make_student(self.teacher, 1)
+        make_attendance(student, self.base_date, 'غائب')
+        make_attendance(student, self.base_date + timedelta(days=1), 'غائب')
+        make_attendance(student, self.base_date + timedelta(days=2), 'حاضر')
+
+        counts = attendance_counts_by_student([student.id])[student.id]
+        self.assertEqual(counts['total_days'], 3)
+        self.assertEqual(counts['absent'], 2)
+        self.assertEqual(counts['present'], 1)
+        self.assertEqual(counts['late'], 0)
+
+        in_range = attendance_counts_by_student(
+            Student.objects.filter(id=student.id),
+            start_date=self.base_date + timedelta(days=1),
+        )[student.id]
+        self.assertEqual(in_range['total_days'], 2)
+        self.assertEqual(in_range['absent'], 1)
+
+    def test_stats_sorted_by_absences_with_history(self):
+        quiet = make_student(self.teacher, 1, full_name='أ')
+        absent = make_student(self.teacher, 2, full_name='ب')
+        make_attendance(quiet, self.base_date, 'حاضر')
+        make_attendance(absent, self.base_date, 'غائب')
+        make_attendance(absent, self.base_date + timedelta(days=1), 'متأخر')
+
+        rows = build_student_attendance_stats([quiet, absent])
+        self.assertEqual([row['student'] for row in rows], [absent, quiet])
+        self.assertEqual(rows[0]['non_present_count'], 2)
+        self.assertEqual(
+            [record['date'] for record in rows[0]['all_attendance']],
+            [self.base_date + timedelta(days=1), self.base_date],
+        )
+
+    def dashboard_query_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('teacher_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_dashboard_query_count_is_constant(self):
+        self.client.login(username='teacher', password='pass')
+        self.add_students(2)
+        small = self.dashboard_query_count()
+        self.add_students(20, start=2)
+        large = self.dashboard_query_count()
+        self.assertEqual(small, large)
+
+
+class AtRiskStudentsTests(TestCase):
+    def setUp(self):
+        self.base_date = date(2026, 2, 1)
+        self.frequent = make_student(index=1, full_name='كثير الغياب')
+        self.rare = make_student(index=2, full_name='قليل الغياب')
+        for offset in range(5):
+            make_attendance(self.frequent, self.base_date + timedelta(days=offset), 'غائب')
+        make_attendance(self.rare, self.base_date, 'غائب')
+
+    def test_threshold(self):
+        at_risk = find_at_risk_students(threshold=5)
+        self.assertEqual([item['student'] for item in at_risk], [self.frequent])
+        self.assertEqual(at_risk[0]['temp_count'], 5)
+        self.assertEqual(at_risk[0]['total_absences'], 5)
+
+        self.assertEqual(len(find_at_risk_students(threshold=1)), 2)
+
+    def test_reset_date_excludes_older_absences(self):
+        self.frequent.absence_reset_at = date.today() + timedelta(days=1)
+        self.frequent.save()
+        self.assertEqual(find_at_risk_students(threshold=5), [])
+        totals = {item['student']: item['total_absences'] for item in find_at_risk_students(threshold=0)}
+        self.assertEqual(totals[self.frequent], 5)
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            find_at_risk_students(threshold=1)
+
+    @override_settings(ABSENCE_RISK_THRESHOLD=1)
+    def test_command_uses_settings_threshold(self):
+        out = StringIO()
+        call_command('report_at_risk_students', stdout=out)
+        self.assertIn('2 student(s) at or above 1 absence(s).', out.getvalue())
+
+
+class StudentAttendanceSummaryTests(TestCase):
+    def setUp(self):
+        self.student = make_student(index=1)
+        self.base_date = date(2026, 2, 1)
+
+    def summary(self):
+        return StudentAttendanceSummary.objects.get(student=self.student)
+
+    def test_counters_follow_create_update_and_delete(self):
+        first = make_attendance(self.student, self.base_date, 'غائب')
+        make_attendance(self.student, self.base_date + timedelta(days=1), 'حاضر')
+        summary = self.summary()
+        self.assertEqual((summary.absent_count, summary.present_count, summary.absent_since_reset_count), (1, 1, 1))
+
+        first.status = 'متأخر'
+        first.save()
+        summary = self.summary()
+        self.assertEqual((summary.absent_count, summary.late_count, summary.absent_since_reset_count), (0, 1, 0))
+
+        Attendance.objects.update_or_create(
+            student=self.student,
+            date=self.base_date + timedelta(days=1),
+            defaults={'status': 'غائب', 'weekday': 'الاثنين', 'week_number': 1},
+        )
+        summary = self.summary()
+        self.assertEqual((summary.absent_count, summary.present_count), (1, 0))
+
+        Attendance.objects.filter(student=self.student).delete()
+        summary = self.summary()
+        self.assertEqual(summary.total_days, 0)
+        self.assertEqual(find_summary_mismatches(), [])
+
+    def test_reset_recounts_since_reset_absences(self):
+        make_attendance(self.student, self.base_date, 'غائب')
+        self.student.absence_reset_at = date.today()
+        self.student.save()
+        self.assertEqual(self.summary().absent_since_reset_count, 0)
+        self.assertEqual(self.summary().absent_count, 1)
+
+    def test_rebuild_command_repairs_and_verifies(self):
+        make_attendance(self.student, self.base_date, 'غائب')
+        StudentAttendanceSummary.objects.update(absent_count=7)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_attendance_summaries', '--verify', stdout=StringIO())
+
+        call_command('rebuild_attendance_summaries', stdout=StringIO())
+        self.assertEqual(self.summary().absent_count, 1)
+        call_command('rebuild_attendance_summaries', '--verify', stdout=StringIO())
+
+
+class AttendanceRecordsTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user('teacher', password='pass')
+        self.students = [make_student(self.teacher, index) for index in range(3)]
+        self.target_date = date(2026, 2, 1)
+
+    def save(self, statuses):
+        return save_students_attendance(statuses, self.target_date, 'الأحد', 3)
+
+    def test_reports_created_updated_and_unchanged(self):
+        first, second, third = self.students
+        result = self.save({first.id: 'حاضر', second.id: 'غائب'})
+        self.assertEqual(sorted(result['created']), sorted([first.id, second.id]))
+        self.assertEqual(result['updated'], [])
+
+        result = self.save({first.id: 'حاضر', second.id: 'متأخر', third.id: 'غائب'})
+        self.assertEqual(result, {'created': [third.id], 'updated': [second.id], 'unchanged': [first.id]})
+        self.assertEqual(Attendance.objects.get(student=second, date=self.target_date).status, 'متأخر')
+        self.assertEqual(Attendance.objects.filter(date=self.target_date).count(), 3)
+        self.assertEqual(find_summary_mismatches(), [])
+
+    def test_invalid_status_is_ignored(self):
+        result = self.save({self.students[0].id: 'غير معروف'})
+        self.assertEqual(result['created'], [])
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_query_count_does_not_grow_with_roster(self):
+        with CaptureQueriesContext(connection) as small:
+            self.save({student.id: 'غائب' for student in self.students[:1]})
+        more = [make_student(self.teacher, index) for index in range(3, 30)]
+        with CaptureQueriesContext(connection) as large:
+            self.save({student.id: 'غائب' for student in self.students[1:] + more})
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_teacher_attendance(self):
+        result = save_teachers_attendance({self.teacher.id: 'غائب'}, self.target_date, 'الأحد', 3)
+        self.assertEqual(result['created'], [self.teacher.id])
+        result = save_teachers_attendance({self.teacher.id: 'حاضر'}, self.target_date, 'الأحد', 3)
+        self.assertEqual(result['updated'], [self.teacher.id])
+        self.assertEqual(TeacherAttendance.objects.get().status, 'حاضر')
+
+    def test_take_attendance_view(self):
+        self.client.login(username='teacher', password='pass')
+        response = self.client.post(reverse('take_attendance'), {
+            'attendance_date': '2026-02-01',
+            **{f'status_{student.id}': 'غائب' for student in self.students},
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Attendance.objects.filter(status='غائب').count(), 3)
+        self.assertEqual(StudentAttendanceSummary.objects.get(student=self.students[0]).absent_count, 1)
+
+
+class UserRolesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('preparer', password='pass')
+        self.preparer_role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        self.manager_role, _ = Role.objects.get_or_create(code='manager', defaults={'name': 'المدير'})
+        UserRole.objects.create(user=self.user, role=self.preparer_role)
+
+    def test_role_codes_memoized_per_user_object(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(user_has_role(self.user, 'preparer'))
+            self.assertFalse(user_has_role(self.user, 'manager'))
+        self.assertEqual(get_user_role_codes(self.user), frozenset({'preparer'}))
+
+    def test_cross_request_cache_invalidated_on_change(self):
+        get_user_role_codes(User.objects.get(pk=self.user.pk))
+        fresh_user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(user_has_role(fresh_user, 'manager'))
+
+        UserRole.objects.create(user=self.user, role=self.manager_role)
+        self.assertTrue(user_has_role(User.objects.get(pk=self.user.pk), 'manager'))
+
+        UserRole.objects.filter(user=self.user, role=self.manager_role).delete()
+        self.assertFalse(user_has_role(User.objects.get(pk=self.user.pk), 'manager'))
+
+    def test_page_render_loads_roles_once(self):
+        self.client.login(username='preparer', password='pass')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('preparer_attendance_summary'))
+        self.assertEqual(response.status_code, 200)
+        role_queries = [query for query in ctx.captured_queries if 'quran_center_userrole' in query['sql']]
+        self.assertLessEqual(len(role_queries), 1)
+
+
+class AdminStatisticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = date(2026, 2, 1)
+        self.teacher_a = User.objects.create_user('a_teacher')
+        self.teacher_b = User.objects.create_user('b_teacher')
+        self.early = make_student(self.teacher_a, 1, grade='1_pri')
+        self.upper = make_student(self.teacher_a, 2, grade='5_pri')
+        self.middle = make_student(self.teacher_b, 3, grade='2_med')
+        make_student(self.teacher_b, 4, grade='2_med', status='منتظر')
+        make_attendance(self.early, self.today, 'غائب')
+        make_attendance(self.middle, self.today, 'غائب')
+        make_attendance(self.upper, self.today - timedelta(days=1), 'غائب')
+        ExamNomination.objects.create(student=self.upper, teacher=self.teacher_a, last_tested_part='1', internal_passed=True)
+        TeacherAttendance.objects.create(teacher=self.teacher_b, date=self.today, weekday='الأحد', week_number=1, status='غائب')
+
+    def test_grouped_statistics(self):
+        with self.assertNumQueries(5):
+            stats = compute_admin_statistics(self.today)
+
+        self.assertEqual(stats['total_students'], 3)
+        self.assertEqual(stats['total_tested'], 1)
+        self.assertEqual(stats['total_absent_today'], 2)
+        self.assertEqual(stats['total_teacher_absent_today'], 1)
+        self.assertEqual(
+            [(row['stage'], row['total_students'], row['tested'], row['absent_today']) for row in stats['stage_stats']],
+            [('مبكرة', 1, 0, 1), ('عليا', 1, 1, 0), ('متوسط', 1, 0, 1)],
+        )
+
+        teacher_a, teacher_b = stats['teacher_stats']
+        self.assertEqual(teacher_a['teacher'], 'a_teacher')
+        self.assertEqual((teacher_a['total_students'], teacher_a['tested'], teacher_a['absent_today']), (2, 1, 1))
+        self.assertEqual(len(teacher_a['stage_stats']), 2)
+        self.assertEqual(teacher_b['teacher_self_absent_today'], 1)
+        self.assertEqual(teacher_b['stage_stats'], [{'stage': 'متوسط', 'total_students': 1, 'tested': 0, 'absent_today': 1}])
+
+    def test_snapshot_cached_until_data_changes(self):
+        first = get_admin_statistics(self.today)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_admin_statistics(self.today), first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_attendance(self.upper, self.today, 'غائب')
+        self.assertEqual(get_admin_statistics(self.today)['total_absent_today'], 3)
+
+    def test_changes_reach_other_processes(self):
+        # اتصال مستقل بالتخزين المؤقت يمثّل عاملاً آخر من عمال gunicorn
+        other_worker = caches.create_connection('default')
+        get_admin_statistics(self.today)
+        version = other_worker.get(STATS_VERSION_KEY)
+        self.assertIsNotNone(version)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_attendance(self.upper, self.today, 'غائب')
+        self.assertNotEqual(other_worker.get(STATS_VERSION_KEY), version)
+
+    def test_page_renders(self):
+        User.objects.create_superuser('admin', password='pass')
+        self.client.login(username='admin', password='pass')
+        response = self.client.get(reverse('admin_statistics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'a_teacher')
+
+
+class StageStudentsDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_superuser('admin', password='pass')
+        self.client.login(username='admin', password='pass')
+        self.base_date = date(2026, 2, 1)
+        self.students = [make_student(index=index, full_name=f'طالب {index:02d}') for index in range(60)]
+        for offset in range(3):
+            make_attendance(self.students[10], self.base_date + timedelta(days=offset), 'غائب')
+        make_attendance(self.students[20], self.base_date + timedelta(days=5), 'غائب')
+
+    def test_ranked_and_paginated(self):
+        response = self.client.get(reverse('stage_students_data'))
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 60)
+        self.assertEqual(len(page.object_list), 50)
+        self.assertEqual(page.object_list[0], self.students[10])
+        self.assertEqual(page.object_list[0].absent_count_in_range, 3)
+        self.assertEqual(page.object_list[1], self.students[20])
+
+        response = self.client.get(reverse('stage_students_data'), {'page': 2})
+        self.assertEqual(len(response.context['page_obj'].object_list), 10)
+
+    def test_date_range(self):
+        response = self.client.get(reverse('stage_students_data'), {'start_date': '2026-02-05', 'end_date': '2026-02-10'})
+        first = response.context['page_obj'].object_list[0]
+        self.assertEqual((first, first.absent_count_in_range), (self.students[20], 1))
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('stage_students_data'), {'export': 'csv'})
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        lines = content.strip().splitlines()
+        self.assertEqual(len(lines), 61)
+        self.assertTrue(lines[1].startswith('طالب 10'))
+
+    def test_xlsx_export(self):
+        response = self.client.get(reverse('stage_students_data'), {'export': 'xlsx'})
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 61)
+        self.assertEqual(rows[1][-1], 3)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.preparer = User.objects.create_user('preparer', password='pass')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=self.preparer, role=role)
+        self.client.login(username='preparer', password='pass')
+
+        self.teacher = User.objects.create_user('teacher', first_name='أحمد')
+        self.target_date = date(2026, 2, 2)
+        self.students = [make_student(self.teacher, index, full_name=f'طالب {index} محمد') for index in range(3)]
+        make_attendance(self.students[0], self.target_date - timedelta(days=1), 'غائب')
+        make_attendance(self.students[0], self.target_date, 'غائب')
+        make_attendance(self.students[1], self.target_date, 'غائب')
+        make_attendance(self.students[2], self.target_date, 'حاضر')
+
+    def load(self, response):
+        return load_workbook(BytesIO(b''.join(response.streaming_content)))
+
+    def test_status_download_streams_rows_from_one_query(self):
+        from .views import build_status_export_rows
+        with self.assertNumQueries(1):
+            rows = build_status_export_rows(self.target_date, 'غائب')
+        self.assertEqual([row['total_days'] for row in rows], [2, 1])
+        self.assertEqual(rows[0]['first_name'], 'طالب')
+
+        response = self.client.get(reverse('preparer_absent_contacts'), {'date': '2026-02-02', 'download': 'absent'})
+        sheet_rows = list(self.load(response).active.iter_rows(values_only=True))
+        self.assertEqual(len(sheet_rows), 3)
+        self.assertEqual(sheet_rows[1][3], 2)
+
+    def test_teacher_register(self):
+        response = self.client.get(reverse('attendance_register_export'), {'teacher_id': self.teacher.id})
+        sheet_rows = list(self.load(response).active.iter_rows(values_only=True))
+        self.assertEqual(sheet_rows[0][3:5], ('2026-02-01', '2026-02-02'))
+        self.assertEqual(len(sheet_rows), 4)
+        first = sheet_rows[1]
+        self.assertEqual(first[:5], ('طالب 0 محمد', 'أحمد', 'عليا', 'غائب', 'غائب'))
+        self.assertEqual(first[5:], (0, 2, 0, 0, 0))
+        self.assertEqual(sheet_rows[3][3:5], (None, 'حاضر'))
+
+    def test_stage_register(self):
+        response = self.client.get(reverse('attendance_register_export'), {'stage': 'عليا'})
+        self.assertEqual(len(list(self.load(response).active.iter_rows())), 4)
+        response = self.client.get(reverse('attendance_register_export'), {'stage': 'متوسط'})
+        self.assertEqual(len(list(self.load(response).active.iter_rows())), 1)
+
+    def test_register_rejects_bad_ids_and_other_stages(self):
+        response = self.client.get(reverse('attendance_register_export'), {'teacher_id': 'abc'})
+        self.assertRedirects(response, reverse('preparer_absent_contacts'), fetch_redirect_response=False)
+
+        supervisor = User.objects.create_user('middle_supervisor', password='pass')
+        StageSupervisor.objects.create(user=supervisor, stage='متوسط')
+        middle_teacher = User.objects.create_user('middle_teacher')
+        make_student(middle_teacher, 50, grade='2_med')
+        self.client.force_login(supervisor)
+
+        for params in ({'teacher_id': self.teacher.id}, {'stage': 'عليا'}):
+            response = self.client.get(reverse('attendance_register_export'), params)
+            self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        response = self.client.get(reverse('attendance_register_export'), {'teacher_id': middle_teacher.id})
+        self.assertEqual(len(list(self.load(response).active.iter_rows())), 2)
+
+        # مشرف بلا مرحلة محددة لا يصدّر أي سجل
+        StageSupervisor.objects.filter(user=supervisor).update(stage=None)
+        for params in ({'teacher_id': middle_teacher.id}, {'stage': 'متوسط'}, {'stage': 'عليا'}):
+            response = self.client.get(reverse('attendance_register_export'), params)
+            self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_contacts_page_lists_register_choices(self):
+        response = self.client.get(reverse('preparer_absent_contacts'), {'date': '2026-02-02'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('attendance_register_export'))
+        self.assertEqual(response.context['absent_phones_count'], 2)
+
+
+class StudentImportTests(TestCase):
+    def rows(self, *entries):
+        return [{'excel_row': index, 'data': data} for index, data in enumerate(entries, start=2)]
+
+    def test_import_validates_rows_and_detects_duplicates(self):
+        existing = make_student(identity_number='1000')
+        result = import_students(self.rows(
+            {'full_name': 'جديد', 'identity_number': '2000', 'grade': 'ثاني متوسط'},
+            {'full_name': 'مكرر', 'identity_number': '1000', 'grade': 'جامعي'},
+            {'full_name': 'مكرر في الملف', 'identity_number': '2000'},
+            {'full_name': 'صف خاطئ', 'identity_number': '3000', 'grade': 'روضة'},
+            {'full_name': '', 'identity_number': ''},
+            {'full_name': 'بدون هوية', 'grade': ''},
+        ))
+
+        self.assertEqual(result['created_count'], 2)
+        self.assertEqual(result['skipped_count'], 4)
+        self.assertEqual(len(result['row_errors']), 3)
+        self.assertTrue(result['row_errors'][0].startswith('السطر 3:'))
+
+        created = Student.objects.get(identity_number='2000')
+        self.assertEqual((created.grade, created.educational_stage), ('2_med', 'متوسط'))
+        self.assertEqual(created.student_unique_id, existing.student_unique_id + 1)
+        generated = Student.objects.get(full_name='بدون هوية')
+        self.assertTrue(generated.identity_number.startswith('GEN_'))
+        self.assertEqual(generated.student_unique_id, existing.student_unique_id + 2)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        sheet = build_sample_workbook(60, identity_prefix='T')
+        with CaptureQueriesContext(connection) as queries:
+            result = import_students(iter_excel_sheet_rows(sheet), chunk_size=25)
+        self.assertEqual(result['created_count'], 60)
+        # identities, then per chunk: counter update + read + insert, plus the savepoint pair
+        self.assertLessEqual(len(queries), 12)
+        self.assertEqual(
+            sorted(Student.objects.values_list('student_unique_id', flat=True)),
+            list(range(1, 61)),
+        )
+
+    def test_upload_view(self):
+        manager = User.objects.create_superuser(username='manager', password='x')
+        self.client.force_login(manager)
+        sheet = build_sample_workbook(3, identity_prefix='V')
+        sheet.name = 'students.xlsx'
+        response = self.client.post(reverse('bulk_students_upload'), {'excel_file': sheet})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result']['created_count'], 3)
+        self.assertEqual(Student.objects.count(), 3)
+
+    def test_upload_view_reports_a_sheet_corrupt_past_the_first_rows(self):
+        manager = User.objects.create_superuser(username='manager', password='x')
+        self.client.force_login(manager)
+        source = zipfile.ZipFile(build_sample_workbook(50, identity_prefix='C'))
+        sheet = BytesIO()
+        with zipfile.ZipFile(sheet, 'w') as corrupt:
+            for item in source.infolist():
+                data = source.read(item)
+                if item.filename.startswith('xl/worksheets/'):
+                    # مع dimension يفتح openpyxl الملف دون قراءة الورقة، فيظهر الخطأ بعد أول الأسطر
+                    data = data.replace(b'</sheetPr>', b'</sheetPr><dimension ref="A1:K51"/>', 1)
+                    data = data[:len(data) // 2]
+                corrupt.writestr(item, data)
+        sheet.seek(0)
+        sheet.name = 'students.xlsx'
+
+        response = self.client.post(reverse('bulk_students_upload'), {'excel_file': sheet})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['excel_file'])
+        self.assertEqual(Student.objects.count(), 0)
+
+
+class StudentUniqueIdTests(TestCase):
+    def test_ids_come_from_the_counter(self):
+        first = make_student()
+        with CaptureQueriesContext(connection) as queries:
+            second = make_student(index=1)
+        self.assertEqual(second.student_unique_id, first.student_unique_id + 1)
+        self.assertFalse(any('MAX(' in query['sql'].upper() for query in queries))
+
+        block = Student.allocate_unique_ids(10)
+        self.assertEqual(block, range(second.student_unique_id + 1, second.student_unique_id + 11))
+        self.assertEqual(make_student(index=2).student_unique_id, block[-1] + 1)
+
+    def test_retries_when_an_id_is_already_taken(self):
+        make_student()
+        taken = Student.allocate_unique_ids(1)[0] + 1
+        Student.objects.filter(pk=make_student(index=1).pk).update(student_unique_id=taken + 5)
+        IdCounter.objects.filter(name=Student.UNIQUE_ID_COUNTER).update(value=taken + 4)
+
+        student = make_student(index=2)
+        self.assertEqual(student.student_unique_id, taken + 6)
+
+    def test_other_integrity_errors_are_raised(self):
+        student = make_student()
+        duplicate = Student(pk=student.pk, full_name='مكرر')
+        with self.assertRaises(IntegrityError):
+            duplicate.save(force_insert=True)
+        self.assertIsNone(duplicate.student_unique_id)
+
+
+class ConcurrentRegistrationTests(TransactionTestCase):
+    def register(self, index):
+        try:
+            return make_student(index=index).student_unique_id
+        finally:
+            connection.close()
+
+    def test_parallel_registrations_get_distinct_ids(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            ids = list(pool.map(self.register, range(20)))
+        self.assertEqual(sorted(ids), list(range(1, 21)))
+        self.assertEqual(IdCounter.objects.get(name=Student.UNIQUE_ID_COUNTER).value, 20)
+
+
+class SmsDispatcherTests(TestCase):
+    def test_concurrent_dispatch_reuses_connections(self):
+        messages = [(f'9665{index:08d}', f'رسالة {index}') for index in range(20)]
+        with StubSmsServer(latency=0.1, failing_phones={'966500000003'}) as stub:
+            dispatcher = SmsDispatcher(stub.provider(), concurrency=5)
+            started = time.monotonic()
+            results = dispatcher.dispatch(messages)
+            elapsed = time.monotonic() - started
+            dispatcher.close()
+
+        # sequential delivery would take 20 × 0.1s
+        self.assertLess(elapsed, 1.2)
+        self.assertEqual([result['phone'] for result in results], [phone for phone, _text in messages])
+        self.assertEqual([result['phone'] for result in results if not result['ok']], ['966500000003'])
+        self.assertEqual(results[0]['info'], 'HTTP 200')
+        self.assertLessEqual(len(stub.client_ports), 5)
+        self.assertEqual(stub.requests[0]['payload']['src'], 'CENTER')
+        self.assertEqual(stub.requests[0]['headers']['Authorization'], 'Bearer key')
+
+    def test_rate_limit_spaces_requests(self):
+        with StubSmsServer() as stub:
+            dispatcher = SmsDispatcher(stub.provider(), concurrency=4, rate_limit=20)
+            started = time.monotonic()
+            results = dispatcher.dispatch([(f'96650000000{index}', f'نص {index}') for index in range(5)])
+            elapsed = time.monotonic() - started
+            dispatcher.close()
+        self.assertTrue(all(result['ok'] for result in results))
+        self.assertGreaterEqual(elapsed, 0.19)
+
+    def test_unreachable_or_unconfigured_provider(self):
+        results = SmsDispatcher(SmsProvider(url='', api_key='key')).dispatch([('966500000001', 'نص')])
+        self.assertEqual(results, [{'phone': '966500000001', 'ok': False, 'info': 'SMS API URL is not configured.'}])
+
+        provider = SmsProvider(url='http://127.0.0.1:9/sms', api_key='key', timeout=1)
+        result = SmsDispatcher(provider).send('966500000001', 'نص')
+        self.assertFalse(result['ok'])
+        self.assertTrue(result['info'].startswith('Connection error'))
+
+    def test_templated_messages_use_dispatcher(self):
+        from .views import build_outbox_messages
+        rows = [
+            {'phone_number': '966500000001', 'first_name': 'أحمد'},
+            {'phone_number': '', 'first_name': 'بدون رقم'},
+            {'phone_number': '966500000002', 'first_name': 'خالد'},
+        ]
+        messages = list(build_outbox_messages(rows, 'السلام عليكم {{{first_name}}}'))
+        self.assertEqual([item['error'] for item in messages], [None, 'رقم هاتف فارغ', None])
+        with StubSmsServer(failing_phones={'966500000002'}) as stub:
+            with override_settings(SMS_API_URL=stub.url, SMS_API_KEY='key', SMS_SENDER_ID='CENTER'):
+                results = dispatch_messages([(item['phone'], item['message']) for item in messages if not item['error']])
+        self.assertEqual([result['ok'] for result in results], [True, False])
+        self.assertIn('السلام عليكم أحمد', [request['payload']['body'] for request in stub.requests])
+        self.assertEqual(results[1]['info'], 'HTTP 500')
+
+
+@override_settings(SMS_OUTBOX_MAX_ATTEMPTS=2, SMS_OUTBOX_RETRY_BACKOFF=60)
+class SmsOutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.preparer = User.objects.create_user('preparer', password='pass')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=self.preparer, role=role)
+        self.client.force_login(self.preparer)
+        self.target_date = date(2026, 2, 2)
+        for index in range(3):
+            make_attendance(make_student(index=index + 1), self.target_date, 'غائب')
+        make_attendance(make_student(index=9, parent_phone=''), self.target_date, 'غائب')
+
+    def test_view_enqueues_and_redirects(self):
+        # session, user, roles, templates, one joined row query,
+        # ledger claim (insert + read back) and one outbox INSERT in a savepoint, session save
+        with self.assertNumQueries(13):
+            response = self.client.post(reverse('preparer_absent_contacts'), {
+                'date': '2026-02-02', 'sms_action': 'absent', 'absent_sms_template': 'غاب {{{first_name}}}',
+            })
+        self.assertEqual(response.status_code, 302)
+        batch_id = response['Location'].split('batch=')[1]
+        self.assertEqual(SmsOutbox.objects.filter(batch_id=batch_id, status='pending').count(), 3)
+        self.assertEqual(SmsOutbox.objects.get(batch_id=batch_id, status='failed').last_response, 'رقم هاتف فارغ')
+
+        page = self.client.get(response['Location'])
+        self.assertEqual(page.context['sms_batch']['pending'], 3)
+        progress = self.client.get(reverse('sms_batch_progress', args=[batch_id])).json()
+        self.assertEqual((progress['total'], progress['failed'], progress['done']), (4, 1, False))
+
+    def test_worker_delivers_and_retries_with_backoff(self):
+        batch_id = enqueue_messages([
+            {'phone': '966500000001', 'message': 'أ'},
+            {'phone': '966500000002', 'message': 'ب'},
+        ], section='absent')
+
+        with StubSmsServer(failing_phones={'966500000002'}) as stub:
+            dispatcher = SmsDispatcher(stub.provider())
+            summary = process_outbox(dispatcher)
+            self.assertEqual(summary, {'claimed': 2, 'sent': 1, 'failed': 0, 'retrying': 1})
+            retrying = SmsOutbox.objects.get(phone='966500000002')
+            self.assertEqual((retrying.status, retrying.attempts, retrying.last_response), ('pending', 1, 'HTTP 500'))
+            self.assertGreater(retrying.next_attempt_at, retrying.created_at + timedelta(seconds=50))
+
+            # not due yet
+            self.assertEqual(process_outbox(dispatcher)['claimed'], 0)
+            SmsOutbox.objects.filter(pk=retrying.pk).update(next_attempt_at=retrying.created_at)
+            self.assertEqual(process_outbox(dispatcher)['failed'], 1)
+            dispatcher.close()
+
+        progress = batch_progress(batch_id)
+        self.assertEqual((progress['sent'], progress['failed'], progress['done']), (1, 1, True))
+        self.assertEqual(progress['failures'], ['966500000002: HTTP 500'])
+
+    def test_stale_claims_are_reclaimed(self):
+        enqueue_messages([{'phone': '966500000001', 'message': 'أ'}])
+        self.assertEqual(len(claim_due_messages()), 1)
+        self.assertEqual(claim_due_messages(), [])
+        later = SmsOutbox.objects.get().claimed_at + timedelta(minutes=10)
+        self.assertEqual(len(claim_due_messages(now=later)), 1)
+        self.assertEqual(SmsOutbox.objects.get().attempts, 1)
+
+        # a message the worker keeps stopping on fails after SMS_OUTBOX_MAX_ATTEMPTS
+        self.assertEqual(claim_due_messages(now=later + timedelta(minutes=10)), [])
+        entry = SmsOutbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts, entry.claimed_at), ('failed', 2, None))
+
+    def test_run_sms_worker_command(self):
+        enqueue_messages([{'phone': '966500000001', 'message': 'أ'}])
+        with StubSmsServer() as stub:
+            with override_settings(SMS_API_URL=stub.url, SMS_API_KEY='key', SMS_SENDER_ID='CENTER'):
+                out = StringIO()
+                call_command('run_sms_worker', '--once', stdout=out)
+        self.assertIn('sent 1', out.getvalue())
+        self.assertEqual(SmsOutbox.objects.get().status, 'sent')
+
+
+class SmsBulkSendTests(TestCase):
+    def test_identical_texts_share_requests(self):
+        messages = [(f'9665{index:08d}', 'تذكير عام') for index in range(250)]
+        messages += [('966511111111', 'رسالة خاصة'), ('966500000007', 'تذكير عام')]
+        with StubSmsServer(rejected_phones={'966500000004'}) as stub:
+            dispatcher = SmsDispatcher(stub.provider(max_recipients=100, rejected_field='rejected'))
+            results = dispatcher.dispatch(messages)
+            dispatcher.close()
+
+        # 250 phones in chunks of 100, plus the distinct text; the repeated phone is sent once
+        self.assertEqual(len(stub.requests), 4)
+        self.assertEqual(sorted(len(request['payload']['dests']) for request in stub.requests), [1, 50, 100, 100])
+        self.assertEqual(len(results), 252)
+        self.assertEqual([result['phone'] for result in results if not result['ok']], ['966500000004'])
+        self.assertEqual(results[4]['info'], 'rejected')
+        self.assertEqual(results[-1], results[7])
+
+    def test_accepted_field_and_failed_chunk(self):
+        with StubSmsServer(rejected_phones={'966500000002'}, failing_phones={'966500000005'}) as stub:
+            dispatcher = SmsDispatcher(stub.provider(max_recipients=3, accepted_field='accepted'), concurrency=1)
+            results = dispatcher.dispatch([(f'96650000000{index}', 'نص') for index in range(6)])
+            dispatcher.close()
+        self.assertEqual(
+            [(result['ok'], result['info']) for result in results],
+            [(True, 'HTTP 200'), (True, 'HTTP 200'), (False, 'rejected')] + [(False, 'HTTP 500')] * 3,
+        )
+
+    def test_single_recipient_providers_are_not_grouped(self):
+        with StubSmsServer() as stub:
+            dispatcher = SmsDispatcher(stub.provider(phone_is_array=False, max_recipients=100))
+            dispatcher.dispatch([('966500000001', 'نص'), ('966500000002', 'نص')])
+            dispatcher.close()
+        self.assertEqual(sorted(request['payload']['dests'] for request in stub.requests), ['966500000001', '966500000002'])
+
+
+class SmsTemplateTests(TestCase):
+    row = {
+        'first_name': 'أحمد', 'full_name': 'أحمد علي', 'teacher_name': 'خالد',
+        'total_days': 3, 'today_date': date(2026, 2, 2), 'today_day_name': 'الاثنين',
+    }
+
+    def test_compiled_render(self):
+        template = compile_template(' غاب {{{الاسم_الأول}}} ({{{full_name}}}) يوم {{{اليوم}}} {{{التاريخ}}}: {{{المجموع}}} {{{غير_معروف}}} ')
+        self.assertEqual(
+            template.render(self.row),
+            'غاب أحمد (أحمد علي) يوم الاثنين 2026-02-02: 3 {{{غير_معروف}}}',
+        )
+        self.assertEqual(template.unknown_tokens, ['{{{غير_معروف}}}'])
+        self.assertIs(compile_template(template.text), template)
+        self.assertEqual(render_message_template('', self.row), '')
+        self.assertEqual(render_message_template('{{{teacher_phone}}}', self.row), '')
+
+    def test_segment_count_and_cost(self):
+        self.assertEqual(sms_segment_count(''), 0)
+        self.assertEqual(sms_segment_count('a' * 160), 1)
+        self.assertEqual(sms_segment_count('a' * 161), 2)
+        self.assertEqual(sms_segment_count('[' * 80), 1)
+        self.assertEqual(sms_segment_count('[' * 81), 2)
+        self.assertEqual(sms_segment_count('ب' * 70), 1)
+        self.assertEqual(sms_segment_count('ب' * 71), 2)
+        self.assertEqual(sms_segment_count('ب' * 135), 3)
+        with override_settings(SMS_SEGMENT_COST=0.05):
+            self.assertEqual(estimate_batch(['ب' * 71, 'hello']), {'messages': 2, 'segments': 3, 'cost': 0.15})
+
+    def test_unknown_tokens_block_saving(self):
+        preparer = User.objects.create_user('preparer')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=preparer, role=role)
+        self.client.force_login(preparer)
+        make_attendance(make_student(index=1), date(2026, 2, 2), 'غائب')
+
+        response = self.client.post(reverse('preparer_absent_contacts'), {
+            'date': '2026-02-02', 'save_templates': '1', 'estimate': 'absent',
+            'absent_sms_template': 'غاب {{{الاسم_الاول}}}',
+            'late_sms_template': 'تأخر {{{الاسم_الأول}}}',
+        })
+        self.assertEqual(list(SmsTemplateSetting.objects.values_list('section', flat=True)), ['late'])
+        self.assertIn('{{{الاسم_الاول}}}', response.context['template_errors'][0])
+        self.assertEqual(response.context['absent_sms_template'], 'غاب {{{الاسم_الاول}}}')
+        self.assertEqual(response.context['sms_estimates']['absent'], {'messages': 1, 'segments': 1, 'cost': 0.0})
+
+        setting = SmsTemplateSetting(user=preparer, section='absent', template_text='{{{x}}}')
+        with self.assertRaises(ValidationError):
+            setting.full_clean()
+
+
+class HouseholdSmsTests(TestCase):
+    rows = [
+        {'student_id': 1, 'phone_number': '966500000001', 'first_name': 'أحمد', 'full_name': 'أحمد علي', 'total_days': 3, 'teacher_name': 'خالد'},
+        {'student_id': 2, 'phone_number': '966500000002', 'first_name': 'سعد', 'full_name': 'سعد فهد', 'total_days': 1, 'teacher_name': 'خالد'},
+        {'student_id': 3, 'phone_number': '966500000001', 'first_name': 'عمر', 'full_name': 'عمر علي', 'total_days': 2, 'teacher_name': 'ماجد'},
+        {'student_id': 4, 'phone_number': '', 'first_name': 'بدون', 'full_name': 'بدون رقم', 'total_days': 1, 'teacher_name': ''},
+    ]
+
+    def test_rows_are_grouped_by_phone(self):
+        households = coalesce_households(self.rows)
+        self.assertEqual([row['children_count'] for row in households], [2, 1, 1])
+        family = households[0]
+        self.assertEqual(family['student_id'], 1)
+        self.assertEqual(family['children_names'], 'أحمد وعمر')
+        self.assertEqual(family['total_days'], 'أحمد: 3، عمر: 2')
+        self.assertEqual(family['teacher_name'], 'خالد وماجد')
+        self.assertEqual(households[1]['first_name'], 'سعد')
+
+    def test_children_block(self):
+        template = compile_template('أبناؤكم ({{{عدد_الأبناء}}}):{{{#الأبناء}}}\n- {{{الاسم_الأول}}}: {{{المجموع}}}{{{/الأبناء}}}')
+        self.assertEqual(template.unknown_tokens, [])
+        family, single = coalesce_households(self.rows)[:2]
+        self.assertEqual(template.render(family), 'أبناؤكم (2):\n- أحمد: 3\n- عمر: 2')
+        self.assertEqual(template.render(single), 'أبناؤكم (1):\n- سعد: 1')
+        self.assertEqual(template.render(self.rows[1]), 'أبناؤكم ():\n- سعد: 1')
+
+        self.assertEqual(compile_template('{{{#الأبناء}}}{{{first_name}}}').unknown_tokens, ['{{{#الأبناء}}}'])
+        self.assertEqual(compile_template('{{{/children}}}').unknown_tokens, ['{{{/children}}}'])
+
+    def test_view_sends_one_message_per_household(self):
+        preparer = User.objects.create_user('preparer')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=preparer, role=role)
+        self.client.force_login(preparer)
+        target_date = date(2026, 2, 2)
+        for index, name in enumerate(['أحمد علي', 'عمر علي']):
+            make_attendance(make_student(index=index, full_name=name, parent_phone='0500000001'), target_date, 'غائب')
+
+        page = self.client.get(reverse('preparer_absent_contacts'), {'date': '2026-02-02'})
+        self.assertEqual(page.context['sms_estimates'], {})
+        page = self.client.get(reverse('preparer_absent_contacts'), {'date': '2026-02-02', 'estimate': 'absent'})
+        self.assertEqual(page.context['sms_estimates']['absent']['messages'], 1)
+
+        self.client.post(reverse('preparer_absent_contacts'), {
+            'date': '2026-02-02', 'sms_action': 'absent', 'absent_sms_template': 'غاب {{{الاسم_الأول}}}',
+        })
+        self.assertEqual(list(SmsOutbox.objects.values_list('message', flat=True)), ['غاب أحمد وعمر'])
+
+        with override_settings(SMS_COALESCE_HOUSEHOLDS=False):
+            self.client.post(reverse('preparer_absent_contacts'), {
+                'date': '2026-02-02', 'sms_action': 'absent', 'absent_sms_template': 'غاب {{{الاسم_الأول}}}',
+                'force_resend': '1',
+            })
+        self.assertEqual(SmsOutbox.objects.count(), 3)
+
+
+class SmsSendLedgerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        preparer = User.objects.create_user('preparer')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=preparer, role=role)
+        self.client.force_login(preparer)
+        for index in range(3):
+            make_attendance(make_student(index=index + 1), date(2026, 2, 2), 'غائب')
+
+    def send(self, **extra):
+        data = {'date': '2026-02-02', 'sms_action': 'absent', 'absent_sms_template': 'غاب {{{الاسم_الأول}}}'}
+        data.update(extra)
+        return self.client.post(reverse('preparer_absent_contacts'), data)
+
+    def test_resubmitting_does_not_send_twice(self):
+        self.send()
+        self.assertEqual(SmsOutbox.objects.count(), 3)
+
+        response = self.send()
+        self.assertEqual(SmsOutbox.objects.count(), 3)
+        self.assertNotIn('batch=', response['Location'])
+        page = self.client.get(response['Location'])
+        self.assertEqual(page.context['sms_skipped']['count'], 3)
+        self.assertEqual(page.context['sms_already_sent'], {'absent': 3})
+
+        # a different template is a different message
+        self.send(absent_sms_template='تنبيه {{{الاسم_الأول}}}')
+        self.assertEqual(SmsOutbox.objects.count(), 6)
+
+        self.send(force_resend='1')
+        self.assertEqual(SmsOutbox.objects.count(), 9)
+        self.assertEqual(SmsSendLedger.objects.count(), 6)
+
+        self.send(retry_failed='1')
+        self.assertEqual(SmsOutbox.objects.count(), 9)
+
+    def test_partial_overlap_and_permanent_failures(self):
+        messages = [{'phone': f'96650000000{index}', 'message': 'نص'} for index in range(3)]
+        first = enqueue_once(messages[:2], 'late', date(2026, 2, 2), 'نص')
+        second = enqueue_once(messages, 'late', date(2026, 2, 2), 'نص')
+        self.assertEqual((first['queued'], second['queued'], second['already_sent']), (2, 1, 2))
+
+        with override_settings(SMS_OUTBOX_MAX_ATTEMPTS=1):
+            entries = claim_due_messages()
+            record_results(entries, [
+                {'phone': entry.phone, 'ok': entry.phone != '966500000000', 'info': 'HTTP 500'} for entry in entries
+            ])
+        # failed recipients stay claimed until a retry is asked for explicitly
+        self.assertTrue(SmsSendLedger.objects.filter(recipient_key='966500000000').exists())
+        self.assertEqual(enqueue_once(messages, 'late', date(2026, 2, 2), 'نص')['queued'], 0)
+        retried = enqueue_once(messages, 'late', date(2026, 2, 2), 'نص', retry_failed=True)
+        self.assertEqual((retried['queued'], retried['already_sent']), (1, 2))
+        self.assertEqual(SmsOutbox.objects.get(batch_id=retried['batch_id']).phone, '966500000000')
+        self.assertEqual(enqueue_once(messages, 'late', date(2026, 2, 2), 'نص', retry_failed=True)['queued'], 0)
+
+    def test_messages_are_claimed_in_chunks(self):
+        queued_before = []
+
+        def messages():
+            for index in range(ENQUEUE_CHUNK_SIZE * 2 + 10):
+                if index == ENQUEUE_CHUNK_SIZE:
+                    queued_before.append(SmsOutbox.objects.count())
+                yield {'phone': f'9665{index % (ENQUEUE_CHUNK_SIZE + 5):08d}', 'message': 'نص'}
+
+        result = enqueue_once(messages(), 'broadcast', date(2026, 2, 2), 'نص')
+        self.assertEqual(queued_before, [ENQUEUE_CHUNK_SIZE])
+        self.assertEqual((result['queued'], result['already_sent']), (ENQUEUE_CHUNK_SIZE * 2 + 10, 0))
+        self.assertEqual(SmsSendLedger.objects.filter(section='broadcast').count(), ENQUEUE_CHUNK_SIZE + 5)
+
+
+class SmsFailoverTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dead = SmsProvider(url='http://127.0.0.1:9/sms', api_key='key', name='dead', timeout=1)
+
+    def test_failover_opens_breaker_and_probes_later(self):
+        with StubSmsServer() as stub, override_settings(SMS_BREAKER_FAILURES=2):
+            dispatcher = SmsDispatcher(providers=[self.dead, stub.provider(name='backup')], concurrency=1)
+            results = dispatcher.dispatch([('966500000001', 'أ'), ('966500000002', 'ب'), ('966500000003', 'ج')])
+            self.assertEqual([(result['ok'], result['provider']) for result in results], [(True, 'backup')] * 3)
+
+            dead = CircuitBreaker('dead')
+            self.assertEqual((dead.snapshot()['state'], dead.snapshot()['requests']), ('open', 2))
+            self.assertEqual(CircuitBreaker('backup').snapshot()['requests'], 3)
+
+            # after the reset timeout one probe goes to the dead provider and re-opens the circuit
+            state = dead.snapshot()
+            state['opened_at'] -= 120
+            cache.set(dead.key, state, None)
+            self.assertTrue(dispatcher.send('966500000004', 'د')['ok'])
+            self.assertEqual((dead.snapshot()['state'], dead.snapshot()['requests']), ('open', 3))
+            dispatcher.close()
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker('probe', failure_threshold=2, reset_timeout=0.1)
+        breaker.record(False, 0.5, 'HTTP 503')
+        self.assertTrue(breaker.allow_request())
+        breaker.record(False, 0.5, 'HTTP 503')
+        self.assertFalse(breaker.allow_request())
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record(True, 0.1)
+        self.assertEqual(breaker.snapshot()['state'], 'closed')
+        self.assertEqual(breaker.snapshot()['max_latency'], 0.5)
+
+    def test_all_providers_down(self):
+        with override_settings(SMS_BREAKER_FAILURES=1):
+            result = SmsDispatcher(providers=[self.dead]).send('966500000001', 'نص')
+            self.assertTrue(result['info'].startswith('Connection error'))
+            other = SmsProvider(url='http://127.0.0.1:9/other', api_key='key', name='dead2', timeout=1)
+            result = SmsDispatcher(providers=[self.dead, other]).send('966500000001', 'نص')
+        self.assertFalse(result['ok'])
+        self.assertTrue(result['info'].startswith('dead: circuit open | dead2: Connection error'))
+
+    @override_settings(SMS_PROVIDERS=[
+        {'name': 'main', 'url': 'https://sms.example.com/send', 'api_key': 'a', 'sender_id': 'X'},
+        {'name': 'spare', 'url': '', 'api_key': 'b'},
+    ])
+    def test_status_page(self):
+        CircuitBreaker('main').record(True, 0.2)
+        CircuitBreaker('main').record(False, 0.4, 'HTTP 502')
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        response = self.client.get(reverse('sms_provider_status'))
+        main, spare = response.context['providers']
+        self.assertEqual((main['host'], main['requests'], main['avg_latency_ms'], main['error_rate']), ('sms.example.com', 2, 300, 50.0))
+        self.assertEqual(main['last_error'], 'HTTP 502')
+        self.assertEqual(spare['configuration_error'], 'SMS API URL is not configured.')
+
+
+@override_settings(SMS_WEBHOOK_TOKEN='secret', SMS_RECEIPT_UNDELIVERED=['undeliv', 'failed'])
+class SmsDeliveryReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.target_date = date(2026, 2, 2)
+        self.webhook = reverse('sms_delivery_webhook') + '?token=secret'
+
+    def send_through_stub(self, messages, section='absent'):
+        enqueue_messages(messages, section=section, target_date=self.target_date)
+        with StubSmsServer() as stub:
+            dispatcher = SmsDispatcher(stub.provider(message_id_field='msgId'))
+            process_outbox(dispatcher)
+            dispatcher.close()
+        return stub
+
+    def test_batched_reports_are_applied_with_one_bulk_update(self):
+        stub = self.send_through_stub([
+            {'phone': '966500000001', 'message': 'غاب'},
+            {'phone': '966500000002', 'message': 'غاب'},
+            {'phone': '966500000003', 'message': 'تأخر'},
+        ])
+        # the two identical texts went out as one request and share its id
+        ids = dict(SmsOutbox.objects.values_list('phone', 'provider_message_id'))
+        self.assertEqual(ids['966500000001'], ids['966500000002'])
+        self.assertEqual({ids['966500000001'], ids['966500000003']}, {'m1', 'm2'})
+
+        reports = stub.delivery_reports(undelivered={'966500000003'})
+        # intermediate states are not stored
+        reports.append({'msgId': 'm1', 'dest': '966500000001', 'status': 'ENROUTE'})
+        response = self.client.post(self.webhook, json.dumps({'reports': reports}), content_type='application/json')
+        self.assertEqual(response.json(), {'accepted': 3})
+        self.assertEqual(SmsOutbox.objects.exclude(delivery_status='').count(), 0)
+
+        # savepoint, report read, outbox read, one UPDATE, one DELETE, release
+        with self.assertNumQueries(6):
+            summary = apply_delivery_reports()
+        self.assertEqual(summary, {'applied': 3, 'updated': 3, 'waiting': 0, 'dropped': 0})
+        self.assertEqual(
+            dict(SmsOutbox.objects.values_list('phone', 'delivery_status')),
+            {'966500000001': 'delivered', '966500000002': 'delivered', '966500000003': 'undelivered'},
+        )
+        self.assertFalse(SmsDeliveryReport.objects.exists())
+
+    def test_single_form_report_and_token(self):
+        self.send_through_stub([{'phone': '966500000001', 'message': 'غاب'}])
+        url = reverse('sms_delivery_webhook')
+        self.assertEqual(self.client.post(url, {'dest': '966500000001', 'status': 'DELIVRD'}).status_code, 403)
+        self.assertEqual(self.client.post(url + '?token=wrong', {'dest': '966500000001', 'status': 'DELIVRD'}).status_code, 403)
+        self.assertEqual(self.client.post(url + '?token=سر', {'dest': '966500000001', 'status': 'DELIVRD'}).status_code, 403)
+        self.assertEqual(self.client.post(url, {'dest': '966500000001'}, HTTP_X_WEBHOOK_TOKEN='sécret').status_code, 403)
+        self.assertEqual(self.client.get(self.webhook).status_code, 405)
+
+        # a report without a message id matches the latest message sent to that phone
+        response = self.client.post(self.webhook, {'dest': '966500000001', 'status': 'DELIVRD'})
+        self.assertEqual(response.json(), {'accepted': 1})
+        apply_delivery_reports()
+        self.assertEqual(SmsOutbox.objects.get().delivery_status, 'delivered')
+
+    def test_unknown_reports_wait_then_expire(self):
+        buffer_delivery_reports({'msgId': 'later', 'dest': '966500000009', 'status': 'DELIVRD'})
+        self.assertEqual(apply_delivery_reports()['waiting'], 1)
+        self.assertEqual(SmsDeliveryReport.objects.count(), 1)
+        later = timezone.now() + UNMATCHED_GRACE + timedelta(minutes=1)
+        self.assertEqual(apply_delivery_reports(now=later)['dropped'], 1)
+        self.assertFalse(SmsDeliveryReport.objects.exists())
+
+    def test_delivery_rate_report(self):
+        stub = self.send_through_stub([
+            {'phone': '966500000001', 'message': 'غاب أ'},
+            {'phone': '966500000002', 'message': 'غاب ب'},
+            {'phone': '966500000003', 'message': 'غاب ج'},
+        ])
+        buffer_delivery_reports([
+            report for report in stub.delivery_reports(undelivered={'966500000002'})
+            if report['dest'] != '966500000003'
+        ])
+        self.send_through_stub([{'phone': '966500000004', 'message': 'تأخر'}], section='late')
+
+        preparer = User.objects.create_user('preparer', password='pass')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=preparer, role=role)
+        self.client.force_login(preparer)
+        url = reverse('sms_delivery_report') + '?start=2026-02-01&end=2026-02-28'
+        response = self.client.get(url)
+        self.assertEqual(response.context['pending_reports'], 2)
+        self.assertEqual(SmsDeliveryReport.objects.count(), 2)
+
+        self.assertRedirects(self.client.post(url, {'apply_reports': '1'}), url)
+        response = self.client.get(url)
+        self.assertEqual(response.context['pending_reports'], 0)
+        rows = {row['section']: row for row in response.context['rows']}
+        absent = rows['absent']
+        self.assertEqual(
+            (absent['sent'], absent['delivered'], absent['undelivered'], absent['awaiting']),
+            (3, 1, 1, 1),
+        )
+        self.assertEqual(absent['rate'], 50.0)
+        self.assertEqual((rows['late']['sent'], rows['late']['rate']), (1, None))
+        self.assertEqual(delivery_rates(date(2026, 3, 1), date(2026, 3, 31))[0]['sent'], 0)
+
+
+class SmsBroadcastTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user('teacher', password='pass')
+        self.other_teacher = User.objects.create_user('other', password='pass')
+
+    def test_recipients_are_deduplicated_in_one_query(self):
+        # the stage is derived from the grade (4_pri -> عليا)
+        make_student(self.teacher, 1)
+        make_student(self.teacher, 2, parent_phone='0500000001')
+        make_student(self.teacher, 3, parent_phone='966500000001')
+        make_student(self.other_teacher, 4, grade='2_med')
+        make_student(self.teacher, 5, status='منتظر')
+        make_student(self.teacher, 6, parent_phone='')
+
+        with self.assertNumQueries(1):
+            phones = list(iter_recipient_phones({'educational_stage': 'عليا', 'status': 'منتظم'}))
+        self.assertEqual(phones, ['966500000001'])
+        self.assertEqual(list(iter_recipient_phones({'teacher': str(self.other_teacher.id)})), ['966500000004'])
+        self.assertEqual(list(iter_recipient_phones({'grade': '2_med', 'educational_stage': 'متوسط'})), ['966500000004'])
+        self.assertEqual(len(list(iter_recipient_phones({}))), 3)
+        with self.assertNumQueries(1) as queries:
+            self.assertEqual(count_recipient_phones({}), 3)
+        self.assertIn('COUNT(', queries.captured_queries[0]['sql'])
+        self.assertEqual(count_recipient_phones({'educational_stage': 'عليا', 'status': 'منتظم'}), 1)
+
+    def test_per_student_fields_are_rejected(self):
+        self.assertEqual(broadcast_template_errors('إجازة يوم {{{اليوم}}} {{{التاريخ}}}'), [])
+        self.assertEqual(
+            broadcast_template_errors('إلى ولي أمر {{{first_name}}} {{{مجهول}}}'),
+            ['{{{مجهول}}}', '{{{first_name}}}'],
+        )
+
+    def test_whole_center_broadcast(self):
+        Student.objects.bulk_create([
+            Student(
+                full_name=f'طالب {index}', parent_phone=f'05{index:08d}', parent_phone_normalized=f'9665{index:08d}',
+                status='منتظم', teacher=self.teacher,
+            )
+            for index in range(1500)
+        ])
+
+        started = time.monotonic()
+        queued = queue_broadcast({'status': 'منتظم'}, 'تنبيه: لا دراسة يوم {{{اليوم}}}', date(2026, 2, 2))
+        self.assertEqual((queued['queued'], queued['already_sent']), (1500, 0))
+
+        with StubSmsServer(latency=0.01) as stub:
+            dispatcher = SmsDispatcher(stub.provider(max_recipients=100))
+            while process_outbox(dispatcher, limit=500)['claimed']:
+                pass
+            dispatcher.close()
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(SmsOutbox.objects.filter(section=BROADCAST_SECTION, status='sent').count(), 1500)
+        self.assertEqual(SmsOutbox.objects.get(phone='966500000007').message, 'تنبيه: لا دراسة يوم الاثنين')
+        # identical texts go out 100 phones per request
+        self.assertEqual(len(stub.requests), 15)
+        self.assertLess(elapsed, 30)
+
+        again = queue_broadcast({'status': 'منتظم'}, 'تنبيه: لا دراسة يوم {{{اليوم}}}', date(2026, 2, 2))
+        self.assertEqual((again['queued'], again['already_sent']), (0, 1500))
+
+    def test_view_queues_for_manager(self):
+        make_student(self.teacher, 1)
+        make_student(self.teacher, 2)
+        manager = User.objects.create_user('manager', password='pass')
+        role, _ = Role.objects.get_or_create(code='manager', defaults={'name': 'مدير'})
+        UserRole.objects.create(user=manager, role=role)
+        self.client.force_login(manager)
+
+        page = self.client.get(reverse('sms_broadcast'), {'teacher': self.teacher.id, 'message': 'اجتماع أولياء الأمور'})
+        self.assertEqual(page.context['recipients_count'], 2)
+        self.assertEqual(page.context['estimate']['messages'], 2)
+
+        for params in ({'teacher': 'abc'}, {'grade': '9_xyz'}, {'status': 'مفصول'}, {'educational_stage': 'روضة'}):
+            response = self.client.post(reverse('sms_broadcast'), dict(params, message='اجتماع أولياء الأمور'))
+            self.assertRedirects(response, reverse('sms_broadcast'), fetch_redirect_response=False)
+            response = self.client.get(reverse('sms_broadcast'), params)
+            self.assertRedirects(response, reverse('sms_broadcast'), fetch_redirect_response=False)
+        self.assertFalse(SmsOutbox.objects.exists())
+
+        rejected = self.client.post(reverse('sms_broadcast'), {'message': 'مرحباً {{{first_name}}}'})
+        self.assertEqual(rejected.status_code, 200)
+        self.assertIn('{{{first_name}}}', rejected.context['errors'][0])
+
+        response = self.client.post(reverse('sms_broadcast'), {'teacher': self.teacher.id, 'message': 'اجتماع أولياء الأمور'})
+        self.assertEqual(response.status_code, 302)
+        batch_id = response['Location'].split('batch=')[1]
+        self.assertEqual(SmsOutbox.objects.filter(batch_id=batch_id, section=BROADCAST_SECTION).count(), 2)
+        progress = self.client.get(reverse('sms_batch_progress', args=[batch_id])).json()
+        self.assertEqual(progress['pending'], 2)
+
+
+class ParentInquiryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user('teacher', password='pass')
+        TeacherProfile.objects.create(user=self.teacher, phone='0551112222')
+        self.older = make_student(self.teacher, 1, full_name='أحمد', parent_phone='0500000001')
+        self.younger = make_student(self.teacher, 2, full_name='خالد', parent_phone='966500000001')
+        make_student(self.teacher, 3, parent_phone='0500000003')
+        for day in range(12):
+            make_attendance(self.older, date(2026, 2, 1) + timedelta(days=day), 'غائب' if day % 4 == 0 else 'حاضر')
+        make_attendance(self.younger, date(2026, 2, 1), 'متأخر')
+
+    def inquire(self, phone):
+        return self.client.post(reverse('parent_inquiry'), {'parent_phone': phone})
+
+    def test_family_is_found_in_two_queries_then_cached(self):
+        # one indexed student query with teacher, profile and summary joined, one windowed history query
+        with self.assertNumQueries(2):
+            response = self.inquire('0500000001')
+        older, younger = response.context['students']
+        self.assertEqual((older['full_name'], younger['full_name']), ('أحمد', 'خالد'))
+        self.assertEqual((older['absent_count'], older['present_count']), (3, 9))
+        self.assertEqual(len(older['recent_attendance']), 10)
+        self.assertEqual(older['recent_attendance'][0]['date'], date(2026, 2, 12))
+        self.assertEqual(younger['recent_attendance'], [{'date': date(2026, 2, 1), 'status': 'متأخر'}])
+        self.assertEqual((older['teacher_name'], older['teacher_phone']), ('teacher', '0551112222'))
+        self.assertContains(response, 'أحمد')
+
+        # any phone format reaches the same cached entry
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.inquire('+966 50 000 0001').context['students']), 2)
+
+    def test_attendance_change_drops_only_that_family(self):
+        get_family_report('0500000001')
+        get_family_report('0500000003')
+        with self.captureOnCommitCallbacks(execute=True):
+            save_students_attendance({self.younger.id: 'غائب'}, date(2026, 2, 20), 'الجمعة', 3)
+
+        with self.assertNumQueries(0):
+            get_family_report('0500000003')
+        younger = get_family_report('0500000001')[1]
+        self.assertEqual((younger['absent_count'], younger['recent_attendance'][0]['status']), (1, 'غائب'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.filter(student=self.younger, date=date(2026, 2, 20)).get().delete()
+        self.assertEqual(get_family_report('0500000001')[1]['absent_count'], 0)
+
+    def test_phone_change_moves_student_between_families(self):
+        get_family_report('0500000001')
+        get_family_report('0500000009')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.younger.parent_phone = '0500000009'
+            self.younger.save()
+        self.assertEqual([child['full_name'] for child in get_family_report('0500000001')], ['أحمد'])
+        self.assertEqual([child['full_name'] for child in get_family_report('0500000009')], ['خالد'])
+
+    def test_student_edits_query_only_for_changed_fields(self):
+        student = Student.objects.get(pk=self.younger.pk)
+        student.full_name = 'خالد محمد'
+        with self.assertNumQueries(1):
+            student.save()
+
+        make_attendance(student, date(2026, 3, 1), 'غائب')
+        student.absence_reset_at = date.today()
+        with self.captureOnCommitCallbacks(execute=True):
+            student.save()
+        self.assertEqual(StudentAttendanceSummary.objects.get(student=student).absent_since_reset_count, 0)
+        with self.assertNumQueries(1):
+            student.save()
+
+        # ذكر الحقل في update_fields يفرض إعادة العد ولو لم تتغير قيمته
+        StudentAttendanceSummary.objects.filter(student=student).update(absent_since_reset_count=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            student.save(update_fields=['absence_reset_at'])
+        self.assertEqual(StudentAttendanceSummary.objects.get(student=student).absent_since_reset_count, 0)
+
+    def test_empty_phone(self):
+        response = self.inquire('   ')
+        self.assertEqual(response.context['error_message'], 'يرجى إدخال رقم الجوال')
+        self.assertEqual(get_family_report('abc'), [])
+
+
+class ExplainHotQueriesTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', stdout=out)
+        self.assertIn('All hot queries use indexes.', out.getvalue())
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+    def test_full_scan_detection(self):
+        self.assertEqual(full_scans([
+            'SEARCH quran_center_attendance USING INDEX attendance_date_status_idx (date=? AND status=?)',
+            'SCAN quran_center_student USING COVERING INDEX student_identity_idx',
+            'SCAN CONSTANT ROW',
+            'SCAN quran_center_examnomination',
+            'SCAN TABLE auth_user',
+        ]), ['quran_center_examnomination', 'auth_user'])
+        self.assertEqual(full_scans([
+            'Nested Loop  (cost=0.29..16.34 rows=1 width=8)',
+            '  ->  Seq Scan on quran_center_student  (cost=0.00..1.01 rows=1 width=4)',
+            '  ->  Index Scan using attendance_date_status_idx on quran_center_attendance',
+        ], vendor='postgresql'), ['quran_center_student'])
+
+
+class RollCallBoardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.day = date(2026, 2, 1)
+        self.done_teacher = User.objects.create_user('a_done', first_name='عبدالله', last_name='سالم')
+        self.partial_teacher = User.objects.create_user('b_partial')
+        self.idle_teacher = User.objects.create_user('c_idle')
+        User.objects.create_user('d_no_students')
+        for index in range(2):
+            make_attendance(make_student(self.done_teacher, index), self.day)
+        make_attendance(make_student(self.partial_teacher, 10), self.day, 'غائب')
+        make_student(self.partial_teacher, 11)
+        make_student(self.partial_teacher, 12, status='منتظر')
+        make_student(self.idle_teacher, 20)
+
+    def test_board_uses_two_grouped_queries(self):
+        for index in range(30, 40):
+            make_student(User.objects.create_user(f'extra_{index}'), index)
+        with self.assertNumQueries(2):
+            board = teacher_roll_call(self.day)
+
+        done, = board['completed']
+        self.assertEqual((done['display_name'], done['student_count'], done['recorded_count']), ('عبدالله سالم', 2, 2))
+        self.assertIsNotNone(done['last_time'])
+        pending = {item['display_name']: item for item in board['pending']}
+        self.assertEqual((pending['b_partial']['student_count'], pending['b_partial']['recorded_count']), (2, 1))
+        self.assertEqual(pending['c_idle']['recorded_count'], 0)
+        self.assertNotIn('d_no_students', pending)
+        self.assertEqual(len(board['pending']), 12)
+
+    def test_view_accepts_past_dates(self):
+        preparer = User.objects.create_user('preparer', password='pass')
+        role, _ = Role.objects.get_or_create(code='preparer', defaults={'name': 'المُحضّر'})
+        UserRole.objects.create(user=preparer, role=role)
+        self.client.force_login(preparer)
+
+        response = self.client.get(reverse('preparer_attendance_summary'), {'date': '2026-02-01'})
+        self.assertEqual(response.context['target_date'], self.day)
+        self.assertEqual([item['display_name'] for item in response.context['completed']], ['عبدالله سالم'])
+
+        response = self.client.get(reverse('preparer_attendance_summary'), {'date': 'not-a-date'})
+        self.assertEqual(response.context['target_date'], timezone.now().date())
+        self.assertEqual(response.context['completed'], [])
+
+
+class AcademicCalendarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(invalidate_calendar)
+        start = date(2026, 1, 18)
+        AcademicCalendar.objects.bulk_create([
+            AcademicCalendar(week_number=week, start_date=start + timedelta(weeks=week - 1), end_date=start + timedelta(weeks=week - 1, days=4))
+            for week in range(1, 20)
+        ])
+        invalidate_calendar()
+
+    def test_lookup_loads_the_calendar_once(self):
+        # ختم التقويم ثم تحميله
+        with self.assertNumQueries(2):
+            self.assertEqual(week_for_date(date(2026, 1, 18)), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(week_for_date(date(2026, 1, 27)), 2)
+            self.assertEqual(AcademicCalendar.get_week_from_date(date(2026, 5, 28)), 19)
+            # عطلة نهاية الأسبوع وما قبل التقويم وما بعده
+            self.assertEqual(week_for_date(date(2026, 1, 23)), 1)
+            self.assertEqual(week_for_date(date(2025, 12, 1)), 1)
+            self.assertEqual(week_for_date(date(2026, 9, 1)), 1)
+
+    def test_calendar_edits_reload_the_index(self):
+        week_for_date(date(2026, 1, 18))
+        with self.captureOnCommitCallbacks(execute=True):
+            AcademicCalendar.objects.filter(week_number=19).delete()
+            AcademicCalendar.objects.create(week_number=20, start_date=date(2026, 9, 1), end_date=date(2026, 9, 5))
+        self.assertEqual(week_for_date(date(2026, 9, 2)), 20)
+        self.assertEqual(week_for_date(date(2026, 5, 28)), 1)
+
+        # عملية أخرى عدّلت التقويم (save يحدّث updated_at) دون أن تصل إشاراتها لهذه العملية
+        AcademicCalendar.objects.filter(week_number=20).update(
+            start_date=date(2026, 8, 30), updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(week_for_date(date(2026, 8, 31)), 1)
+        with override_settings(ACADEMIC_CALENDAR_CHECK_SECONDS=0):
+            self.assertEqual(week_for_date(date(2026, 8, 31)), 20)
+            with self.assertNumQueries(1):
+                self.assertEqual(week_for_date(date(2026, 8, 31)), 20)
+
+    def test_overlapping_weeks_resolve_like_the_recompute_query(self):
+        # أسبوع مكرر يبدأ مع الأسبوع 2، وأسبوع طويل يحتوي الأسبوعين 3 و4
+        AcademicCalendar.objects.create(week_number=30, start_date=date(2026, 1, 25), end_date=date(2026, 1, 29))
+        AcademicCalendar.objects.create(week_number=31, start_date=date(2026, 1, 31), end_date=date(2026, 2, 14))
+        invalidate_calendar()
+        student = make_student()
+        days = [date(2026, 1, 26), date(2026, 2, 2), date(2026, 2, 6), date(2026, 2, 12), date(2026, 2, 14)]
+        for day in days:
+            Attendance.objects.create(student=student, date=day, weekday='الأحد', week_number=0, status='حاضر')
+
+        call_command('recompute_week_numbers', stdout=StringIO())
+        stored = dict(Attendance.objects.values_list('date', 'week_number'))
+        self.assertEqual({day: week_for_date(day) for day in days}, stored)
+        # الأحدث بدايةً يغلب، والأسبوع الطويل يغطي ما بعد نهاية الأسبوع 4
+        self.assertEqual([stored[day] for day in days], [30, 3, 31, 4, 31])
+
+    def test_recompute_command_updates_stored_weeks(self):
+        teacher = User.objects.create_user('teacher')
+        student = make_student(teacher)
+        for day in (date(2026, 1, 18), date(2026, 2, 3), date(2026, 8, 1)):
+            Attendance.objects.create(student=student, date=day, weekday='الأحد', week_number=7, status='حاضر')
+        TeacherAttendance.objects.create(teacher=teacher, date=date(2026, 2, 10), weekday='الثلاثاء', week_number=1, status='حاضر')
+
+        out = StringIO()
+        call_command('recompute_week_numbers', '--dry-run', stdout=out)
+        self.assertIn('Attendance: would change 3 row(s)', out.getvalue())
+        self.assertEqual(set(Attendance.objects.values_list('week_number', flat=True)), {7})
+
+        with self.assertNumQueries(4):
+            call_command('recompute_week_numbers', stdout=StringIO())
+        self.assertEqual(
+            sorted(Attendance.objects.values_list('date', 'week_number')),
+            [(date(2026, 1, 18), 1), (date(2026, 2, 3), 3), (date(2026, 8, 1), 1)],
+        )
+        self.assertEqual(TeacherAttendance.objects.get().week_number, 4)
+
+        out = StringIO()
+        call_command('recompute_week_numbers', stdout=out)
+        self.assertIn('Recomputed week numbers of 0 row(s).', out.getvalue())
+
+
+class SqliteTuningTests(TransactionTestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+    def test_new_connections_get_the_pragmas(self):
+        connection.close()
+        with connection.cursor() as cursor:
+            values = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                cursor.execute(f'PRAGMA {name}')
+                values[name] = cursor.fetchone()[0]
+        # synchronous NORMAL = 1, temp_store MEMORY = 2
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2})
+
+    @override_settings(SQLITE_WRITE_ATTEMPTS=3, SQLITE_WRITE_RETRY_BACKOFF=0)
+    def test_lock_errors_are_retried_a_bounded_number_of_times(self):
+        calls = []
+
+        @write_transaction
+        def flaky(failures):
+            calls.append(connection.in_atomic_block)
+            if len(calls) <= failures:
+                raise OperationalError('database is locked')
+            return 'saved'
+
+        self.assertEqual(flaky(2), 'saved')
+        self.assertEqual(calls, [True, True, True])
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            flaky(3)
+        self.assertEqual(len(calls), 3)
+
+        @write_transaction
+        def broken():
+            calls.append(None)
+            raise OperationalError('no such table: missing')
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            broken()
+        self.assertEqual(calls, [None])
+
+    def test_parallel_attendance_submissions_do_not_hit_locks(self):
+        day = date(2026, 2, 1)
+        rosters = []
+        for index in range(20):
+            teacher = User.objects.create_user(f'teacher_{index}')
+            Student.objects.bulk_create([
+                Student(
+                    full_name=f'طالب {index}-{number}', parent_phone=f'05{index:04d}{number:04d}', grade='4_pri',
+                    status='منتظم', teacher=teacher, student_unique_id=index * 100 + number + 1,
+                )
+                for number in range(30)
+            ])
+            rosters.append({student_id: 'حاضر' for student_id in Student.objects.filter(teacher=teacher).values_list('id', flat=True)})
+
+        def submit(statuses):
+            try:
+                save_students_attendance(statuses, day, 'الأحد', 3)
+                return None
+            except OperationalError as exc:
+                return str(exc)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            errors = [error for error in pool.map(submit, rosters) if error]
+        self.assertEqual(errors, [])
+        self.assertEqual(Attendance.objects.filter(date=day).count(), 600)
+        self.assertEqual(StudentAttendanceSummary.objects.filter(present_count=1).count(), 600)
+
+
+class CopySqliteDataTests(TransactionTestCase):
+    def setUp(self):
+        # مصدر النسخ اتصال يُضاف أثناء التشغيل، فيُسمح به لهذه الاختبارات
+        databases = type(self).databases
+        type(self).databases = databases | {SOURCE_ALIAS}
+        self.addCleanup(setattr, type(self), 'databases', databases)
+
+    def make_source(self, path):
+        register_sqlite_source(path)
+        try:
+            call_command('migrate', database=SOURCE_ALIAS, verbosity=0)
+            teacher = User.objects.db_manager(SOURCE_ALIAS).create_user('source_teacher')
+            Student.objects.using(SOURCE_ALIAS).bulk_create([
+                Student(
+                    id=100 + index, full_name=f'طالب {index}', parent_phone=f'05{index:08d}', grade='4_pri',
+                    status='منتظم', teacher=teacher, student_unique_id=index + 1,
+                )
+                for index in range(25)
+            ])
+            Attendance.objects.using(SOURCE_ALIAS).bulk_create([
+                Attendance(student_id=100 + index, date=date(2026, 2, 1), weekday='الأحد', week_number=3, status='حاضر')
+                for index in range(25)
+            ])
+        finally:
+            unregister_sqlite_source()
+
+    def test_copy_replaces_target_rows_and_resets_sequences(self):
+        make_student(index=900)
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'source.sqlite3'
+            self.make_source(path)
+            out = StringIO()
+            call_command('copy_sqlite_data', str(path), '--noinput', '--chunk-size', '10', stdout=out)
+
+        self.assertIn('Copied', out.getvalue())
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['source_teacher'])
+        self.assertEqual(
+            list(Student.objects.order_by('id').values_list('id', 'student_unique_id'))[:2],
+            [(100, 1), (101, 2)],
+        )
+        self.assertEqual(Student.objects.count(), 25)
+        self.assertEqual(Attendance.objects.filter(student__teacher__username='source_teacher').count(), 25)
+        self.assertTrue(Role.objects.exists())
+        self.assertGreater(make_student(index=901).id, 124)
+
+    def test_source_with_an_older_schema_is_refused(self):
+        make_student(index=900)
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'source.sqlite3'
+            register_sqlite_source(path)
+            try:
+                call_command('migrate', database=SOURCE_ALIAS, verbosity=0)
+                call_command('migrate', 'quran_center', '0027', database=SOURCE_ALIAS, verbosity=0)
+            finally:
+                unregister_sqlite_source()
+            with self.assertRaisesMessage(CommandError, 'quran_center.0028_academic_calendar_updated_at'):
+                call_command('copy_sqlite_data', str(path), '--noinput')
+        self.assertEqual(Student.objects.count(), 1)
+
+    def test_missing_source_is_an_error(self):
+        with self.assertRaises(CommandError):
+            call_command('copy_sqlite_data', '/nonexistent/db.sqlite3', '--noinput')
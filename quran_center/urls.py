@@ -27,8 +27,14 @@ urlpatterns = [
     path('preparer-attendance/take/', views.preparer_take_attendance, name='preparer_take_attendance'),
     path('preparer-attendance/students/', views.preparer_take_students_attendance, name='preparer_take_students_attendance'),
     path('preparer-absent-contacts/', views.preparer_absent_contacts, name='preparer_absent_contacts'),
+    path('sms-batches/<str:batch_id>/progress/', views.sms_batch_progress, name='sms_batch_progress'),
+    path('sms-broadcast/', views.sms_broadcast, name='sms_broadcast'),
+    path('sms/delivery-reports/', views.sms_delivery_webhook, name='sms_delivery_webhook'),
+    path('sms-delivery-report/', views.sms_delivery_report, name='sms_delivery_report'),
+    path('attendance-register/', views.attendance_register_export, name='attendance_register_export'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('admin-statistics/', views.admin_statistics, name='admin_statistics'),
+    path('sms-providers/', views.sms_provider_status, name='sms_provider_status'),
     path('login/', views.TeacherLoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='welcome'), name='logout'),
 ]
\ No newline at end of file
@@ -1,21 +1,40 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.core.paginator import Paginator
 from django.conf import settings
 from .forms import StudentRegistrationForm, StudentBulkUploadForm
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.views import LoginView
-from .models import Student, Attendance, TeacherAttendance, StageSupervisor, AcademicCalendar, ExamNomination, UserRole, TeacherPlanPreference, SmsTemplateSetting
+from django.views.decorators.csrf import csrf_exempt
+from .models import Student, Attendance, TeacherAttendance, StageSupervisor, AcademicCalendar, ExamNomination, UserRole, TeacherPlanPreference, SmsTemplateSetting, StudentAttendanceSummary, SmsDeliveryReport
+from .roles import user_has_role
+from .center_stats import get_admin_statistics
+from .attendance_records import save_students_attendance, save_teachers_attendance
+from .exports import csv_streaming_response, xlsx_file_response
+from .attendance_register import get_term_range, iter_register_rows, register_dates, register_headers
+from .student_import import SheetReadError, import_students, iter_excel_sheet_rows
+from .sms import normalize_saudi_phone, provider_status
+from .sms_outbox import already_sent_counts, batch_progress, enqueue_once
+from .sms_receipts import apply_delivery_reports, buffer_delivery_reports, delivery_rates
+from .parent_inquiry import get_family_report
+from .sms_broadcast import broadcast_filters, broadcast_template_errors, count_recipient_phones, invalid_broadcast_filters, queue_broadcast, render_broadcast
+from .sms_templates import coalesce_households, compile_template, estimate_batch, get_arabic_weekday_name, unknown_template_tokens
+from .attendance_stats import (
+    annotate_absences_in_range,
+    build_student_attendance_stats,
+    find_at_risk_students,
+    get_absence_risk_threshold,
+    get_student_summary,
+    teacher_roll_call,
+)
 from django.utils import timezone
 from django.contrib.auth.models import User
-from django.db.models import Count, Q, Max
+from django.db.models import Count, Q
 from datetime import datetime, date, timedelta
-from openpyxl import Workbook, load_workbook
-from uuid import uuid4
-import json
-from urllib import request as urlrequest
-from urllib.error import HTTPError, URLError
 from urllib.parse import quote, unquote
+import hmac
+import json
 
 
 class TeacherLoginView(LoginView):
@@ -74,171 +93,26 @@ def is_stage_supervisor(user):
     return hasattr(user, 'stage_supervisor') or user.is_superuser or user_has_role(user, 'supervisor')
 
 
-def user_has_role(user, role_code):
-    """تحقق من العضوية"""
-    if not user.is_authenticated:
-        return False
-    if user.is_superuser:
-        return True
-    return UserRole.objects.filter(user=user, role__code=role_code).exists()
-
-
-ARABIC_WEEKDAY_NAMES = {
-    0: 'الاثنين',
-    1: 'الثلاثاء',
-    2: 'الأربعاء',
-    3: 'الخميس',
-    4: 'الجمعة',
-    5: 'السبت',
-    6: 'الأحد',
-}
-
-
-def get_arabic_weekday_name(target_date):
-    return ARABIC_WEEKDAY_NAMES.get(target_date.weekday(), 'الأحد')
-
-
-def normalize_saudi_phone(phone):
-    phone = phone or ''
-    digits = ''.join([ch for ch in phone if ch.isdigit()])
-    if digits.startswith('966'):
-        return digits
-    if digits.startswith('0'):
-        return '966' + digits[1:]
-    if digits.startswith('5'):
-        return '966' + digits
-    return digits
-
-
-def normalize_excel_value(value):
-    if value is None:
-        return ''
-    return str(value).strip()
-
-
-def normalize_arabic_text(value):
-    text = normalize_excel_value(value)
-    replacements = {
-        'أ': 'ا',
-        'إ': 'ا',
-        'آ': 'ا',
-        'ى': 'ي',
-        'ة': 'ه',
-    }
-    for old_char, new_char in replacements.items():
-        text = text.replace(old_char, new_char)
-    return ' '.join(text.split()).lower()
-
-
-def map_grade_from_excel(raw_grade):
-    text_value = normalize_excel_value(raw_grade)
-    if not text_value:
-        return ''
-
-    # Accept internal code directly (e.g. 3_pri).
-    valid_codes = {choice[0] for choice in Student.GRADE_CHOICES}
-    if text_value in valid_codes:
-        return text_value
-
-    normalized_text = normalize_arabic_text(text_value)
-
-    # Values that mean "not selected yet" are accepted as empty grade.
-    empty_markers = {
-        normalize_arabic_text('لم يتم التحديد بعد'),
-        normalize_arabic_text('غير محدد'),
-        normalize_arabic_text('غير محدده'),
-        normalize_arabic_text('لا يوجد'),
-    }
-    if normalized_text in empty_markers:
-        return ''
-
-    # Accept official labels and common writing variants.
-    label_map = {
-        normalize_arabic_text('أول ابتدائي'): '1_pri',
-        normalize_arabic_text('اول ابتدائي'): '1_pri',
-        normalize_arabic_text('اولى ابتدائي'): '1_pri',
-        normalize_arabic_text('اولي ابتدائي'): '1_pri',
-        normalize_arabic_text('ثاني ابتدائي'): '2_pri',
-        normalize_arabic_text('ثانيه ابتدائي'): '2_pri',
-        normalize_arabic_text('ثالث ابتدائي'): '3_pri',
-        normalize_arabic_text('ثالثه ابتدائي'): '3_pri',
-        normalize_arabic_text('رابع ابتدائي'): '4_pri',
-        normalize_arabic_text('رابعه ابتدائي'): '4_pri',
-        normalize_arabic_text('خامس ابتدائي'): '5_pri',
-        normalize_arabic_text('خامسه ابتدائي'): '5_pri',
-        normalize_arabic_text('سادس ابتدائي'): '6_pri',
-        normalize_arabic_text('سادسه ابتدائي'): '6_pri',
-        normalize_arabic_text('أول متوسط'): '1_med',
-        normalize_arabic_text('اول متوسط'): '1_med',
-        normalize_arabic_text('اولى متوسط'): '1_med',
-        normalize_arabic_text('اولي متوسط'): '1_med',
-        normalize_arabic_text('ثاني متوسط'): '2_med',
-        normalize_arabic_text('ثالث متوسط'): '3_med',
-        normalize_arabic_text('أول ثانوي'): '1_sec',
-        normalize_arabic_text('اول ثانوي'): '1_sec',
-        normalize_arabic_text('ثاني ثانوي'): '2_sec',
-        normalize_arabic_text('ثالث ثانوي'): '3_sec',
-        normalize_arabic_text('جامعي'): 'uni',
-    }
-
-    return label_map.get(normalized_text, '')
-
-
-def parse_excel_birth_date(value):
-    if value in (None, ''):
-        return ''
+STAGE_STUDENTS_PER_PAGE = 50
 
-    if isinstance(value, datetime):
-        return value.strftime('%Y-%m-%d')
 
-    if isinstance(value, date):
-        return value.isoformat()
-
-    if isinstance(value, (int, float)):
-        try:
-            base_date = datetime(1899, 12, 30)
-            parsed = base_date + timedelta(days=float(value))
-            return parsed.strftime('%Y-%m-%d')
-        except Exception:
-            return str(value)
-
-    text = str(value).strip()
-    digit_map = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
-    text = text.translate(digit_map)
-    return text
-
-
-def read_excel_sheet_as_dicts(uploaded_file):
-    workbook = load_workbook(uploaded_file, data_only=True)
-    sheet = workbook.active
-    rows = list(sheet.iter_rows(values_only=True))
-    if not rows:
-        return []
-
-    headers = [normalize_excel_value(item) for item in rows[0]]
-    data_rows = []
-
-    for row_idx, row_values in enumerate(rows[1:], start=2):
-        row_data = {}
-        for col_idx, header in enumerate(headers):
-            if not header:
-                continue
-            row_data[header] = row_values[col_idx] if col_idx < len(row_values) else None
-        data_rows.append({'excel_row': row_idx, 'data': row_data})
-
-    return data_rows
-
-
-def build_status_export_rows(target_date, status_code):
-    attendances = Attendance.objects.filter(date=target_date, status=status_code).select_related('student')
-    rows = []
+def iter_status_export_rows(target_date, status_code):
+    """Rows for one status on one day, streamed from a single joined query."""
+    attendances = (
+        Attendance.objects.filter(date=target_date, status=status_code)
+        .select_related('student__teacher__teacher_profile', 'student__attendance_summary')
+        .order_by('student__full_name', 'student_id')
+    )
+    summary_field = StudentAttendanceSummary.STATUS_FIELDS[status_code]
+    today_day_name = get_arabic_weekday_name(target_date)
 
-    for attendance in attendances:
+    for attendance in attendances.iterator(chunk_size=500):
         student = attendance.student
         teacher = student.teacher
         full_name = student.full_name or ''
         first_name = full_name.split()[0] if full_name.split() else ''
-        total_days = Attendance.objects.filter(student=student, status=status_code).count()
+        summary = get_student_summary(student)
+        total_days = getattr(summary, summary_field) if summary else 0
         teacher_name = ''
         teacher_phone = ''
 
@@ -247,7 +121,8 @@ def build_status_export_rows(target_date, status_code):
             profile = getattr(teacher, 'teacher_profile', None)
             teacher_phone = normalize_saudi_phone(getattr(profile, 'phone', '')) if profile else ''
 
-        rows.append({
+        yield {
+            'student_id': student.id,
             'phone_number': normalize_saudi_phone(student.parent_phone),
             'first_name': first_name,
             'full_name': full_name,
@@ -255,159 +130,53 @@ def build_status_export_rows(target_date, status_code):
             'teacher_phone': teacher_phone,
             'total_days': total_days,
             'today_date': target_date,
-            'today_day_name': get_arabic_weekday_name(target_date),
-        })
+            'today_day_name': today_day_name,
+        }
 
-    return rows
 
+def build_status_export_rows(target_date, status_code):
+    return list(iter_status_export_rows(target_date, status_code))
 
-def export_status_rows_to_excel(rows, status_label, target_date):
-    workbook = Workbook()
-    worksheet = workbook.active
-    worksheet.title = status_label
-    worksheet.sheet_view.rightToLeft = True
 
+def export_status_rows_to_excel(rows, status_label, target_date):
     headers = ['رقم الجوال', 'الاسم الأول', 'الاسم الكامل', f'إجمالي أيام {status_label}', 'تاريخ اليوم', 'اسم اليوم']
-    worksheet.append(headers)
-
-    for row in rows:
-        worksheet.append([
+    sheet_rows = (
+        [
             row['phone_number'],
             row['first_name'],
             row['full_name'],
             row['total_days'],
             row['today_date'].strftime('%Y-%m-%d'),
             row['today_day_name'],
-        ])
-
-    filename = f'preparer_contacts_{status_label}_{target_date.strftime("%Y-%m-%d")}.xlsx'
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        ]
+        for row in rows
     )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    workbook.save(response)
-    return response
-
-
-def render_message_template(template_text, row_data):
-    """Simple token renderer for templates like: Hello {{{first_name}}}."""
-    if not template_text:
-        return ''
-
-    placeholders = {
-        'first_name': row_data.get('first_name', ''),
-        'full_name': row_data.get('full_name', ''),
-        'phone_number': row_data.get('phone_number', ''),
-        'teacher_name': row_data.get('teacher_name', ''),
-        'teacher_phone': row_data.get('teacher_phone', ''),
-        'total_days': row_data.get('total_days', ''),
-        'today_date': row_data.get('today_date', ''),
-        'today_day_name': row_data.get('today_day_name', ''),
-        # Arabic aliases for template variables.
-        'الاسم_الأول': row_data.get('first_name', ''),
-        'الاسم_الكامل': row_data.get('full_name', ''),
-        'رقم_الجوال': row_data.get('phone_number', ''),
-        'اسم_المعلم': row_data.get('teacher_name', ''),
-        'جوال_المعلم': row_data.get('teacher_phone', ''),
-        'رقم_جوال_المعلم': row_data.get('teacher_phone', ''),
-        'المجموع': row_data.get('total_days', ''),
-        'التاريخ': row_data.get('today_date', ''),
-        'اليوم': row_data.get('today_day_name', ''),
-    }
-
-    rendered = template_text
-    for key, value in placeholders.items():
-        rendered = rendered.replace(f'{{{{{{{key}}}}}}}', str(value or ''))
-    return rendered.strip()
-
-
-def send_sms_via_api(phone_number, message_text):
-    """Send one SMS using a configurable JSON API endpoint."""
-    api_url = getattr(settings, 'SMS_API_URL', '').strip()
-    api_key = getattr(settings, 'SMS_API_KEY', '').strip()
-
-    if not api_url:
-        return False, 'SMS API URL is not configured.'
-    if not api_key:
-        return False, 'SMS API key is not configured.'
-
-    phone_field = getattr(settings, 'SMS_PHONE_FIELD', 'to')
-    message_field = getattr(settings, 'SMS_MESSAGE_FIELD', 'message')
-    sender_field = getattr(settings, 'SMS_SENDER_FIELD', 'sender')
-    sender_id = getattr(settings, 'SMS_SENDER_ID', '').strip()
-
-    phone_is_array = bool(getattr(settings, 'SMS_PHONE_IS_ARRAY', False))
+    filename = f'preparer_contacts_{status_label}_{target_date.strftime("%Y-%m-%d")}.xlsx'
+    return xlsx_file_response(filename, [(status_label, headers, sheet_rows)])
 
-    payload = {
-        phone_field: [phone_number] if phone_is_array else phone_number,
-        message_field: message_text,
-    }
 
-    if sender_id:
-        payload[sender_field] = sender_id
-    elif sender_field == 'src':
-        return False, 'SMS_SENDER_ID is not configured (required field: src).'
-
-    auth_header = getattr(settings, 'SMS_AUTH_HEADER', 'Authorization')
-    auth_scheme = getattr(settings, 'SMS_AUTH_SCHEME', 'Bearer').strip()
-    auth_value = f'{auth_scheme} {api_key}' if auth_scheme else api_key
-
-    body = json.dumps(payload).encode('utf-8')
-    req = urlrequest.Request(
-        api_url,
-        data=body,
-        headers={
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            auth_header: auth_value,
-        },
-        method='POST',
-    )
+def section_message_rows(target_date, status_code):
+    """Rows to message for one status; siblings sharing a parent phone are merged when SMS_COALESCE_HOUSEHOLDS is on."""
+    rows = iter_status_export_rows(target_date, status_code)
+    if getattr(settings, 'SMS_COALESCE_HOUSEHOLDS', True):
+        return coalesce_households(rows)
+    return rows
 
-    try:
-        timeout = int(getattr(settings, 'SMS_API_TIMEOUT', 15))
-        with urlrequest.urlopen(req, timeout=timeout) as response:
-            status_code = getattr(response, 'status', 200)
-            return 200 <= status_code < 300, f'HTTP {status_code}'
-    except HTTPError as exc:
-        return False, f'HTTP {exc.code}'
-    except URLError as exc:
-        return False, f'URL error: {exc.reason}'
-    except Exception as exc:
-        return False, str(exc)
-
-
-def send_batch_messages(rows, template_text):
-    """Send templated messages to each row phone and return a summary."""
-    success_count = 0
-    failed_count = 0
-    failures = []
 
+def build_outbox_messages(rows, template_text):
+    """Render each row's message; rows that cannot be sent carry an ``error``."""
+    template = compile_template(template_text or '')
     for row in rows:
         phone_number = row.get('phone_number')
+        message = {'phone': phone_number, 'message': '', 'student_id': row.get('student_id'), 'error': None}
         if not phone_number:
-            failed_count += 1
-            failures.append('رقم هاتف فارغ')
-            continue
-
-        message_text = render_message_template(template_text, row)
-        if not message_text:
-            failed_count += 1
-            failures.append(f'{phone_number}: الرسالة فارغة')
-            continue
-
-        ok, info = send_sms_via_api(phone_number, message_text)
-        if ok:
-            success_count += 1
+            message['error'] = 'رقم هاتف فارغ'
         else:
-            failed_count += 1
-            failures.append(f'{phone_number}: {info}')
+            message['message'] = template.render(row)
+            if not message['message']:
+                message['error'] = 'الرسالة فارغة'
+        yield message
 
-    return {
-        'success_count': success_count,
-        'failed_count': failed_count,
-        'failures': failures[:5],
-    }
 
 @login_required
 def pending_students(request):
@@ -490,18 +259,21 @@ def stage_students_data(request):
     if start_date and end_date and start_date > end_date:
         start_date, end_date = end_date, start_date
 
-    # نحتاج قائمة فعلية لإضافة العد ثم الترتيب حسب الأعلى غياباً
-    students = list(students.select_related('teacher').order_by('teacher__username', 'full_name'))
+    # عدّ الغياب والترتيب من الأكثر غياباً يتمان في قاعدة البيانات
+    students = annotate_absences_in_range(students, start_date, end_date).select_related('teacher').order_by(
+        '-absent_count_in_range', 'full_name', 'id'
+    )
 
-    for student in students:
-        attendance_qs = Attendance.objects.filter(student=student, status='غائب')
-        if start_date:
-            attendance_qs = attendance_qs.filter(date__gte=start_date)
-        if end_date:
-            attendance_qs = attendance_qs.filter(date__lte=end_date)
-        student.absent_count_in_range = attendance_qs.count()
-
-    students.sort(key=lambda s: (-getattr(s, 'absent_count_in_range', 0), s.full_name or ''))
+    filter_query = []
+    if start_date:
+        filter_query.append(f"start_date={start_date.strftime('%Y-%m-%d')}")
+    if end_date:
+        filter_query.append(f"end_date={end_date.strftime('%Y-%m-%d')}")
+    filter_query = '&'.join(filter_query)
+
+    export_format = request.GET.get('export')
+    if request.method == 'GET' and export_format in {'csv', 'xlsx'}:
+        return export_stage_students(students, export_format, start_date, end_date)
     
     # جلب جميع المعلمين لقائمة التعيين
     teachers = User.objects.filter(
@@ -524,11 +296,10 @@ def stage_students_data(request):
         except:
             pass
 
-        query = []
-        if start_date:
-            query.append(f"start_date={start_date.strftime('%Y-%m-%d')}")
-        if end_date:
-            query.append(f"end_date={end_date.strftime('%Y-%m-%d')}")
+        query = [filter_query] if filter_query else []
+        page_number = request.POST.get('page') or request.GET.get('page')
+        if page_number:
+            query.append(f"page={page_number}")
 
         if query:
             return redirect(f"{reverse('stage_students_data')}?{'&'.join(query)}")
@@ -538,9 +309,13 @@ def stage_students_data(request):
     current_stage = None
     if hasattr(request.user, 'stage_supervisor'):
         current_stage = request.user.stage_supervisor.stage
+
+    page_obj = Paginator(students, STAGE_STUDENTS_PER_PAGE).get_page(request.GET.get('page'))
     
     return render(request, 'stage_students_data.html', {
-        'students': students,
+        'students': page_obj,
+        'page_obj': page_obj,
+        'filter_query': filter_query,
         'teachers': teachers,
         'current_stage': current_stage,
         'start_date': start_date,
@@ -548,6 +323,29 @@ def stage_students_data(request):
         'today': today,
     })
 
+
+def export_stage_students(students, export_format, start_date=None, end_date=None):
+    """تصدير طلاب المرحلة بنفس ترتيب الصفحة (CSV أو Excel) دون تحميلهم كلهم في الذاكرة"""
+    headers = ['اسم الطالب', 'المعلم', 'جوال ولي الأمر', 'جوال الطالب', 'الحي', 'آخر جزء', 'عدد الغياب']
+
+    def rows():
+        for student in students.iterator(chunk_size=500):
+            yield [
+                student.full_name,
+                student.teacher.username if student.teacher else '',
+                student.parent_phone or '',
+                student.student_phone or '',
+                student.neighborhood or '',
+                student.get_last_tested_part_display(),
+                student.absent_count_in_range,
+            ]
+
+    range_label = '_'.join(item.strftime('%Y-%m-%d') for item in (start_date, end_date) if item) or 'all'
+    filename = f'stage_students_{range_label}.{export_format}'
+    if export_format == 'csv':
+        return csv_streaming_response(filename, headers, rows())
+    return xlsx_file_response(filename, [('طلاب المرحلة', headers, rows())])
+
 @login_required
 def take_attendance(request):
     """التحضير اليومي للمعلم"""
@@ -587,18 +385,12 @@ def take_attendance(request):
         selected_weekday = weekday_map.get(posted_date.weekday(), 'الأحد')
         selected_week = AcademicCalendar.get_week_from_date(posted_date)
         
-        for student in students:
-            status = request.POST.get(f'status_{student.id}')
-            if status:
-                Attendance.objects.update_or_create(
-                    student=student,
-                    date=posted_date,
-                    defaults={
-                        'status': status,
-                        'weekday': selected_weekday,
-                        'week_number': selected_week
-                    }
-                )
+        statuses = {
+            student.id: request.POST.get(f'status_{student.id}')
+            for student in students
+            if request.POST.get(f'status_{student.id}')
+        }
+        save_students_attendance(statuses, posted_date, selected_weekday, selected_week)
         # بدل redirect، نعيد تحميل البيانات وإظهار رسالة نجاح
         success = True
         selected_date = posted_date
@@ -645,21 +437,8 @@ def parent_inquiry(request):
         if not parent_phone:
             error_message = "يرجى إدخال رقم الجوال"
         else:
-            students = Student.objects.filter(parent_phone=parent_phone).select_related('teacher').order_by('full_name')
-
-            for student in students:
-                attendances = Attendance.objects.filter(student=student).order_by('-date')
-                student.present_count = attendances.filter(status='حاضر').count()
-                student.absent_count = attendances.filter(status='غائب').count()
-                student.absent_excused_count = attendances.filter(status='غياب بعذر').count()
-                student.excused_count = attendances.filter(status='مستأذن').count()
-                student.late_count = attendances.filter(status='متأخر').count()
-                student.recent_attendance = attendances[:10]
-
-                teacher_phone = None
-                if student.teacher and hasattr(student.teacher, 'teacher_profile'):
-                    teacher_phone = student.teacher.teacher_profile.phone
-                student.teacher_phone = teacher_phone
+            # بحث بالرقم الموحد المفهرس، والنتيجة مخزنة مؤقتاً حتى يتغير حضور الأبناء
+            students = get_family_report(parent_phone)
 
             return render(
                 request,
@@ -706,76 +485,25 @@ def bulk_students_upload(request):
 
     if request.method == 'POST' and form.is_valid():
         uploaded_file = form.cleaned_data['excel_file']
-        last_part_choices = {choice[0] for choice in Student._meta.get_field('last_tested_part').choices}
-        status_default = Student._meta.get_field('status').default
-
-        created_count = 0
-        skipped_count = 0
-        row_errors = []
 
+        read_error = 'تعذر قراءة الملف. تأكد أن الملف بصيغة Excel صحيحة (.xlsx).'
         try:
-            rows = read_excel_sheet_as_dicts(uploaded_file)
+            rows = iter_excel_sheet_rows(uploaded_file)
         except Exception:
-            form.add_error('excel_file', 'تعذر قراءة الملف. تأكد أن الملف بصيغة Excel صحيحة (.xlsx).')
+            form.add_error('excel_file', read_error)
             rows = []
 
-        for row in rows:
-            row_number = row['excel_row']
-            data = row['data']
-
-            full_name = normalize_excel_value(data.get('full_name'))
-            identity_number = normalize_excel_value(data.get('identity_number'))
-
-            if not full_name and not identity_number:
-                skipped_count += 1
-                continue
-
-            if not identity_number:
-                identity_number = f'GEN_{uuid4().hex[:12]}'
-
-            if Student.objects.filter(identity_number=identity_number).exists():
-                skipped_count += 1
-                row_errors.append(f'السطر {row_number}: رقم هوية الطالب {identity_number} موجود مسبقاً.')
-                continue
-
-            grade_input = data.get('grade')
-            grade = map_grade_from_excel(grade_input)
-            if normalize_excel_value(grade_input) and not grade:
-                skipped_count += 1
-                row_errors.append(f'السطر {row_number}: الصف الدراسي "{normalize_excel_value(grade_input)}" غير صحيح.')
-                continue
-
-            last_tested_part = normalize_excel_value(data.get('last_tested_part')) or '0'
-            if last_tested_part not in last_part_choices:
-                last_tested_part = '0'
-
-            birth_date = parse_excel_birth_date(data.get('birth_date'))
-
-            Student.objects.create(
-                full_name=full_name,
-                student_phone=normalize_excel_value(data.get('student_phone')),
-                parent_phone=normalize_excel_value(data.get('parent_phone')),
-                identity_number=identity_number,
-                jamiaa_id=normalize_excel_value(data.get('jamiaa_id')),
-                parent_identity=normalize_excel_value(data.get('parent_identity')),
-                grade=grade,
-                birth_date=birth_date,
-                last_tested_part=last_tested_part,
-                previous_center=normalize_excel_value(data.get('previous_center')),
-                neighborhood=normalize_excel_value(data.get('neighborhood')),
-                status=status_default,
-            )
-            created_count += 1
+        # التحقق من التكرار والحفظ على دفعات داخل معاملة واحدة؛ الأسطر تُقرأ أثناء الحفظ،
+        # فخطأ القراءة في منتصف الملف يلغي المعاملة كلها
+        try:
+            result = import_students(rows)
+        except SheetReadError:
+            form.add_error('excel_file', read_error)
+            result = None
 
-        if created_count > 0:
+        if result and result['created_count'] > 0:
             form = StudentBulkUploadForm()
 
-        result = {
-            'created_count': created_count,
-            'skipped_count': skipped_count,
-            'row_errors': row_errors,
-        }
-
     return render(request, 'bulk_students_upload.html', {
         'form': form,
         'result': result,
@@ -805,44 +533,10 @@ def teacher_dashboard(request):
     if start_date and end_date and start_date > end_date:
         start_date, end_date = end_date, start_date
     
-    # إحصائيات عامة
-    total_students = students.count()
-    
-    stats_rows = []
-    for student in students:
-        attendances = Attendance.objects.filter(student=student)
-        if start_date:
-            attendances = attendances.filter(date__gte=start_date)
-        if end_date:
-            attendances = attendances.filter(date__lte=end_date)
-        
-        total_days = attendances.count()
-        present = attendances.filter(status='حاضر').count()
-        absent = attendances.filter(status='غائب').count()
-        absent_excused = attendances.filter(status='غياب بعذر').count()
-        excused = attendances.filter(status='مستأذن').count()
-        late = attendances.filter(status='متأخر').count()
-        
-        # عدد الأيام غير الحاضر (غياب + استئذان + تأخير)
-        non_present_count = absent + absent_excused + excused + late
-        
-        # جميع الحضور مع الحالة
-        all_attendance = list(attendances.values('date', 'status').order_by('-date'))
-        
-        stats_rows.append((student.id, {
-            'student': student,
-            'total_days': total_days,
-            'present': present,
-            'absent': absent,
-            'absent_excused': absent_excused,
-            'excused': excused,
-            'late': late,
-            'non_present_count': non_present_count,
-            'all_attendance': all_attendance
-        }))
-
-    stats_rows.sort(key=lambda item: (-item[1]['absent'], item[1]['student'].full_name or ''))
-    attendance_stats = {student_id: stats for student_id, stats in stats_rows}
+    # إحصائيات الحضور لكل الطلاب بعدد ثابت من الاستعلامات
+    stats_rows = build_student_attendance_stats(students, start_date, end_date)
+    total_students = len(stats_rows)
+    attendance_stats = {stats['student'].id: stats for stats in stats_rows}
     
     context = {
         'total_students': total_students,
@@ -1135,44 +829,23 @@ def association_results(request):
 
 @login_required
 def preparer_attendance_summary(request):
-    """متابعة تحضير المعلمين لليوم"""
+    """متابعة تحضير المعلمين ليوم محدد (اليوم افتراضياً)"""
     if not user_has_role(request.user, 'preparer'):
         return redirect('home')
 
-    target_date = timezone.now().date()
-    teachers = User.objects.filter(student__isnull=False).distinct().order_by('username')
-    pending = []
-    completed = []
-
-    for teacher in teachers:
-        student_count = Student.objects.filter(teacher=teacher, status='منتظم').count()
-        if student_count == 0:
-            continue
-        attendance_qs = Attendance.objects.filter(student__teacher=teacher, date=target_date)
-        recorded_count = attendance_qs.count()
-        display_name = teacher.get_full_name() or teacher.username
-
-        if attendance_qs.count() >= student_count:
-            last_time = attendance_qs.aggregate(last_time=Max('created_at'))['last_time']
-            completed.append({
-                'teacher': teacher,
-                'display_name': display_name,
-                'student_count': student_count,
-                'recorded_count': recorded_count,
-                'last_time': last_time,
-            })
-        else:
-            pending.append({
-                'teacher': teacher,
-                'display_name': display_name,
-                'student_count': student_count,
-                'recorded_count': recorded_count,
-            })
+    today = timezone.now().date()
+    try:
+        target_date = datetime.strptime(request.GET.get('date', ''), "%Y-%m-%d").date()
+    except ValueError:
+        target_date = today
 
+    # استعلامان مجمّعان لكل المعلمين: عدد الطلاب المنتظمين، وعدد سجلات اليوم وآخر وقت تحضير
+    board = teacher_roll_call(target_date)
     context = {
         'target_date': target_date,
-        'pending': pending,
-        'completed': completed,
+        'today': today,
+        'pending': board['pending'],
+        'completed': board['completed'],
     }
     return render(request, 'preparer_attendance_summary.html', context)
 
@@ -1214,18 +887,12 @@ def preparer_take_attendance(request):
         selected_weekday = weekday_map.get(posted_date.weekday(), 'الأحد')
         selected_week = AcademicCalendar.get_week_from_date(posted_date)
 
-        for teacher in teachers:
-            status = request.POST.get(f'status_{teacher.id}')
-            if status:
-                TeacherAttendance.objects.update_or_create(
-                    teacher=teacher,
-                    date=posted_date,
-                    defaults={
-                        'status': status,
-                        'weekday': selected_weekday,
-                        'week_number': selected_week
-                    }
-                )
+        statuses = {
+            teacher.id: request.POST.get(f'status_{teacher.id}')
+            for teacher in teachers
+            if request.POST.get(f'status_{teacher.id}')
+        }
+        save_teachers_attendance(statuses, posted_date, selected_weekday, selected_week)
 
         success = True
         selected_date = posted_date
@@ -1312,18 +979,12 @@ def preparer_take_students_attendance(request):
         if not selected_teacher:
             error_message = 'يرجى اختيار المعلم أولاً.'
         else:
-            for student in students:
-                status = request.POST.get(f'status_{student.id}')
-                if status:
-                    Attendance.objects.update_or_create(
-                        student=student,
-                        date=posted_date,
-                        defaults={
-                            'status': status,
-                            'weekday': selected_weekday,
-                            'week_number': selected_week,
-                        }
-                    )
+            statuses = {
+                student.id: request.POST.get(f'status_{student.id}')
+                for student in students
+                if request.POST.get(f'status_{student.id}')
+            }
+            save_students_attendance(statuses, posted_date, selected_weekday, selected_week)
 
             success = True
             selected_date = posted_date
@@ -1407,6 +1068,7 @@ def preparer_absent_contacts(request):
             current_templates[key] = value
 
     template_save_feedback = None
+    template_errors = []
     if request.method == 'POST':
         reset_student_id = request.POST.get('reset_student_id')
         if reset_student_id:
@@ -1430,6 +1092,13 @@ def preparer_absent_contacts(request):
                 if not template_text:
                     template_text = default_templates[section]
 
+                unknown_tokens = unknown_template_tokens(template_text)
+                if unknown_tokens:
+                    template_errors.append(
+                        f"قالب {dict(SmsTemplateSetting.SECTION_CHOICES)[section]} لم يُحفظ، متغيرات غير معروفة: {' '.join(unknown_tokens)}"
+                    )
+                    continue
+
                 SmsTemplateSetting.objects.update_or_create(
                     user=request.user,
                     section=section,
@@ -1438,13 +1107,51 @@ def preparer_absent_contacts(request):
                 current_templates[section] = template_text
                 saved_count += 1
 
-            template_save_feedback = f'تم حفظ القالب بنجاح ({saved_count}).'
+            if saved_count:
+                template_save_feedback = f'تم حفظ القالب بنجاح ({saved_count}).'
+
+    if download_type in {'absent', 'absent_excused', 'late', 'excused'}:
+        status_map = {
+            'absent': ('غائب', 'غياب'),
+            'absent_excused': ('غياب بعذر', 'غياب_بعذر'),
+            'late': ('متأخر', 'تأخر'),
+            'excused': ('مستأذن', 'انصراف'),
+        }
+        status_code, status_label = status_map[download_type]
+        return export_status_rows_to_excel(iter_status_export_rows(target_date, status_code), status_label, target_date)
+
+    section_statuses = {
+        'absent': 'غائب',
+        'absent_excused': 'غياب بعذر',
+        'late': 'متأخر',
+        'excused': 'مستأذن',
+    }
+
+    if request.method == 'POST':
+        sms_action = request.POST.get('sms_action')
+        if sms_action in section_statuses and request.POST.get('save_templates') != '1':
+            # الرسائل تُحفظ في صندوق الإرسال ويرسلها العامل run_sms_worker في الخلفية
+            # ومن استلم نفس الرسالة لهذا اليوم يُتجاوز إلا عند طلب إعادة الإرسال صراحةً
+            rows = section_message_rows(target_date, section_statuses[sms_action])
+            queued = enqueue_once(
+                build_outbox_messages(rows, current_templates[sms_action]),
+                section=sms_action,
+                target_date=target_date,
+                template_text=current_templates[sms_action],
+                user=request.user,
+                force=request.POST.get('force_resend') == '1',
+                retry_failed=request.POST.get('retry_failed') == '1',
+            )
+            redirect_url = f"{reverse('preparer_absent_contacts')}?date={target_date}&already_sent={queued['already_sent']}&section={sms_action}"
+            if queued['batch_id']:
+                redirect_url += f"&batch={queued['batch_id']}"
+            return redirect(redirect_url)
 
     def collect_parent_phones_by_status(status_code):
-        status_attendance = Attendance.objects.filter(date=target_date, status=status_code).select_related('student')
+        parent_phones = Attendance.objects.filter(date=target_date, status=status_code).values_list('student__parent_phone', flat=True)
         phones = []
-        for attendance in status_attendance:
-            formatted = normalize_saudi_phone(attendance.student.parent_phone)
+        for parent_phone in parent_phones:
+            formatted = normalize_saudi_phone(parent_phone)
             if formatted:
                 phones.append(formatted)
 
@@ -1460,61 +1167,36 @@ def preparer_absent_contacts(request):
     late_contacts = collect_parent_phones_by_status('متأخر')
     excused_contacts = collect_parent_phones_by_status('مستأذن')
 
-    status_rows = {
-        'absent': build_status_export_rows(target_date, 'غائب'),
-        'absent_excused': build_status_export_rows(target_date, 'غياب بعذر'),
-        'late': build_status_export_rows(target_date, 'متأخر'),
-        'excused': build_status_export_rows(target_date, 'مستأذن'),
+    # تقدير عدد أجزاء الرسائل وتكلفتها قبل الإرسال: يتطلب توليد كل رسائل القسم،
+    # فيُحسب عند الطلب (?estimate=<القسم>) لقسم واحد فقط
+    contacts_by_section = {
+        'absent': absent_contacts,
+        'absent_excused': absent_excused_contacts,
+        'late': late_contacts,
+        'excused': excused_contacts,
     }
-
-    sms_feedback = None
-    if request.method == 'POST':
-        sms_action = request.POST.get('sms_action')
-        if sms_action in status_rows and request.POST.get('save_templates') != '1':
-            batch_result = send_batch_messages(status_rows[sms_action], current_templates[sms_action])
-            sms_feedback = {
-                'section': sms_action,
-                'success_count': batch_result['success_count'],
-                'failed_count': batch_result['failed_count'],
-                'failures': batch_result['failures'],
-            }
-
-    if download_type in {'absent', 'absent_excused', 'late', 'excused'}:
-        status_map = {
-            'absent': ('غائب', 'غياب'),
-            'absent_excused': ('غياب بعذر', 'غياب_بعذر'),
-            'late': ('متأخر', 'تأخر'),
-            'excused': ('مستأذن', 'انصراف'),
+    sms_estimates = {}
+    estimate_section = request.GET.get('estimate') or request.POST.get('estimate')
+    if estimate_section in section_statuses and contacts_by_section[estimate_section]['phones_count']:
+        rows = section_message_rows(target_date, section_statuses[estimate_section])
+        messages = build_outbox_messages(rows, current_templates[estimate_section])
+        sms_estimates[estimate_section] = estimate_batch(item['message'] for item in messages if not item['error'])
+
+    sms_skipped = None
+    if request.GET.get('already_sent', '').isdigit() and int(request.GET['already_sent']) > 0:
+        sms_skipped = {
+            'count': int(request.GET['already_sent']),
+            'section': dict(SmsTemplateSetting.SECTION_CHOICES).get(request.GET.get('section'), ''),
         }
-        status_code, status_label = status_map[download_type]
-        rows = build_status_export_rows(target_date, status_code)
-        return export_status_rows_to_excel(rows, status_label, target_date)
 
-    at_risk = []
-    students = Student.objects.filter(status='منتظم').order_by('full_name')
-    for student in students:
-        total_absences = Attendance.objects.filter(
-            student=student,
-            status='غائب'
-        ).count()
-
-        if student.absence_reset_at:
-            temp_count = Attendance.objects.filter(
-                student=student,
-                status='غائب',
-                created_at__date__gt=student.absence_reset_at
-            ).count()
-        else:
-            temp_count = Attendance.objects.filter(
-                student=student,
-                status='غائب'
-            ).count()
-        if temp_count >= 5:
-            at_risk.append({
-                'student': student,
-                'temp_count': temp_count,
-                'total_absences': total_absences,
-            })
+    sms_batch = None
+    batch_id = request.GET.get('batch')
+    if batch_id:
+        sms_batch = batch_progress(batch_id)
+        sms_batch['batch_id'] = batch_id
+
+    at_risk_threshold = get_absence_risk_threshold()
+    at_risk = find_at_risk_students(at_risk_threshold)
 
     context = {
         'target_date': target_date,
@@ -1530,12 +1212,190 @@ def preparer_absent_contacts(request):
         'absent_excused_sms_template': current_templates['absent_excused'],
         'late_sms_template': current_templates['late'],
         'excused_sms_template': current_templates['excused'],
-        'sms_feedback': sms_feedback,
+        'sms_batch': sms_batch,
+        'sms_skipped': sms_skipped,
+        'sms_already_sent': already_sent_counts(target_date),
         'template_save_feedback': template_save_feedback,
+        'template_errors': template_errors,
+        'sms_estimates': sms_estimates,
+        'sms_segment_cost': getattr(settings, 'SMS_SEGMENT_COST', 0),
         'at_risk': at_risk,
+        'at_risk_threshold': at_risk_threshold,
+        'register_teachers': User.objects.filter(student__status='منتظم').distinct().order_by('username'),
+        'register_stages': StageSupervisor.STAGE_CHOICES,
     }
     return render(request, 'preparer_absent_contacts.html', context)
 
+
+@login_required
+def sms_batch_progress(request, batch_id):
+    """حالة إرسال دفعة رسائل من صندوق الإرسال (تُستدعى دورياً من صفحتي أرقام الغياب والرسائل الجماعية)"""
+    if not (user_has_role(request.user, 'preparer') or is_admin(request.user)):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    return JsonResponse(batch_progress(batch_id))
+
+
+@login_required
+def sms_broadcast(request):
+    """رسالة جماعية لأولياء أمور مرحلة أو معلم أو صف أو حالة"""
+    if not (user_has_role(request.user, 'preparer') or is_admin(request.user)):
+        return redirect('home')
+
+    today = timezone.now().date()
+    data = request.POST if request.method == 'POST' else request.GET
+    filters = broadcast_filters(data)
+    if invalid_broadcast_filters(filters):
+        return redirect('sms_broadcast')
+    template_text = (data.get('message') or '').strip()
+    errors = []
+    if template_text:
+        unusable_tokens = broadcast_template_errors(template_text)
+        if unusable_tokens:
+            errors.append(f"متغيرات غير متاحة في الرسالة الجماعية: {' '.join(unusable_tokens)}")
+
+    if request.method == 'POST' and template_text and not errors:
+        # الأرقام تُقرأ باستعلام واحد وتُضاف لصندوق الإرسال على دفعات، ويرسلها العامل run_sms_worker
+        queued = queue_broadcast(
+            filters, template_text, today, user=request.user, force=request.POST.get('force_resend') == '1',
+            retry_failed=request.POST.get('retry_failed') == '1',
+        )
+        query = '&'.join(f'{name}={quote(str(value))}' for name, value in filters.items())
+        redirect_url = f"{reverse('sms_broadcast')}?{query}&already_sent={queued['already_sent']}"
+        if queued['batch_id']:
+            redirect_url += f"&batch={queued['batch_id']}"
+        return redirect(redirect_url)
+    if request.method == 'POST' and not template_text:
+        errors.append('اكتب نص الرسالة.')
+
+    recipients_count = count_recipient_phones(filters)
+    estimate = None
+    if template_text and not errors:
+        text = render_broadcast(template_text, today)
+        estimate = estimate_batch(text for _index in range(recipients_count))
+
+    sms_batch = None
+    batch_id = request.GET.get('batch')
+    if batch_id:
+        sms_batch = batch_progress(batch_id)
+        sms_batch['batch_id'] = batch_id
+
+    already_sent = request.GET.get('already_sent', '')
+    context = {
+        'filters': filters,
+        'message': template_text,
+        'errors': errors,
+        'recipients_count': recipients_count,
+        'estimate': estimate,
+        'sms_segment_cost': getattr(settings, 'SMS_SEGMENT_COST', 0),
+        'sms_batch': sms_batch,
+        'sms_skipped': int(already_sent) if already_sent.isdigit() else 0,
+        'stage_choices': StageSupervisor.STAGE_CHOICES,
+        'grade_choices': Student.GRADE_CHOICES,
+        'status_choices': Student.STATUS_CHOICES,
+        'teachers': User.objects.filter(student__isnull=False).distinct().order_by('username'),
+    }
+    return render(request, 'sms_broadcast.html', context)
+
+
+@csrf_exempt
+def sms_delivery_webhook(request):
+    """استقبال تقارير الاستلام من مزود الرسائل (تقرير واحد أو دفعة) وحفظها لتطبيقها لاحقاً"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'method not allowed'}, status=405)
+
+    expected_token = getattr(settings, 'SMS_WEBHOOK_TOKEN', '')
+    token = request.GET.get('token') or request.headers.get('X-Webhook-Token', '')
+    if not expected_token or not hmac.compare_digest(token.encode(), expected_token.encode()):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    if request.content_type == 'application/json':
+        try:
+            payload = json.loads(request.body or b'null')
+        except ValueError:
+            return JsonResponse({'error': 'invalid json'}, status=400)
+    else:
+        payload = request.POST.dict()
+
+    # الحفظ هنا إدخال واحد فقط، وتطبيقها على صندوق الإرسال يتم دفعة واحدة في العامل
+    return JsonResponse({'accepted': buffer_delivery_reports(payload)})
+
+
+@login_required
+def sms_delivery_report(request):
+    """نسبة وصول الرسائل لكل قسم خلال فترة (آخر 30 يوماً افتراضياً)"""
+    if not user_has_role(request.user, 'preparer'):
+        return redirect('home')
+
+    today = timezone.now().date()
+    try:
+        end_date = datetime.strptime(request.GET.get('end', ''), "%Y-%m-%d").date()
+    except ValueError:
+        end_date = today
+    try:
+        start_date = datetime.strptime(request.GET.get('start', ''), "%Y-%m-%d").date()
+    except ValueError:
+        start_date = end_date - timedelta(days=29)
+
+    # التقارير الواردة يطبقها العامل run_sms_worker، ويمكن تطبيقها من الصفحة بطلب صريح
+    if request.method == 'POST' and request.POST.get('apply_reports') == '1':
+        apply_delivery_reports()
+        return redirect(f"{reverse('sms_delivery_report')}?start={start_date}&end={end_date}")
+
+    context = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'rows': delivery_rates(start_date, end_date),
+        'pending_reports': SmsDeliveryReport.objects.count(),
+    }
+    return render(request, 'sms_delivery_report.html', context)
+
+
+@login_required
+def attendance_register_export(request):
+    """سجل الحضور الكامل للفصل الدراسي لمعلم أو لمرحلة بصيغة Excel"""
+    user = request.user
+    if not (user_has_role(user, 'preparer') or user_has_role(user, 'manager') or is_stage_supervisor(user)):
+        return redirect('home')
+
+    # مشرف المرحلة لا يصدّر إلا سجل مرحلته أو سجل معلم له طلاب فيها، ومن لم تُحدد مرحلته لا يصدّر شيئاً
+    restricted = hasattr(user, 'stage_supervisor') and not (
+        user.is_superuser or user_has_role(user, 'preparer') or user_has_role(user, 'manager')
+    )
+    supervised_stage = user.stage_supervisor.stage if restricted else None
+    if restricted and not supervised_stage:
+        return redirect('home')
+
+    students = Student.objects.filter(status='منتظم')
+    if restricted:
+        students = students.filter(educational_stage=supervised_stage)
+    teacher_id = request.GET.get('teacher_id', '')
+    stage = request.GET.get('stage')
+    if teacher_id:
+        if not teacher_id.isdigit():
+            return redirect('preparer_absent_contacts')
+        teacher = get_object_or_404(User, id=teacher_id)
+        if restricted and not students.filter(teacher=teacher).exists():
+            return redirect('home')
+        students = students.filter(teacher=teacher)
+        label = f'teacher_{teacher.username}'
+        title = teacher.get_full_name() or teacher.username
+    elif stage in dict(StageSupervisor.STAGE_CHOICES):
+        if restricted and stage != supervised_stage:
+            return redirect('home')
+        students = students.filter(educational_stage=stage)
+        label = f'stage_{stage}'
+        title = stage
+    else:
+        return redirect('preparer_absent_contacts')
+
+    start_date, end_date = get_term_range()
+    dates = register_dates(students, start_date, end_date)
+    rows = iter_register_rows(students, dates, start_date, end_date)
+    return xlsx_file_response(
+        f'attendance_register_{label}.xlsx',
+        [(f'سجل {title}', register_headers(dates), rows)],
+    )
+
 # 1. للمدير فقط: لا يدخل إلا من لديه صلاحيات Superuser
 def is_admin(user):
     return user.is_superuser or user_has_role(user, 'manager')
@@ -1550,123 +1410,20 @@ def admin_dashboard(request):
 @user_passes_test(is_admin)
 def admin_statistics(request):
     """صفحة الإحصائيات الشاملة للمدير"""
-    from django.db.models import Count, Q
-    
-    # الحصول على جميع المراحل الموجودة
-    STAGES = [
-        ('مبكرة', 'مبكرة'),
-        ('عليا', 'عليا'),
-        ('متوسط', 'متوسط'),
-        ('ثانوي', 'ثانوي'),
-        ('جامعي', 'جامعي'),
-    ]
-    
-    # إحصائيات عامة
-    total_students = Student.objects.filter(status='منتظم').count()
-    total_tested = ExamNomination.objects.filter(internal_passed=True).count()
-    
-    # إجمالي الغياب اليومي
     today = timezone.now().date()
-    total_absent_today = Attendance.objects.filter(date=today, status='غائب').count()
-    total_teacher_absent_today = TeacherAttendance.objects.filter(date=today, status='غائب').count()
-    
-    # إحصائيات حسب المرحلة
-    stage_stats = []
-    for stage_code, stage_name in STAGES:
-        stage_students = Student.objects.filter(status='منتظم', educational_stage=stage_code)
-        stage_tested = ExamNomination.objects.filter(
-            student__educational_stage=stage_code,
-            internal_passed=True
-        ).count()
-        
-        # الغياب اليومي في هذه المرحلة
-        stage_absent_today = Attendance.objects.filter(
-            student__educational_stage=stage_code,
-            date=today,
-            status='غائب'
-        ).count()
-        
-        if stage_students.count() > 0:
-            stage_stats.append({
-                'stage': stage_name,
-                'total_students': stage_students.count(),
-                'tested': stage_tested,
-                'absent_today': stage_absent_today,
-            })
-    
-    # إحصائيات حسب المعلم
-    teachers = User.objects.filter(
-        student__status='منتظم'
-    ).distinct().order_by('username')
-    
-    teacher_stats = []
-    for teacher in teachers:
-        teacher_students = Student.objects.filter(teacher=teacher, status='منتظم')
-        teacher_tested = ExamNomination.objects.filter(
-            teacher=teacher,
-            internal_passed=True
-        ).count()
-        
-        # الغياب اليومي عند هذا المعلم
-        teacher_absent_today = Attendance.objects.filter(
-            student__teacher=teacher,
-            date=today,
-            status='غائب'
-        ).count()
-
-        # غياب المعلم نفسه اليوم
-        teacher_self_absent_today = TeacherAttendance.objects.filter(
-            teacher=teacher,
-            date=today,
-            status='غائب'
-        ).count()
-        
-        # إحصائيات المعلم حسب المرحلة
-        teacher_stage_stats = []
-        for stage_code, stage_name in STAGES:
-            stage_students = teacher_students.filter(educational_stage=stage_code)
-            if stage_students.count() > 0:
-                stage_tested = ExamNomination.objects.filter(
-                    teacher=teacher,
-                    student__educational_stage=stage_code,
-                    internal_passed=True
-                ).count()
-                
-                stage_absent = Attendance.objects.filter(
-                    student__teacher=teacher,
-                    student__educational_stage=stage_code,
-                    date=today,
-                    status='غائب'
-                ).count()
-                
-                teacher_stage_stats.append({
-                    'stage': stage_name,
-                    'total_students': stage_students.count(),
-                    'tested': stage_tested,
-                    'absent_today': stage_absent,
-                })
-        
-        teacher_stats.append({
-            'teacher': teacher.username,
-            'total_students': teacher_students.count(),
-            'tested': teacher_tested,
-            'absent_today': teacher_absent_today,
-            'teacher_self_absent_today': teacher_self_absent_today,
-            'stage_stats': teacher_stage_stats,
-        })
-    
-    context = {
-        'total_students': total_students,
-        'total_tested': total_tested,
-        'total_absent_today': total_absent_today,
-        'total_teacher_absent_today': total_teacher_absent_today,
-        'today': today,
-        'stage_stats': stage_stats,
-        'teacher_stats': teacher_stats,
-    }
+
+    # لقطة محسوبة باستعلامات مجمّعة ومخزنة مؤقتاً حتى يتغير أي سجل مؤثر
+    context = dict(get_admin_statistics(today))
+    context['today'] = today
     
     return render(request, 'admin_statistics.html', context)
 
+@login_required
+@user_passes_test(is_admin)
+def sms_provider_status(request):
+    """حالة مزودي الرسائل: قاطع الدائرة وزمن الاستجابة لكل مزود"""
+    return render(request, 'sms_provider_status.html', {'providers': provider_status()})
+
 # 2. للمعلمين: أي مستخدم مسجل دخول (معلم أو مدير)
 @login_required
 def attendance_view(request):